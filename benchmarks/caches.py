@@ -0,0 +1,93 @@
+"""Latency and cross-worker hit rate of the local cache backends.
+
+Each backend is timed on hot lookups of small values, like a user. Then
+the keys that a forked worker wrote are read back, which only a cache
+shared across processes can serve.
+
+Run with `python -m benchmarks.caches`.
+"""
+
+import os
+import tempfile
+from collections.abc import Callable
+from pathlib import Path
+from time import perf_counter
+from typing import TYPE_CHECKING
+
+from django.core.cache.backends.base import BaseCache
+from django.core.cache.backends.filebased import FileBasedCache
+from django.core.cache.backends.locmem import LocMemCache
+from pyutilkit.term import SGRCodes, SGRString
+
+from cp_project.lib.cache import SharedMemoryCache
+
+if TYPE_CHECKING:
+    from cp_project.lib.types import JSONDict
+
+KEYS = 1000
+OPERATIONS = 20000
+VALUE = {"id": 1, "email": "benchmark@example.com", "is_active": True}
+
+
+def get_backends(directory: Path) -> dict[str, BaseCache]:
+    params: JSONDict = {"OPTIONS": {"MAX_ENTRIES": KEYS * 4}}
+    return {
+        "locmem": LocMemCache("benchmark", params),
+        "file": FileBasedCache(str(directory.joinpath("file")), params),
+        "shared memory": SharedMemoryCache(str(directory.joinpath("shm")), params),
+    }
+
+
+def time_operation(operation: Callable[[int], object]) -> float:
+    start = perf_counter()
+    for i in range(OPERATIONS):
+        operation(i % KEYS)
+    return (perf_counter() - start) / OPERATIONS
+
+
+def time_backend(cache: BaseCache) -> dict[str, float]:
+    return {
+        "set": time_operation(lambda i: cache.set(f"user:{i}", VALUE)),
+        "hit": time_operation(lambda i: cache.get(f"user:{i}")),
+        "miss": time_operation(lambda i: cache.get(f"missing:{i}")),
+    }
+
+
+def get_worker_hit_rate(cache: BaseCache) -> float:
+    """Read the keys that another worker wrote after the fork."""
+    keys = [f"worker:{i}" for i in range(KEYS)]
+    pid = os.fork()
+    if pid == 0:
+        cache.set_many(dict.fromkeys(keys, VALUE))
+        os._exit(0)
+    os.waitpid(pid, 0)
+    return len(cache.get_many(keys)) / KEYS
+
+
+def main() -> None:
+    with tempfile.TemporaryDirectory() as directory:
+        backends = get_backends(Path(directory))
+        results = {name: time_backend(cache) for name, cache in backends.items()}
+        hit_rates = {
+            name: get_worker_hit_rate(cache) for name, cache in backends.items()
+        }
+
+    SGRString(
+        f"Mean latency of {OPERATIONS} operations over {KEYS} keys:",
+        params=[SGRCodes.BOLD, SGRCodes.CYAN],
+    ).print()
+    SGRString(
+        f"  {'':<14} {'set':>10} {'hit':>10} {'miss':>10} {'other worker':>13}"
+    ).print()
+    for name, timings in results.items():
+        SGRString(
+            f"  {name:<14}"
+            f" {timings['set'] * 1e6:7.1f} µs"
+            f" {timings['hit'] * 1e6:7.1f} µs"
+            f" {timings['miss'] * 1e6:7.1f} µs"
+            f" {hit_rates[name]:12.0%}"
+        ).print()
+
+
+if __name__ == "__main__":
+    main()
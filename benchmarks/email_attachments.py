@@ -0,0 +1,64 @@
+"""Peak memory of sending a message with a 50 MB attachment.
+
+Run with `python -m benchmarks.email_attachments`.
+"""
+
+import tracemalloc
+from collections.abc import Callable
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+from django.core.mail import EmailMessage
+from pyutilkit.term import SGRCodes, SGRString
+
+from cp_project.lib.emails import FileAttachment, iter_message_chunks, split_message
+
+ATTACHMENT_SIZE = 50 * 1024 * 1024
+MIMETYPE = "application/octet-stream"
+
+
+def get_mail() -> EmailMessage:
+    return EmailMessage("Report", "See attached.", to=["jon.snow@winterfell.org"])
+
+
+def in_memory(path: Path) -> None:
+    mail = get_mail()
+    mail.attach(path.name, path.read_bytes(), MIMETYPE)
+    mail.message().as_bytes(linesep="\r\n")
+
+
+def streamed(path: Path) -> None:
+    mail = get_mail()
+    mail.attach(FileAttachment(path.name, path, MIMETYPE).to_mime(streamed=True))
+    for _chunk in iter_message_chunks(split_message(mail)):
+        pass
+
+
+def peak_memory(func: Callable[[Path], None], path: Path) -> int:
+    tracemalloc.start()
+    try:
+        func(path)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak
+
+
+def main() -> None:
+    with TemporaryDirectory() as directory:
+        path = Path(directory).joinpath("attachment.bin")
+        with path.open("wb") as file:
+            for _ in range(ATTACHMENT_SIZE // 1024**2):
+                file.write(bytes(range(256)) * 4096)
+
+        SGRString(
+            f"Peak memory for a {ATTACHMENT_SIZE // 1024**2} MB attachment:",
+            params=[SGRCodes.BOLD, SGRCodes.CYAN],
+        ).print()
+        for func in (in_memory, streamed):
+            peak = peak_memory(func, path) / 1024**2
+            SGRString(f"  {func.__name__:<10} {peak:8.1f} MB").print()
+
+
+if __name__ == "__main__":
+    main()
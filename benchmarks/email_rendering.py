@@ -0,0 +1,44 @@
+"""Emails rendered per second, one by one and in bulk.
+
+Run with `python -m benchmarks.email_rendering`.
+"""
+
+from time import perf_counter
+
+from pyutilkit.term import SGRCodes, SGRString
+
+from cp_project.accounts.models import User
+from cp_project.lib.emails import BulkRecipients
+from cp_project.notifications.emails import SignupEmail
+
+RECIPIENTS = 2000
+
+
+def single(recipients: BulkRecipients) -> None:
+    for recipient, context in recipients:
+        SignupEmail.plain_message(recipient, **context)
+        SignupEmail.html_message(recipient, **context)
+
+
+def bulk(recipients: BulkRecipients) -> None:
+    SignupEmail.plain_messages(recipients)
+    SignupEmail.html_messages(recipients)
+
+
+def main() -> None:
+    recipients = [
+        (User(email=f"user{i}@example.com"), {"signup_link": f"https://a.b/{i}"})
+        for i in range(RECIPIENTS)
+    ]
+    SGRString(
+        f"Rendering {RECIPIENTS} signup emails:", params=[SGRCodes.BOLD, SGRCodes.CYAN]
+    ).print()
+    for func in (single, bulk):
+        start = perf_counter()
+        func(recipients)
+        rate = RECIPIENTS / (perf_counter() - start)
+        SGRString(f"  {func.__name__:<6} {rate:10.0f} emails/s").print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""Statements sent one by one and in a pipeline, over a slow connection.
+
+The connection goes through a local proxy that delays every packet, to
+simulate the round trip to a remote database.
+
+Run with `python -m benchmarks.pipeline`.
+"""
+
+import os
+import socket
+import threading
+import time
+from queue import Queue
+from time import perf_counter
+
+from django.db import connection, transaction
+from pyutilkit.term import SGRCodes, SGRString
+
+from cp_project.accounts.models import (
+    ISSUE_SIGNUP_TOKEN,
+    SignupToken,
+    User,
+    get_signup_token_names,
+)
+
+LATENCY = 0.02
+USERS = 20
+
+
+def receive(source: socket.socket, packets: Queue[tuple[float, bytes]]) -> None:
+    with source:
+        while data := source.recv(65536):
+            packets.put((time.monotonic() + LATENCY / 2, data))
+    packets.put((0, b""))
+
+
+def send(target: socket.socket, packets: Queue[tuple[float, bytes]]) -> None:
+    """Deliver each packet half a round trip after it was received."""
+    with target:
+        while (packet := packets.get())[1]:
+            deadline, data = packet
+            time.sleep(max(0, deadline - time.monotonic()))
+            target.sendall(data)
+
+
+def forward(source: socket.socket, target: socket.socket) -> None:
+    packets: Queue[tuple[float, bytes]] = Queue()
+    threading.Thread(target=receive, args=(source, packets), daemon=True).start()
+    threading.Thread(target=send, args=(target, packets), daemon=True).start()
+
+
+def serve(listener: socket.socket, upstream: tuple[str, int]) -> None:
+    while True:
+        client, _ = listener.accept()
+        server = socket.create_connection(upstream)
+        forward(client, server)
+        forward(server, client)
+
+
+def start_proxy() -> int:
+    listener = socket.create_server(("127.0.0.1", 0))
+    upstream = (
+        connection.settings_dict["HOST"] or os.getenv("PGHOST", "localhost"),
+        int(connection.settings_dict["PORT"] or os.getenv("PGPORT", "5432")),
+    )
+    threading.Thread(target=serve, args=(listener, upstream), daemon=True).start()
+    return int(listener.getsockname()[1])
+
+
+def one_by_one(users: list[User]) -> None:
+    for user in users:
+        SignupToken.objects.issue(user)
+    User.objects.count()
+
+
+def pipelined(users: list[User]) -> None:
+    sql = ISSUE_SIGNUP_TOKEN.format_map(get_signup_token_names(connection.alias))
+    with User.objects.pipeline() as batch:
+        for user in users:
+            batch.execute(
+                sql,
+                {"user_id": user.pk, "dt": user.created_at},
+                writes=[SignupToken],
+            )
+        rows = batch.fetch(User.objects.values_list("pk"))
+    rows.result()
+
+
+def main() -> None:
+    port = start_proxy()
+    connection.close()
+    connection.close_pool()  # type: ignore[attr-defined]
+    connection.settings_dict["HOST"] = "127.0.0.1"
+    connection.settings_dict["PORT"] = str(port)
+    SGRString(
+        f"Issuing {USERS} signup tokens and reading the users, "
+        f"with {LATENCY * 1000:.0f} ms of latency:",
+        params=[SGRCodes.BOLD, SGRCodes.CYAN],
+    ).print()
+    for func in (one_by_one, pipelined):
+        with transaction.atomic():
+            users = User.objects.bulk_create(
+                [User(email=f"pipeline{i}@example.com") for i in range(USERS)]
+            )
+            start = perf_counter()
+            func(users)
+            elapsed = perf_counter() - start
+            transaction.set_rollback(True)
+        SGRString(f"  {func.__name__:<10} {elapsed * 1000:8.1f} ms").print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""Latency of the hot queries, with and without server-side preparation.
+
+Run with `python -m benchmarks.prepared_statements`.
+"""
+
+from collections.abc import Callable
+from time import perf_counter
+
+from django.db import connection, transaction
+from pyutilkit.term import SGRCodes, SGRString
+
+from cp_project.accounts.models import SignupToken, User
+
+EXECUTIONS = 2000
+# psycopg prepares a statement after prepare_threshold executions.
+MODES = {"unprepared": None, "prepared": 0}
+
+
+def get_queries(user: User, token: SignupToken) -> dict[str, Callable[[], object]]:
+    return {
+        "user by email": lambda: User.objects.get(email=user.email),
+        "user by pk": lambda: User.objects.get(pk=user.pk),
+        "token by oid": lambda: SignupToken.objects.get_by_oid(token.oid),
+    }
+
+
+def time_query(query: Callable[[], object]) -> float:
+    query()
+    start = perf_counter()
+    for _ in range(EXECUTIONS):
+        query()
+    return (perf_counter() - start) / EXECUTIONS
+
+
+def run(prepare_threshold: int | None) -> dict[str, float]:
+    connection.close()
+    connection.close_pool()  # type: ignore[attr-defined]
+    connection.settings_dict["OPTIONS"]["prepare_threshold"] = prepare_threshold
+    with transaction.atomic():
+        user = User.objects.create_user("benchmark@example.com")
+        token = SignupToken.objects.issue(user)
+        queries = get_queries(user, token)
+        timings = {name: time_query(query) for name, query in queries.items()}
+        transaction.set_rollback(True)
+    return timings
+
+
+def main() -> None:
+    results = {mode: run(threshold) for mode, threshold in MODES.items()}
+    SGRString(
+        f"Mean latency of {EXECUTIONS} executions per query:",
+        params=[SGRCodes.BOLD, SGRCodes.CYAN],
+    ).print()
+    SGRString(f"  {'':<14} {'unprepared':>12} {'prepared':>12} {'speedup':>8}").print()
+    for name, unprepared in results["unprepared"].items():
+        prepared = results["prepared"][name]
+        SGRString(
+            f"  {name:<14} {unprepared * 1e6:9.1f} µs {prepared * 1e6:9.1f} µs"
+            f" {unprepared / prepared:7.2f}x"
+        ).print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+from __future__ import annotations
+
+import time
+from typing import TYPE_CHECKING
+
+from django.core.management.base import BaseCommand
+
+from cp_project.accounts.models import SignupToken, User
+
+if TYPE_CHECKING:
+    from argparse import ArgumentParser
+
+    from cp_project.lib.models import BaseQuerySet
+
+
+class Command(BaseCommand):
+    help = "Delete the expired signup tokens and the users that never confirmed"
+
+    def add_arguments(self, parser: ArgumentParser) -> None:
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="The maximum number of rows deleted in one transaction",
+        )
+        parser.add_argument(
+            "--pause",
+            type=float,
+            default=0.1,
+            help="Seconds to wait between two batches",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Report what would be deleted, without deleting it",
+        )
+
+    def purge(
+        self,
+        queryset: BaseQuerySet[SignupToken] | BaseQuerySet[User],
+        *,
+        batch_size: int,
+        pause: float,
+        dry_run: bool,
+    ) -> tuple[int, int]:
+        label = queryset.model._meta.label  # noqa: SLF001
+        rows = batches = 0
+        for first, last in queryset.pk_ranges(batch_size):
+            if batches and not dry_run:
+                time.sleep(pause)
+            batch = queryset.filter(pk__gte=first, pk__lte=last)
+            if dry_run:
+                rows += batch.count()
+            else:
+                # The related rows go with them, e.g. a user's signup token.
+                _, deleted = batch.delete()
+                rows += deleted.get(label, 0)
+            batches += 1
+        return rows, batches
+
+    def handle(self, *_args: object, **options: object) -> None:
+        batch_size = options["batch_size"]
+        pause = options["pause"]
+        dry_run = bool(options["dry_run"])
+        assert isinstance(batch_size, int)  # noqa: S101
+        assert isinstance(pause, float)  # noqa: S101
+
+        verb = "Would delete" if dry_run else "Deleted"
+        for label, queryset in (
+            ("expired signup tokens", SignupToken.objects.expired()),
+            ("abandoned users", User.objects.abandoned()),
+        ):
+            rows, batches = self.purge(
+                queryset, batch_size=batch_size, pause=pause, dry_run=dry_run
+            )
+            self.stdout.write(f"🗑️ {verb} {rows} {label} in {batches} batches")
@@ -0,0 +1,19 @@
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ("accounts", "0001_initial"),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name="signuptoken",
+            index=models.Index(
+                fields=["created_at"], name="signuptoken_created_at_idx"
+            ),
+        ),
+    ]
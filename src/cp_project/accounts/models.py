@@ -5,13 +5,15 @@ from typing import TYPE_CHECKING, ClassVar, Self
 from django.conf import settings
 from django.contrib.auth.base_user import BaseUserManager
 from django.contrib.auth.models import AbstractUser
-from django.db import models
+from django.core import signing
+from django.db import connections, models
 from django.http import HttpRequest
 from django.urls import reverse
+from django.utils.crypto import constant_time_compare, salted_hmac
 from pyutilkit.date_utils import now
 
-from cp_project.lib.models import BaseModel, BaseQuerySet
-from cp_project.lib.utils import JWT, get_app_url
+from cp_project.lib.models import BaseModel, BaseQuerySet, invalidate
+from cp_project.lib.utils import JWT, Optimus, get_app_url
 
 if TYPE_CHECKING:
     from datetime import datetime
@@ -19,8 +21,68 @@ if TYPE_CHECKING:
     from django.http import HttpRequest
     from pathurl import URL
 
-
-class UserManager(BaseUserManager.from_queryset(BaseQuerySet["User"])):  # type: ignore[misc]
+SIGNUP_TOKEN_SALT = "cp_project.accounts.signup"  # noqa: S105
+# Both flows are a single statement, so they need neither a transaction nor
+# more than one round-trip. The table and column names come from the models,
+# see get_signup_token_names.
+ISSUE_SIGNUP_TOKEN = """
+INSERT INTO {token} ({token_user}, {token_created_at}, {token_updated_at})
+VALUES (%(user_id)s, %(dt)s, %(dt)s)
+ON CONFLICT ({token_user}) DO UPDATE
+SET {token_id} = DEFAULT,
+    {token_created_at} = excluded.{token_created_at},
+    {token_updated_at} = excluded.{token_updated_at}
+RETURNING {token_id}, {token_user}, {token_created_at}, {token_updated_at}
+"""  # noqa: S105
+CONFIRM_SIGNUP_TOKEN = """
+WITH token AS (
+    SELECT {token_id} AS id, {token_user} AS user_id,
+        {token_created_at} > %(cutoff)s AS valid
+    FROM {token}
+    WHERE {token_id} = %(id)s
+), deleted AS (
+    DELETE FROM {token}
+    USING token
+    WHERE {token}.{token_id} = token.id AND token.valid
+    RETURNING {token}.{token_user} AS user_id
+), activated AS (
+    UPDATE {user}
+    SET {user_is_active} = true, {user_updated_at} = %(dt)s
+    FROM deleted
+    WHERE {user}.{user_id} = deleted.user_id
+)
+SELECT valid FROM token
+"""  # noqa: S105
+
+
+def get_signup_token_names(using: str) -> dict[str, str]:
+    """Get the quoted table and column names used by the signup token SQL."""
+    quote_name = connections[using].ops.quote_name
+    token = SignupToken._meta  # noqa: SLF001
+    user = User._meta  # noqa: SLF001
+    return {
+        "token": quote_name(token.db_table),
+        "token_id": quote_name(token.pk.column),
+        "token_user": quote_name(token.get_field("user").column),
+        "token_created_at": quote_name(token.get_field("created_at").column),
+        "token_updated_at": quote_name(token.get_field("updated_at").column),
+        "user": quote_name(user.db_table),
+        "user_id": quote_name(user.pk.column),
+        "user_is_active": quote_name(user.get_field("is_active").column),
+        "user_updated_at": quote_name(user.get_field("updated_at").column),
+    }
+
+
+class UserQuerySet(BaseQuerySet["User"]):
+    def abandoned(self, as_of: datetime | None = None) -> UserQuerySet:
+        """Get the users that never confirmed their email in time."""
+        cutoff = (as_of or now()) - settings.SIGNUP_TOKEN_EXPIRY
+        return self.filter(
+            is_active=False, last_login__isnull=True, created_at__lte=cutoff
+        ).exclude(signup_token__created_at__gt=cutoff)
+
+
+class UserManager(BaseUserManager.from_queryset(UserQuerySet)):  # type: ignore[misc]
     use_in_migrations = True
 
     def _create_user(
@@ -88,6 +150,74 @@ class SignupTokenQuerySet(BaseQuerySet["SignupToken"]):
         as_of = as_of or now()
         return self.filter(created_at__lte=as_of - settings.SIGNUP_TOKEN_EXPIRY)
 
+    def issue(self, user: User) -> SignupToken:
+        """Create the signup token of a user, replacing any previous one.
+
+        A replaced token gets a new id, so links to it stop working.
+        """
+        dt = now()
+        signup_token: SignupToken
+        (signup_token,) = self.model.objects.using(self.write_db).raw(
+            ISSUE_SIGNUP_TOKEN.format_map(get_signup_token_names(self.write_db)),
+            {"user_id": user.pk, "dt": dt},
+        )
+        invalidate(self.model, using=self.write_db)
+        return signup_token
+
+    def confirm_by_oid(self, oid: int) -> bool:
+        """Activate the user of a token and delete the token, unless expired.
+
+        Return whether the token was valid, or raise DoesNotExist if there
+        is no such token.
+        """
+        as_of = now()
+        with connections[self.write_db].cursor() as cursor:
+            cursor.execute(
+                CONFIRM_SIGNUP_TOKEN.format_map(get_signup_token_names(self.write_db)),
+                {
+                    "id": Optimus().decode(oid),
+                    "cutoff": as_of - settings.SIGNUP_TOKEN_EXPIRY,
+                    "dt": as_of,
+                },
+            )
+            row = cursor.fetchone()
+        invalidate(self.model, User, using=self.write_db)
+        if row is None:
+            msg = "SignupToken matching query does not exist."
+            raise self.model.DoesNotExist(msg)
+        return bool(row[0])
+
+    def confirm_signed(self, token: str) -> bool:
+        """Activate the user of a signed token, without a signup token row.
+
+        Return whether the token was valid, or raise DoesNotExist if it was
+        not signed by us. Activating the user changes its activation hash,
+        so a token can only be used once.
+        """
+        try:
+            oid, activation_hash = signing.loads(
+                token,
+                salt=SIGNUP_TOKEN_SALT,
+                max_age=settings.SIGNUP_TOKEN_EXPIRY,
+            )
+        except signing.SignatureExpired:
+            return False
+        except signing.BadSignature as exc:
+            msg = "SignupToken matching query does not exist."
+            raise self.model.DoesNotExist(msg) from exc
+
+        try:
+            user: User = User.objects.using(self.write_db).get_by_oid(oid)
+        except User.DoesNotExist as exc:
+            msg = "SignupToken matching query does not exist."
+            raise self.model.DoesNotExist(msg) from exc
+        if not constant_time_compare(activation_hash, user.get_activation_hash()):
+            return False
+
+        user.is_active = True
+        user.save(update_fields=["is_active", "updated_at"])
+        return True
+
 
 class SignupTokenManager(models.Manager.from_queryset(SignupTokenQuerySet)):  # type: ignore[misc]
     pass
@@ -123,11 +253,11 @@ class User(AbstractUser, BaseModel):
             msg = "Not an access token"
             raise LookupError(msg)
 
-        try:
-            user: Self = cls.objects.get(email=jwt.email)
-        except cls.DoesNotExist as exc:
+        # Not from the query cache, which would keep the password hashes.
+        user: Self | None = cls.objects.filter(email=jwt.email).first()
+        if user is None:
             msg = "No such user"
-            raise LookupError(msg) from exc
+            raise LookupError(msg)
 
         return user
 
@@ -142,13 +272,20 @@ class User(AbstractUser, BaseModel):
     def get_signup_token(self) -> SignupToken:
         """Get the signup token for this user.
 
-        If one already exists, delete it first. This is to prevent
-        expanding the lifetime of a token after the 24h limit.
+        If one already exists, it is replaced by a token with a new id. This
+        is to prevent expanding the lifetime of a token after the 24h limit.
         """
-        SignupToken.objects.filter(user=self).delete()
-        signup_token: SignupToken = SignupToken.objects.create(user=self)
+        if settings.SIGNUP_TOKEN_STATELESS:
+            # The link is signed, so there is nothing to store.
+            return SignupToken(user=self)
+        signup_token: SignupToken = SignupToken.objects.issue(self)
         return signup_token
 
+    def get_activation_hash(self) -> str:
+        """Get a hash that changes when the account gets activated."""
+        value = f"{self.pk}:{self.is_active}:{self.last_login}:{self.password}"
+        return salted_hmac(SIGNUP_TOKEN_SALT, value, algorithm="sha256").hexdigest()
+
 
 class SignupToken(BaseModel):
     user = models.OneToOneField(
@@ -157,15 +294,31 @@ class SignupToken(BaseModel):
 
     objects: ClassVar[SignupTokenManager] = SignupTokenManager()
 
+    class Meta:
+        indexes: ClassVar[list[models.Index]] = [
+            models.Index(fields=["created_at"], name="signuptoken_created_at_idx")
+        ]
+
     def expired(self, as_of: datetime | None = None) -> bool:
         as_of = as_of or now()
         return self.created_at <= as_of - settings.SIGNUP_TOKEN_EXPIRY
 
     @property
     def signup_link(self) -> URL:
+        if settings.SIGNUP_TOKEN_STATELESS:
+            return get_app_url(
+                reverse("accounts:confirm-signed-email", kwargs={"token": self.signed})
+            )
         return get_app_url(
             reverse("accounts:confirm-email", kwargs={"token_id": self.oid})
         )
 
+    @property
+    def signed(self) -> str:
+        """Sign the user and its activation state, with the time of signing."""
+        return signing.dumps(
+            [self.user.oid, self.user.get_activation_hash()], salt=SIGNUP_TOKEN_SALT
+        )
+
     def __str__(self) -> str:
         return f"Signup token for {self.user}"
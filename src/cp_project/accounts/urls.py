@@ -10,6 +10,11 @@ urlpatterns = [
         views.ConfirmEmailAPIView.as_view(),
         name="confirm-email",
     ),
+    path(
+        "confirm-email/signed/<str:token>",
+        views.ConfirmSignedEmailAPIView.as_view(),
+        name="confirm-signed-email",
+    ),
     path("token/", views.ObtainTokenView.as_view(), name="obtain_token"),
     path("token/refresh", views.RefreshTokenView.as_view(), name="refresh_token"),
 ]
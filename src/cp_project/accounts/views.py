@@ -150,17 +150,29 @@ class ConfirmEmailAPIView(APIView):
     @staticmethod
     def post(token_id: int) -> JsonResponse:
         try:
-            signup_token = SignupToken.objects.get_by_oid(token_id)
+            confirmed = SignupToken.objects.confirm_by_oid(token_id)
         except SignupToken.DoesNotExist:
             return JsonResponse(
                 {"error": {"message": "Invalid token."}}, status=HTTPStatus.NOT_FOUND
             )
-        if signup_token.expired():
+        if not confirmed:
+            return JsonResponse(
+                {"error": {"message": "Invalid token."}}, status=HTTPStatus.UNAUTHORIZED
+            )
+        return JsonResponse(None, status=HTTPStatus.NO_CONTENT, safe=False)
+
+
+class ConfirmSignedEmailAPIView(APIView):
+    @staticmethod
+    def post(token: str) -> JsonResponse:
+        try:
+            confirmed = SignupToken.objects.confirm_signed(token)
+        except SignupToken.DoesNotExist:
+            return JsonResponse(
+                {"error": {"message": "Invalid token."}}, status=HTTPStatus.NOT_FOUND
+            )
+        if not confirmed:
             return JsonResponse(
                 {"error": {"message": "Invalid token."}}, status=HTTPStatus.UNAUTHORIZED
             )
-        user = signup_token.user
-        user.is_active = True
-        user.save()
-        signup_token.delete()
         return JsonResponse(None, status=HTTPStatus.NO_CONTENT, safe=False)
@@ -1,6 +1,16 @@
+import os
+
 from django.apps import AppConfig
 
 
 class LibAppConfig(AppConfig):
     name = "cp_project.lib"
     verbose_name = "Lib"
+
+    def ready(self) -> None:
+        from cp_project.lib.db import forget_connections
+        from cp_project.lib.invalidation import restart_listener
+
+        # Gunicorn forks its workers, after the app is loaded with --preload.
+        os.register_at_fork(after_in_child=forget_connections)
+        os.register_at_fork(after_in_child=restart_listener)
@@ -0,0 +1,515 @@
+from __future__ import annotations
+
+import fcntl
+import hashlib
+import mmap
+import os
+import pickle
+import struct
+import threading
+import time
+from contextlib import contextmanager
+from functools import cached_property
+from pathlib import Path
+from typing import TYPE_CHECKING, cast
+
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+from django.core.cache.backends.filebased import FileBasedCache
+
+if TYPE_CHECKING:
+    from collections.abc import Callable, Iterator
+
+    from cp_project.lib.types import JSONDict
+
+MISSING = object()
+FLIGHT_STRIPES = 64
+LOCK_POLL_INTERVAL = 0.05
+READ_RETRIES = 100
+# magic, buckets, ways, slot size
+TABLE_HEADER = struct.Struct("<8sIII")
+TABLE_MAGIC = b"cpshm001"
+TABLE_OFFSET = 64
+# version, key hash, expires, accessed, key length, value length
+SLOT_HEADER = struct.Struct("<QQddII")
+VERSION = struct.Struct("<Q")
+KEY_HASH = struct.Struct("<Q")
+KEY_HASH_OFFSET = 8
+ACCESSED = struct.Struct("<d")
+ACCESSED_OFFSET = 24
+tables: dict[str, SharedTable] = {}
+tables_lock = threading.Lock()
+key_locks: dict[str, KeyLocks] = {}
+
+
+class KeyLocks:
+    """Locks on keys, against the threads of a process and the other processes.
+
+    A key hashes to one of a few stripes, each a byte of a lock file, so
+    the processes that share the file wait on each other.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.thread_locks = [threading.Lock() for _ in range(FLIGHT_STRIPES)]
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+
+    @contextmanager
+    def locked(self, key: str) -> Iterator[None]:
+        stripe = SharedTable.hash(key.encode()) % FLIGHT_STRIPES
+        with self.thread_locks[stripe]:
+            fcntl.lockf(self.fd, fcntl.LOCK_EX, 1, stripe)
+            try:
+                yield
+            finally:
+                fcntl.lockf(self.fd, fcntl.LOCK_UN, 1, stripe)
+
+
+class TieredCache(BaseCache):
+    """An in-process cache in front of a cache that all the workers share.
+
+    The local entries expire after L1_TIMEOUT at the latest, which bounds
+    how long a worker can miss a change made by another one. Counters are
+    only kept in the shared cache, so that all the workers count together.
+
+    A file-based shared cache reads and then writes in add and incr, so
+    these lock the key, which only holds for the workers of a single host.
+    The workers of many hosts need a shared cache whose add and incr are
+    atomic, like the database or redis.
+    """
+
+    def __init__(self, _location: str, params: JSONDict) -> None:
+        super().__init__(params)
+        options = cast("JSONDict", params.get("OPTIONS", {}))
+        self.l1_alias = str(options["L1"])
+        self.l2_alias = str(options["L2"])
+        self.l1_timeout = float(cast(float, options.get("L1_TIMEOUT", 5)))
+        self.lock_timeout = float(cast(float, options.get("LOCK_TIMEOUT", 10)))
+        self.flights = [threading.Lock() for _ in range(FLIGHT_STRIPES)]
+
+    @property
+    def l1(self) -> BaseCache:
+        return caches[self.l1_alias]
+
+    @property
+    def l2(self) -> BaseCache:
+        return caches[self.l2_alias]
+
+    @cached_property
+    def l2_locks(self) -> KeyLocks | None:
+        l2 = self.l2
+        if not isinstance(l2, FileBasedCache):
+            return None
+        path = Path(l2._dir).joinpath("tiered.lock")  # type: ignore[attr-defined]  # noqa: SLF001
+        # A process locks a file through a single descriptor, since closing
+        # any other one would release its locks.
+        with tables_lock:
+            if str(path) not in key_locks:
+                key_locks[str(path)] = KeyLocks(path)
+            return key_locks[str(path)]
+
+    @contextmanager
+    def l2_locked(self, key: str) -> Iterator[None]:
+        """Lock a key of the shared cache, unless its writes are atomic already."""
+        if self.l2_locks is None:
+            yield
+            return
+        with self.l2_locks.locked(key):
+            yield
+
+    def l2_add(self, key: str, value: object, timeout: float | None) -> bool:
+        with self.l2_locked(key):
+            return bool(self.l2.add(key, value, timeout))
+
+    def get_l1_timeout(self, timeout: float | None) -> float:
+        if timeout is DEFAULT_TIMEOUT or timeout is None:
+            return self.l1_timeout
+        return min(timeout, self.l1_timeout)
+
+    def add(
+        self,
+        key: str,
+        value: object,
+        timeout: float | None = DEFAULT_TIMEOUT,
+        version: int | None = None,
+    ) -> bool:
+        key = self.make_and_validate_key(key, version=version)
+        if not self.l2_add(key, value, timeout):
+            return False
+        self.l1.set(key, value, self.get_l1_timeout(timeout))
+        return True
+
+    def get(
+        self, key: str, default: object = None, version: int | None = None
+    ) -> object:
+        key = self.make_and_validate_key(key, version=version)
+        value = self.l1.get(key, MISSING)
+        if value is MISSING:
+            value = self.l2.get(key, MISSING)
+            if value is MISSING:
+                return default
+            self.l1.set(key, value, self.l1_timeout)
+        return value
+
+    def set(
+        self,
+        key: str,
+        value: object,
+        timeout: float | None = DEFAULT_TIMEOUT,
+        version: int | None = None,
+    ) -> None:
+        key = self.make_and_validate_key(key, version=version)
+        self.l2.set(key, value, timeout)
+        self.l1.set(key, value, self.get_l1_timeout(timeout))
+
+    def touch(
+        self,
+        key: str,
+        timeout: float | None = DEFAULT_TIMEOUT,
+        version: int | None = None,
+    ) -> bool:
+        key = self.make_and_validate_key(key, version=version)
+        self.l1.touch(key, self.get_l1_timeout(timeout))
+        return bool(self.l2.touch(key, timeout))
+
+    def delete(self, key: str, version: int | None = None) -> bool:
+        key = self.make_and_validate_key(key, version=version)
+        self.l1.delete(key)
+        return bool(self.l2.delete(key))
+
+    def incr(self, key: str, delta: int = 1, version: int | None = None) -> int:
+        key = self.make_and_validate_key(key, version=version)
+        self.l1.delete(key)
+        with self.l2_locked(key):
+            value = int(self.l2.incr(key, delta))
+        # A concurrent get could have put the previous value back meanwhile.
+        self.l1.delete(key)
+        return value
+
+    def clear(self) -> None:
+        self.l1.clear()
+        self.l2.clear()
+
+    def evict_local(self, *keys: str, version: int | None = None) -> None:
+        """Drop some keys, or everything, from the local tier only."""
+        if not keys:
+            self.l1.clear()
+            return
+        self.l1.delete_many(
+            [self.make_and_validate_key(key, version=version) for key in keys]
+        )
+
+    def get_or_set(
+        self,
+        key: str,
+        default: object,
+        timeout: float | None = DEFAULT_TIMEOUT,
+        version: int | None = None,
+    ) -> object:
+        """Get a value, or compute it once, even when many ask for it at once.
+
+        The threads of a worker wait on a local lock. The workers wait on a
+        lock in the shared cache, until the value shows up or the lock
+        expires, e.g. because its holder died.
+        """
+        value = self.get(key, MISSING, version=version)
+        if value is not MISSING:
+            return value
+        with self.flights[hash(key) % FLIGHT_STRIPES]:
+            value = self.get(key, MISSING, version=version)
+            if value is MISSING:
+                value = self.compute_once(key, default, timeout, version)
+        return value
+
+    def compute_once(
+        self,
+        key: str,
+        default: object,
+        timeout: float | None,
+        version: int | None,
+    ) -> object:
+        lock_key = self.make_and_validate_key(f"{key}:lock", version=version)
+        deadline = time.monotonic() + self.lock_timeout
+        locked = self.l2_add(lock_key, value=True, timeout=self.lock_timeout)
+        while not locked and time.monotonic() < deadline:
+            time.sleep(LOCK_POLL_INTERVAL)
+            value = self.get(key, MISSING, version=version)
+            if value is not MISSING:
+                return value
+            locked = self.l2_add(lock_key, value=True, timeout=self.lock_timeout)
+        try:
+            if callable(default):
+                default = cast("Callable[[], object]", default)()
+            self.set(key, default, timeout, version=version)
+        finally:
+            if locked:
+                self.l2.delete(lock_key)
+        return default
+
+
+class SharedTable:
+    """A fixed-size hash table in a file that the processes of a host map.
+
+    A key hashes to a bucket of a few slots, and a full bucket evicts its
+    least recently used slot. Writers lock the bucket, against the threads
+    of their process and against the other processes. Readers take no
+    lock: the version of a slot is odd while it is written, so a reader
+    copies the slot and retries if the version changed meanwhile.
+    """
+
+    def __init__(self, path: Path, slots: int, slot_size: int, ways: int) -> None:
+        self.slot_size = slot_size
+        self.ways = ways
+        self.buckets = max(slots // ways, 1)
+        self.thread_locks = [threading.Lock() for _ in range(FLIGHT_STRIPES)]
+        size = TABLE_OFFSET + self.buckets * ways * slot_size
+        header = TABLE_HEADER.pack(TABLE_MAGIC, self.buckets, ways, slot_size)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.lockf(self.fd, fcntl.LOCK_EX)
+        try:
+            # A table with another layout is dropped, which only happens
+            # when the workers restart with new options.
+            stale = os.fstat(self.fd).st_size != size
+            if stale or os.pread(self.fd, TABLE_HEADER.size, 0) != header:
+                os.ftruncate(self.fd, 0)
+                os.ftruncate(self.fd, size)
+                os.pwrite(self.fd, header, 0)
+        finally:
+            fcntl.lockf(self.fd, fcntl.LOCK_UN)
+        self.map = mmap.mmap(self.fd, size)
+
+    @staticmethod
+    def hash(key: bytes) -> int:
+        return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), "little")
+
+    def get_offsets(self, key_hash: int) -> range:
+        start = TABLE_OFFSET + (key_hash % self.buckets) * self.ways * self.slot_size
+        return range(start, start + self.ways * self.slot_size, self.slot_size)
+
+    @contextmanager
+    def locked(self, offsets: range) -> Iterator[None]:
+        with self.thread_locks[offsets.start // self.slot_size % FLIGHT_STRIPES]:
+            fcntl.lockf(self.fd, fcntl.LOCK_EX, 1, offsets.start)
+            try:
+                yield
+            finally:
+                fcntl.lockf(self.fd, fcntl.LOCK_UN, 1, offsets.start)
+
+    def read(self, offset: int) -> tuple[int, float, bytes, bytes] | None:
+        """Copy a slot, as a key hash, expiry, key and value."""
+        for _ in range(READ_RETRIES):
+            data = self.map[offset : offset + self.slot_size]
+            version, key_hash, expires, _, key_length, value_length = (
+                SLOT_HEADER.unpack_from(data)
+            )
+            if version % 2 or VERSION.unpack_from(self.map, offset)[0] != version:
+                continue
+            key_end = SLOT_HEADER.size + key_length
+            key = data[SLOT_HEADER.size : key_end]
+            return key_hash, expires, key, data[key_end : key_end + value_length]
+        return None
+
+    def write(
+        self, offset: int, key_hash: int, expires: float, key: bytes, value: bytes
+    ) -> None:
+        # The version is forced odd, since a writer that died halfway left
+        # it odd, and an even one would let the readers see a torn slot.
+        (version,) = VERSION.unpack_from(self.map, offset)
+        version |= 1
+        VERSION.pack_into(self.map, offset, version)
+        SLOT_HEADER.pack_into(
+            self.map,
+            offset,
+            version,
+            key_hash,
+            expires,
+            time.time(),
+            len(key),
+            len(value),
+        )
+        payload = key + value
+        start = offset + SLOT_HEADER.size
+        self.map[start : start + len(payload)] = payload
+        VERSION.pack_into(self.map, offset, version + 1)
+
+    def find(self, key: bytes, offsets: range) -> tuple[int, float, bytes] | None:
+        """Find the live slot of a key, as its offset, expiry and value."""
+        key_hash = self.hash(key)
+        for offset in offsets:
+            if KEY_HASH.unpack_from(self.map, offset + KEY_HASH_OFFSET)[0] != key_hash:
+                continue
+            slot = self.read(offset)
+            if slot is None or slot[2] != key:
+                continue
+            _, expires, _, value = slot
+            # An expired copy of the key can stay next to a live one.
+            if not expires or expires > time.time():
+                return offset, expires, value
+        return None
+
+    def get(self, key: bytes) -> bytes | None:
+        found = self.find(key, self.get_offsets(self.hash(key)))
+        if found is None:
+            return None
+        offset, _, value = found
+        ACCESSED.pack_into(self.map, offset + ACCESSED_OFFSET, time.time())
+        return value
+
+    def put(
+        self, key: bytes, value: bytes, expires: float, *, replace: bool = True
+    ) -> bool:
+        """Store a value, unless it is too large or, without replace, already set."""
+        key_hash = self.hash(key)
+        offsets = self.get_offsets(key_hash)
+        with self.locked(offsets):
+            found = self.find(key, offsets)
+            if found is not None and not replace:
+                return False
+            if SLOT_HEADER.size + len(key) + len(value) > self.slot_size:
+                # The previous value must not outlive the one that was set.
+                if found is not None:
+                    self.write(found[0], 0, 0, b"", b"")
+                return False
+            if found is not None:
+                offset = found[0]
+            else:
+                offset = min(offsets, key=self.get_priority)
+            self.write(offset, key_hash, expires, key, value)
+        return True
+
+    def get_priority(self, offset: int) -> tuple[bool, float]:
+        """Order the slots to evict: the free and expired ones first, then by access."""
+        _, _, expires, accessed, key_length, _ = SLOT_HEADER.unpack_from(
+            self.map, offset
+        )
+        free = not key_length or bool(expires and expires <= time.time())
+        return not free, accessed
+
+    def update(self, key: bytes, function: Callable[[bytes], bytes]) -> bytes | None:
+        """Replace a value with a function of it, keeping its expiry."""
+        key_hash = self.hash(key)
+        offsets = self.get_offsets(key_hash)
+        with self.locked(offsets):
+            found = self.find(key, offsets)
+            if found is None:
+                return None
+            offset, expires, value = found
+            value = function(value)
+            if SLOT_HEADER.size + len(key) + len(value) > self.slot_size:
+                self.write(offset, 0, 0, b"", b"")
+            else:
+                self.write(offset, key_hash, expires, key, value)
+        return value
+
+    def delete(self, key: bytes) -> bool:
+        offsets = self.get_offsets(self.hash(key))
+        with self.locked(offsets):
+            found = self.find(key, offsets)
+            if found is not None:
+                self.write(found[0], 0, 0, b"", b"")
+        return found is not None
+
+    def clear(self) -> None:
+        for bucket in range(self.buckets):
+            start = TABLE_OFFSET + bucket * self.ways * self.slot_size
+            offsets = range(start, start + self.ways * self.slot_size, self.slot_size)
+            with self.locked(offsets):
+                for offset in offsets:
+                    self.write(offset, 0, 0, b"", b"")
+
+
+class SharedMemoryCache(BaseCache):
+    """A cache that all the workers of a host share, in a memory-mapped file.
+
+    It holds up to MAX_ENTRIES values of up to SLOT_SIZE bytes each, key
+    and pickled value included. Larger values are not stored, so it suits
+    small, hot entries. The file should be on a tmpfs, like /dev/shm, so
+    that the kernel does not write the pages back to disk.
+    """
+
+    def __init__(self, location: str, params: JSONDict) -> None:
+        super().__init__(params)
+        options = cast("JSONDict", params.get("OPTIONS", {}))
+        self.location = location
+        self.slot_size = int(cast(int, options.get("SLOT_SIZE", 1024)))
+        self.ways = int(cast(int, options.get("WAYS", 8)))
+
+    @cached_property
+    def table(self) -> SharedTable:
+        # The threads of a process share a single mapping, as locmem does.
+        with tables_lock:
+            if self.location not in tables:
+                tables[self.location] = SharedTable(
+                    Path(self.location), self._max_entries, self.slot_size, self.ways
+                )
+            return tables[self.location]
+
+    def get_expires(self, timeout: float | None) -> float:
+        expires = self.get_backend_timeout(timeout)
+        return 0 if expires is None else expires
+
+    def add(
+        self,
+        key: str,
+        value: object,
+        timeout: float | None = DEFAULT_TIMEOUT,
+        version: int | None = None,
+    ) -> bool:
+        key = self.make_and_validate_key(key, version=version)
+        pickled = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        expires = self.get_expires(timeout)
+        return self.table.put(key.encode(), pickled, expires, replace=False)
+
+    def get(
+        self, key: str, default: object = None, version: int | None = None
+    ) -> object:
+        key = self.make_and_validate_key(key, version=version)
+        pickled = self.table.get(key.encode())
+        if pickled is None:
+            return default
+        return pickle.loads(pickled)  # noqa: S301
+
+    def set(
+        self,
+        key: str,
+        value: object,
+        timeout: float | None = DEFAULT_TIMEOUT,
+        version: int | None = None,
+    ) -> None:
+        key = self.make_and_validate_key(key, version=version)
+        pickled = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        self.table.put(key.encode(), pickled, self.get_expires(timeout))
+
+    def touch(
+        self,
+        key: str,
+        timeout: float | None = DEFAULT_TIMEOUT,
+        version: int | None = None,
+    ) -> bool:
+        key = self.make_and_validate_key(key, version=version)
+        pickled = self.table.get(key.encode())
+        if pickled is None:
+            return False
+        expires = self.get_expires(timeout)
+        return self.table.put(key.encode(), pickled, expires)
+
+    def delete(self, key: str, version: int | None = None) -> bool:
+        key = self.make_and_validate_key(key, version=version)
+        return self.table.delete(key.encode())
+
+    def incr(self, key: str, delta: int = 1, version: int | None = None) -> int:
+        key = self.make_and_validate_key(key, version=version)
+
+        def increment(pickled: bytes) -> bytes:
+            value = pickle.loads(pickled) + delta  # noqa: S301
+            return pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+
+        pickled = self.table.update(key.encode(), increment)
+        if pickled is None:
+            msg = f"Key '{key}' not found"
+            raise ValueError(msg)
+        return int(pickle.loads(pickled))  # noqa: S301
+
+    def clear(self) -> None:
+        self.table.clear()
@@ -0,0 +1,272 @@
+from __future__ import annotations
+
+import hashlib
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, cast
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+from django.db.backends.postgresql.base import DatabaseWrapper
+
+if TYPE_CHECKING:
+    from collections.abc import Iterable, Iterator
+
+    from django.contrib.auth.models import AnonymousUser
+    from django.db.backends.base.base import BaseDatabaseWrapper
+    from django.db.backends.utils import CursorWrapper, _ExecuteParameters
+    from django.db.models import Model, QuerySet
+
+    from cp_project.accounts.models import User
+
+STICKY_PRIMARY_KEY = "db:primary:{}"
+TRY_ADVISORY_LOCK = "SELECT pg_try_advisory_lock(%s)"
+ADVISORY_UNLOCK = "SELECT pg_advisory_unlock(%s)"
+
+
+@dataclass(slots=True)
+class Routing:
+    replica: str | None
+    wrote: bool = False
+
+
+routing: ContextVar[Routing | None] = ContextVar("routing", default=None)
+
+
+@dataclass(slots=True)
+class Statement:
+    sql: str
+    cursor: CursorWrapper
+    error: Exception | None = None
+    rows: list[tuple[object, ...]] = field(default_factory=list)
+    count: int = -1
+
+    @property
+    def rowcount(self) -> int:
+        self.raise_error()
+        return self.count
+
+    def raise_error(self) -> None:
+        if self.error is not None:
+            raise self.error
+
+    def result(self) -> list[tuple[object, ...]]:
+        self.raise_error()
+        return self.rows
+
+    def close(self) -> None:
+        """Keep the result of the statement, and close its cursor."""
+        if self.error is None and self.cursor.pgresult is not None:
+            if self.cursor.description is not None:
+                self.rows = cast(list[tuple[object, ...]], self.cursor.fetchall())
+            self.count = cast(int, self.cursor.rowcount)
+        self.cursor.close()
+
+
+@dataclass(slots=True)
+class Pipeline:
+    """Statements sent to the server without waiting for each other's result.
+
+    The results are only read when the pipeline syncs, when the block
+    ends, so the statements must not depend on each other. A failed
+    statement aborts the ones after it, and, since everything up to the
+    sync runs in a single transaction, rolls back the ones before it.
+    """
+
+    connection: BaseDatabaseWrapper
+    statements: list[Statement] = field(default_factory=list)
+    written: set[type[Model]] = field(default_factory=set)
+
+    def execute(
+        self,
+        sql: str,
+        params: _ExecuteParameters = None,
+        *,
+        writes: Iterable[type[Model]] = (),
+    ) -> Statement:
+        """Queue a statement, along with the models that it writes to.
+
+        Writing sends the later reads of the request to the primary, and
+        the queryset pipeline invalidates the written models when it ends.
+        """
+        writes = set(writes)
+        if writes:
+            self.written |= writes
+            state = routing.get()
+            if state is not None:
+                state.wrote = True
+        statement = Statement(sql=sql, cursor=self.connection.cursor())
+        # The results of earlier statements can arrive during the execution,
+        # so a statement is known before an earlier error gets raised.
+        self.statements.append(statement)
+        statement.cursor.execute(sql, params)
+        return statement
+
+    def fetch(self, queryset: QuerySet[Model]) -> Statement:
+        """Queue the query of a queryset, to read its rows after the sync."""
+        sql, params = queryset.query.sql_with_params()
+        return self.execute(sql, params)
+
+    def assign_error(self, error: DatabaseError) -> Statement | None:
+        """Blame the first statement without a result, and abort the rest."""
+        pending = [
+            statement
+            for statement in self.statements
+            if statement.cursor.pgresult is None
+        ]
+        if not pending:
+            return None
+        failed, *aborted = pending
+        failed.error = error
+        for statement in aborted:
+            statement.error = DatabaseError(f"Aborted after: {failed.sql}")
+        return failed
+
+    def close(self) -> None:
+        for statement in self.statements:
+            statement.close()
+
+
+def forget_connections() -> None:
+    """Drop the connections and pools that a forked process inherited.
+
+    The sockets are shared with the parent, so the child must not use
+    them. They are not closed either, since psycopg only finishes the
+    connections of the process that opened them. Each child opens its
+    own pool on first use.
+    """
+    DatabaseWrapper._connection_pools.clear()  # type: ignore[attr-defined]  # noqa: SLF001
+    for connection in connections.all(initialized_only=True):
+        connection.connection = None
+
+
+def in_transaction(using: str | None = None) -> bool:
+    """Tell whether the writes on a connection can still be rolled back.
+
+    Like for durable atomic blocks, the blocks of test cases do not count.
+    """
+    blocks = connections[using or DEFAULT_DB_ALIAS].atomic_blocks
+    return not all(block._from_testcase for block in blocks)  # type: ignore[attr-defined]  # noqa: SLF001
+
+
+@contextmanager
+def advisory_lock(name: str, using: str = DEFAULT_DB_ALIAS) -> Iterator[bool]:
+    """Try to lock a name for the block, and tell whether it was locked.
+
+    The lock belongs to the session, so unlike a lock in a cache it is
+    atomic on any cache backend, and the server releases it if the
+    process dies. It is not reentrant across threads, since each thread
+    has its own connection.
+    """
+    digest = hashlib.sha256(name.encode()).digest()
+    lock_id = int.from_bytes(digest[:8], "big", signed=True)
+    connection = connections[using]
+    with connection.cursor() as cursor:
+        cursor.execute(TRY_ADVISORY_LOCK, [lock_id])
+        (locked,) = cursor.fetchone()
+    try:
+        yield bool(locked)
+    finally:
+        if locked:
+            with connection.cursor() as cursor:
+                cursor.execute(ADVISORY_UNLOCK, [lock_id])
+
+
+@contextmanager
+def route_reads(*, replica: bool) -> Iterator[Routing]:
+    """Send the reads to a single replica, until something is written.
+
+    A replica is picked once, so that all the reads see the same snapshot
+    of the primary. After a write, reads go to the primary, so they see it.
+    A nested block, like a request of a batch, reads from the primary once
+    the enclosing one wrote, and passes its own writes on to it.
+    """
+    parent = routing.get()
+    if parent is not None and parent.wrote:
+        replica = False
+    replicas = settings.DATABASE_REPLICAS if replica else []
+    state = Routing(replica=random.choice(replicas) if replicas else None)  # noqa: S311
+    token = routing.set(state)
+    try:
+        yield state
+    finally:
+        routing.reset(token)
+        if parent is not None and state.wrote:
+            parent.wrote = True
+
+
+def is_stuck_to_primary(user: User | AnonymousUser) -> bool:
+    if not user.is_authenticated:
+        return False
+    return bool(cache.get(STICKY_PRIMARY_KEY.format(user.pk)))
+
+
+def stick_to_primary(user: User | AnonymousUser) -> None:
+    """Keep the reads of a user on the primary, until the replicas catch up."""
+    if user.is_authenticated:
+        timeout = settings.DB_REPLICA_STICKY_SECONDS
+        cache.set(STICKY_PRIMARY_KEY.format(user.pk), value=True, timeout=timeout)
+
+
+class ReplicaRouter:
+    """Route the reads of safe requests to the replicas.
+
+    Outside of route_reads, e.g. in commands and shells, everything goes
+    to the primary.
+    """
+
+    @staticmethod
+    def db_for_read(_model: type[Model], **_hints: object) -> str | None:
+        state = routing.get()
+        if state is None or state.wrote:
+            return None
+        return state.replica
+
+    @staticmethod
+    def db_for_write(_model: type[Model], **_hints: object) -> str:
+        state = routing.get()
+        if state is not None:
+            state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    @staticmethod
+    def allow_relation(obj1: Model, obj2: Model, **_hints: object) -> bool | None:
+        # The replicas hold the same rows as the primary.
+        aliases = {DEFAULT_DB_ALIAS, *settings.DATABASE_REPLICAS}
+        if {obj1._state.db, obj2._state.db} <= aliases:  # noqa: SLF001
+            return True
+        return None
+
+    @staticmethod
+    def allow_migrate(db: str, _app_label: str, **_hints: object) -> bool:
+        # The replicas get the schema through replication.
+        return db not in settings.DATABASE_REPLICAS
+
+
+@contextmanager
+def pipeline(using: str = DEFAULT_DB_ALIAS) -> Iterator[Pipeline]:
+    """Send the statements of a block to the server in a single round trip.
+
+    The first error is raised when the block ends. Each statement also
+    keeps its own error, so the caller can tell which one failed. The
+    results are read and the cursors closed when the block ends too.
+
+    The written models are not invalidated, so the writes to the models
+    of the query cache should go through BaseQuerySet.pipeline.
+    """
+    connection = connections[using]
+    connection.ensure_connection()
+    batch = Pipeline(connection)
+    try:
+        with connection.wrap_database_errors, connection.connection.pipeline():
+            yield batch
+    except DatabaseError as exc:
+        failed = batch.assign_error(exc)
+        if failed is not None:
+            exc.add_note(f"Failed statement: {failed.sql}")
+        raise
+    finally:
+        batch.close()
@@ -1,18 +1,28 @@
+import base64
 import logging
 import re
-from collections.abc import Iterable
+from collections.abc import Iterable, Iterator, Mapping, Sequence
 from dataclasses import dataclass
+from email.mime.base import MIMEBase
+from functools import cache
 from pathlib import Path
 from smtplib import SMTPException
 from typing import Literal
+from uuid import uuid4
 
 from django.conf import settings
-from django.core.mail import EmailMultiAlternatives, get_connection
+from django.core.mail import EmailMessage, EmailMultiAlternatives, get_connection
+from django.core.mail.backends.base import BaseEmailBackend
 from jinja2 import Environment, FileSystemLoader, StrictUndefined, Template
 from pyutilkit.date_utils import now
 
 from cp_project.accounts.models import User
+from cp_project.lib.exceptions import AttachmentTooLargeError, UnsplittableTemplateError
+from cp_project.lib.jinja import EmailHTMLExtension, Skeleton, finalize
 
+BASE64_LINE_LENGTH = 76
+BASE64_LINE_SIZE = 57  # the bytes that a full base64 line encodes
+BASE64_CHUNK_SIZE = BASE64_LINE_SIZE * 1024
 CAPITAL_SPLIT = re.compile("[A-Z][^A-Z]*")
 PREVIEW_LENGTH = 300
 SUFFIXES = {"html": "html", "plain": "txt"}
@@ -20,6 +30,8 @@ SUFFIXES = {"html": "html", "plain": "txt"}
 
 logger = logging.getLogger(__name__)
 
+BulkRecipients = Sequence[tuple[User, Mapping[str, object]]]
+
 
 @dataclass(frozen=True, slots=True)
 class Attachment:
@@ -28,6 +40,110 @@ class Attachment:
     mimetype: str
 
 
+@dataclass(frozen=True, slots=True)
+class FileAttachment:
+    name: str
+    path: Path
+    mimetype: str
+
+    def to_mime(self, *, streamed: bool) -> "FileAttachmentPart":
+        check_attachment_size(self.name, self.path.stat().st_size)
+        return FileAttachmentPart(self, streamed=streamed)
+
+
+class FileAttachmentPart(MIMEBase):
+    """A base64 MIME part whose content is read from disk.
+
+    A streamed part only carries a placeholder line, which
+    `iter_message_chunks` swaps for the encoded file while sending. The
+    backends that cannot stream get a regular part, which holds the
+    encoded file in memory, like any other attachment.
+    """
+
+    def __init__(self, attachment: FileAttachment, *, streamed: bool) -> None:
+        maintype, subtype = attachment.mimetype.split("/", 1)
+        super().__init__(maintype, subtype)
+        self.source = attachment.path
+        self.size = attachment.path.stat().st_size
+        self.streamed = streamed
+        self.placeholder = f"cp-attachment-{uuid4().hex}"
+        self["Content-Transfer-Encoding"] = "base64"
+        self.add_header("Content-Disposition", "attachment", filename=attachment.name)
+        if streamed:
+            self.set_payload(f"{self.placeholder}\n")
+        else:
+            self.set_payload(b"".join(iter_base64(self.source)).decode("ascii"))
+
+
+MessagePart = bytes | FileAttachmentPart
+
+
+def check_attachment_size(name: str, size: int) -> None:
+    if size > settings.EMAIL_MAX_ATTACHMENT_SIZE:
+        msg = f"Attachment `{name}` is {size} bytes, over the size cap"
+        raise AttachmentTooLargeError(msg)
+
+
+@cache
+def get_environment(template_dir: str) -> Environment:
+    """Get the environment for the email templates.
+
+    It's shared so that each template is compiled (and its HTML inlined and
+    minified) once per process instead of once per email.
+    """
+    return Environment(  # noqa: S701
+        loader=FileSystemLoader(template_dir),
+        undefined=StrictUndefined,
+        auto_reload=settings.DEBUG,
+        extensions=[EmailHTMLExtension],
+        finalize=finalize,
+    )
+
+
+def iter_base64(path: Path, linesep: bytes = b"\n") -> Iterator[bytes]:
+    with path.open("rb") as file:
+        while chunk := file.read(BASE64_CHUNK_SIZE):
+            yield base64.encodebytes(chunk).replace(b"\n", linesep)
+
+
+def get_base64_size(size: int, linesep: bytes = b"\r\n") -> int:
+    """Get the length of the output of `iter_base64` for a file of some size."""
+    lines, rest = divmod(size, BASE64_LINE_SIZE)
+    characters = lines * BASE64_LINE_LENGTH + -(-rest // 3) * 4
+    return characters + (lines + bool(rest)) * len(linesep)
+
+
+def split_message(email_message: EmailMessage) -> list[MessagePart]:
+    """Split the CRLF-encoded message around its streamed attachments."""
+    message = email_message.message().as_bytes(linesep="\r\n")
+    parts: list[MessagePart] = []
+    for part in email_message.attachments:
+        if isinstance(part, FileAttachmentPart) and part.streamed:
+            head, message = message.split(f"{part.placeholder}\r\n".encode(), 1)
+            parts.extend([head, part])
+    parts.append(message)
+    return parts
+
+
+def get_message_size(parts: Iterable[MessagePart]) -> int:
+    return sum(
+        len(part) if isinstance(part, bytes) else get_base64_size(part.size)
+        for part in parts
+    )
+
+
+def iter_message_chunks(parts: Iterable[MessagePart]) -> Iterator[bytes]:
+    """Yield the message, reading streamed attachments from disk.
+
+    Every chunk starts at the beginning of a line.
+    """
+    for part in parts:
+        if isinstance(part, bytes):
+            yield part
+        else:
+            yield from iter_base64(part.source, linesep=b"\r\n")
+
+
 class BaseTransactionalEmail:
     subject: str
     preview_text: str
@@ -42,10 +158,7 @@ class BaseTransactionalEmail:
         suffix = f".{SUFFIXES[component]}.jinja"
         path = Path(component).joinpath(cls.get_template_name()).with_suffix(suffix)
 
-        template_dir = settings.EMAIL_TEMPLATE_DIR.as_posix()
-        env = Environment(  # noqa: S701
-            loader=FileSystemLoader(template_dir), undefined=StrictUndefined
-        )
+        env = get_environment(settings.EMAIL_TEMPLATE_DIR.as_posix())
         return env.get_template(path.as_posix())
 
     @classmethod
@@ -56,6 +169,43 @@ class BaseTransactionalEmail:
         kwargs.setdefault("current_year", now().year)
         return template.render(kwargs)
 
+    @classmethod
+    def render_bulk(
+        cls, template: Template, recipients: BulkRecipients, **kwargs: object
+    ) -> list[str]:
+        """Render a template for many recipients.
+
+        Everything but the recipient and their own context is rendered once
+        into a skeleton, which is then filled in for each recipient. If the
+        template does more than print the personal values, every recipient
+        gets a full render instead, as they do when their contexts have
+        different keys.
+        """
+        if not recipients:
+            return []
+        kwargs.setdefault("current_year", now().year)
+        _, first_context = recipients[0]
+        slot_names = ["recipient", *first_context]
+        # A skeleton has the same slots for every recipient.
+        same_keys = all(
+            context.keys() == first_context.keys() for _, context in recipients
+        )
+        try:
+            skeleton = (
+                Skeleton.render(template, slot_names, kwargs) if same_keys else None
+            )
+        except UnsplittableTemplateError:
+            skeleton = None
+        if skeleton is None:
+            return [
+                cls.render_template(template, recipient, **kwargs, **context)
+                for recipient, context in recipients
+            ]
+        return [
+            skeleton.fill({"recipient": recipient, **context})
+            for recipient, context in recipients
+        ]
+
     @classmethod
     def plain_message(cls, recipient: User, **kwargs: object) -> str:
         return cls.render_template(cls.get_template("plain"), recipient, **kwargs)
@@ -67,28 +217,63 @@ class BaseTransactionalEmail:
         )
 
     @classmethod
-    def send_email(
+    def plain_messages(cls, recipients: BulkRecipients, **kwargs: object) -> list[str]:
+        return cls.render_bulk(cls.get_template("plain"), recipients, **kwargs)
+
+    @classmethod
+    def html_messages(cls, recipients: BulkRecipients, **kwargs: object) -> list[str]:
+        return cls.render_bulk(
+            cls.get_template("html"),
+            recipients,
+            preview_text=cls.preview_text,
+            **kwargs,
+        )
+
+    @classmethod
+    def get_mail(
         cls,
         recipient: User,
-        attachments: Iterable[Attachment] = (),
-        **kwargs: object,
-    ) -> bool:
+        plain_message: str,
+        html_message: str,
+        attachments: Iterable[Attachment | FileAttachment],
+        connection: BaseEmailBackend,
+    ) -> EmailMultiAlternatives:
         mail = EmailMultiAlternatives(
             cls.subject,
-            cls.plain_message(recipient, **kwargs),
+            plain_message,
             settings.NO_REPLY_EMAIL,
             [recipient.email],
-            connection=get_connection(),
+            connection=connection,
         )
-        html_message = cls.html_message(recipient, **kwargs)
         mail.attach_alternative(html_message, "text/html")
 
+        streamed = getattr(connection, "supports_streamed_attachments", False)
         for attachment in attachments:
-            mail.attach(attachment.name, attachment.content, attachment.mimetype)
+            if isinstance(attachment, FileAttachment):
+                mail.attach(attachment.to_mime(streamed=streamed))
+            else:
+                check_attachment_size(attachment.name, len(attachment.content))
+                mail.attach(attachment.name, attachment.content, attachment.mimetype)
+        return mail
+
+    @classmethod
+    def send_email(
+        cls,
+        recipient: User,
+        attachments: Iterable[Attachment | FileAttachment] = (),
+        **kwargs: object,
+    ) -> bool:
+        mail = cls.get_mail(
+            recipient,
+            cls.plain_message(recipient, **kwargs),
+            cls.html_message(recipient, **kwargs),
+            attachments,
+            get_connection(),
+        )
 
         try:
             number_sent = mail.send()
-        except SMTPException:
+        except (OSError, SMTPException):
             success = False
         else:
             success = bool(number_sent)
@@ -100,3 +285,42 @@ class BaseTransactionalEmail:
             success,
         )
         return success
+
+    @classmethod
+    def send_bulk(
+        cls,
+        recipients: BulkRecipients,
+        attachments: Sequence[Attachment | FileAttachment] = (),
+        **kwargs: object,
+    ) -> int:
+        connection: BaseEmailBackend = get_connection()
+        mails = [
+            cls.get_mail(
+                recipient, plain_message, html_message, attachments, connection
+            )
+            for (recipient, _), plain_message, html_message in zip(
+                recipients,
+                cls.plain_messages(recipients, **kwargs),
+                cls.html_messages(recipients, **kwargs),
+                strict=True,
+            )
+        ]
+
+        # A failure only loses the messages of its chunk.
+        number_sent = 0
+        chunk_size = settings.EMAIL_BULK_CHUNK_SIZE
+        for start in range(0, len(mails), chunk_size):
+            try:
+                number_sent += connection.send_messages(
+                    mails[start : start + chunk_size]
+                )
+            except (OSError, SMTPException):
+                logger.exception("Failed to send a chunk of %s", cls.__qualname__)
+
+        logger.info(
+            "Attempted to sent %s to %s recipients (sent: %s).",
+            cls.__qualname__,
+            len(recipients),
+            number_sent,
+        )
+        return number_sent
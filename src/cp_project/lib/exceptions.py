@@ -1,15 +1,32 @@
 from __future__ import annotations
 
+from smtplib import SMTPException
 from typing import TYPE_CHECKING
 
 if TYPE_CHECKING:
     from collections.abc import Iterable
 
 
+class AttachmentTooLargeError(ValueError):
+    pass
+
+
+class CircuitOpenError(SMTPException):
+    pass
+
+
 class LoginRequiredError(RuntimeError):
     pass
 
 
+class PoolExhaustedError(SMTPException):
+    pass
+
+
+class UnsplittableTemplateError(TypeError):
+    pass
+
+
 class ValidationError(AssertionError):
     def __init__(
         self, message: str = "Validation failed", *, notes: Iterable[str] = ()
@@ -1,14 +1,164 @@
+import hashlib
 import json
-from typing import cast
+import zlib
+from collections.abc import Callable, Mapping
+from dataclasses import dataclass
+from http import HTTPStatus
+from io import BytesIO
+from typing import TYPE_CHECKING, cast
 
-from django.http import JsonResponse as BaseJsonResponse
+from django.conf import settings
+from django.core.handlers.wsgi import WSGIRequest
+from django.http import HttpRequest, JsonResponse as BaseJsonResponse
+from django.utils.http import parse_etags
+from django.utils.text import compress_string
 
+from cp_project.lib.exceptions import ValidationError
 from cp_project.lib.types import JSONType
 
+if TYPE_CHECKING:
+    from django.contrib.auth.models import AnonymousUser
+
+    from cp_project.accounts.models import User
+
+# Random bytes in the gzip header, against BREACH, as in Django's middleware.
+GZIP_MAX_RANDOM_BYTES = 100
+GZIP_CHUNK_SIZE = 64 * 1024
+# The headers of a batch that describe its own body, cache entry or retries.
+BATCH_ONLY_META = {
+    "CONTENT_LENGTH",
+    "CONTENT_TYPE",
+    "HTTP_CONTENT_ENCODING",
+    "HTTP_IDEMPOTENCY_KEY",
+    "HTTP_IF_NONE_MATCH",
+}
+
 
 class JsonResponse(BaseJsonResponse):
+    # The compressed content, if known, for GZipMiddleware to reuse.
+    gzip_content: bytes | None = None
+
     @property
     def data(self) -> JSONType:
         if self.content:
             return cast(JSONType, json.loads(self.content))
         return None
+
+
+def compress(content: bytes) -> bytes:
+    return compress_string(content, max_random_bytes=GZIP_MAX_RANDOM_BYTES)
+
+
+def decompress(read: Callable[[int], bytes], max_size: int) -> bytes:
+    """Decompress a gzip stream chunk by chunk, up to max_size bytes.
+
+    The output of each chunk is capped as well, so a small bomb never
+    inflates past the limit in memory.
+    """
+    decompressor = zlib.decompressobj(wbits=zlib.MAX_WBITS | 16)
+    chunks, size = [], 0
+    try:
+        while not decompressor.eof and (chunk := read(GZIP_CHUNK_SIZE)):
+            while chunk:
+                data = decompressor.decompress(chunk, max_size - size + 1)
+                size += len(data)
+                if size > max_size:
+                    msg = f"Request body exceeds {max_size} bytes"
+                    raise ValidationError(msg)
+                chunks.append(data)
+                chunk = decompressor.unconsumed_tail
+    except zlib.error as exc:
+        msg = "Invalid gzip body"
+        raise ValidationError(msg) from exc
+    if not decompressor.eof:
+        msg = "Truncated gzip body"
+        raise ValidationError(msg)
+    return b"".join(chunks)
+
+
+@dataclass(frozen=True, slots=True)
+class CachedResponse:
+    content: bytes
+    headers: dict[str, str]
+    gzip_content: bytes | None = None
+    status: int = HTTPStatus.OK
+
+    @classmethod
+    def from_response(
+        cls, response: JsonResponse, *, gzip: bool = True
+    ) -> "CachedResponse":
+        """Keep a response, compressed as well if it is large enough."""
+        gzip_content = None
+        if gzip and len(response.content) >= settings.GZIP_MIN_LENGTH:
+            gzip_content = compress(response.content)
+        return cls(
+            content=response.content,
+            headers=dict(response.headers),
+            gzip_content=gzip_content,
+            status=response.status_code,
+        )
+
+    def to_response(self) -> JsonResponse:
+        response = build_response(self.content, self.headers, self.status)
+        response.gzip_content = self.gzip_content
+        return response
+
+
+def build_response(
+    content: bytes, headers: Mapping[str, str], status: int = HTTPStatus.OK
+) -> JsonResponse:
+    """Build a response from raw content, with the headers of another one."""
+    response = JsonResponse(None, safe=False, status=status)
+    response.content = content
+    for header, value in headers.items():
+        response.headers[header] = value
+    return response
+
+
+def make_etag(*parts: object) -> str:
+    """Make a strong ETag, from the response bytes or from a validator."""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part if isinstance(part, bytes) else str(part).encode())
+        digest.update(b"\0")
+    return f'"{digest.hexdigest()}"'
+
+
+def etag_matches(etag: str, if_none_match: str) -> bool:
+    # If-None-Match uses the weak comparison.
+    etags = parse_etags(if_none_match)
+    return "*" in etags or etag in (tag.removeprefix("W/") for tag in etags)
+
+
+def not_modified(etag: str) -> JsonResponse:
+    return build_response(b"", {"ETag": etag}, HTTPStatus.NOT_MODIFIED)
+
+
+class SubRequest(WSGIRequest):
+    """A request of a batch, made in-process, with the user of the batch."""
+
+    def __init__(
+        self,
+        parent: HttpRequest,
+        user: "User | AnonymousUser",
+        method: str,
+        path: str,
+        data: JSONType,
+    ) -> None:
+        path_info, _, query_string = path.partition("?")
+        body = b"" if data is None else json.dumps(data).encode()
+        environ = {
+            key: value
+            for key, value in parent.META.items()
+            if key not in BATCH_ONLY_META
+        }
+        environ |= {
+            "REQUEST_METHOD": method,
+            "PATH_INFO": path_info,
+            "QUERY_STRING": query_string,
+            "CONTENT_TYPE": "application/json",
+            "CONTENT_LENGTH": str(len(body)),
+            "wsgi.input": BytesIO(body),
+        }
+        super().__init__(environ)
+        self.user = user
@@ -0,0 +1,137 @@
+from __future__ import annotations
+
+import json
+import logging
+import threading
+from typing import TYPE_CHECKING
+
+import psycopg
+from django.apps import apps
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.dispatch import Signal
+
+if TYPE_CHECKING:
+    from collections.abc import Iterable
+
+    from django.db.models import Model
+
+CHANNEL = "cache_invalidation"
+NOTIFY_QUERY = "SELECT pg_notify(%s, %s)"
+POLL_TIMEOUT = 1.0
+RECONNECT_DELAY = 1.0
+
+logger = logging.getLogger(__name__)
+# Sent with the model that changed, and the primary keys of the changed rows,
+# or None when any row could have changed. A None sender means that any
+# model could have changed, e.g. while the listener was disconnected.
+invalidated = Signal()
+listeners: list[Listener] = []
+
+
+def publish(labels: Iterable[str], pks: list[object] | None, using: str | None) -> None:
+    """Tell every worker that some models changed.
+
+    The notification is sent in autocommit, once the write has committed
+    and the shared generations are bumped, so a worker that evicts its
+    local entries reads the new ones.
+    """
+    if not settings.CACHE_INVALIDATION_BUS:
+        return
+    payload = json.dumps({"models": sorted(labels), "pks": pks}, default=str)
+    with connections[using or DEFAULT_DB_ALIAS].cursor() as cursor:
+        cursor.execute(NOTIFY_QUERY, [CHANNEL, payload])
+
+
+def send_invalidated(sender: type[Model] | None, pks: list[object] | None) -> None:
+    """Send invalidated, logging the errors of the receivers instead of raising."""
+    for receiver, response in invalidated.send_robust(sender=sender, pks=pks):
+        if isinstance(response, Exception):
+            logger.error("%r failed to invalidate", receiver, exc_info=response)
+
+
+def dispatch(payload: str) -> None:
+    """Send invalidated for a notification, without ever raising.
+
+    The listener would die from an error. A notification that cannot be
+    read, e.g. about a model that a worker of an older release does not
+    have, makes everything stale instead.
+    """
+    try:
+        message = json.loads(payload)
+        senders: list[type[Model] | None] = [
+            apps.get_model(label) for label in message["models"]
+        ]
+        pks = message["pks"]
+    except (LookupError, TypeError, ValueError):
+        logger.exception("Unreadable invalidation: %s", payload)
+        senders, pks = [None], None
+    for sender in senders:
+        send_invalidated(sender, pks)
+
+
+class Listener(threading.Thread):
+    """Evict the local cache entries that other workers made stale.
+
+    The listener runs on its own connection, outside of the pool, since
+    it holds it for as long as the worker lives.
+    """
+
+    def __init__(self, using: str = DEFAULT_DB_ALIAS) -> None:
+        super().__init__(daemon=True)
+        self.using = using
+        self.stopped = threading.Event()
+        self.listening = threading.Event()
+
+    def run(self) -> None:
+        while not self.stopped.is_set():
+            try:
+                self.listen()
+            except psycopg.Error:
+                logger.exception("The invalidation listener lost its connection")
+            self.listening.clear()
+            # Anything could have changed while nobody was listening.
+            send_invalidated(None, None)
+            self.stopped.wait(RECONNECT_DELAY)
+
+    def listen(self) -> None:
+        params = connections[self.using].get_connection_params()
+        with psycopg.Connection.connect(**params, autocommit=True) as connection:
+            connection.execute(f"LISTEN {CHANNEL}")
+            self.listening.set()
+            while not self.stopped.is_set():
+                for notify in connection.notifies(timeout=POLL_TIMEOUT):
+                    dispatch(notify.payload)
+
+    def stop(self) -> None:
+        self.stopped.set()
+        self.join()
+
+
+def start_listener() -> Listener | None:
+    """Start the listener of the current process, if there is none yet."""
+    if not settings.CACHE_INVALIDATION_BUS:
+        return None
+    if not listeners:
+        listeners.append(Listener())
+        listeners[0].start()
+    return listeners[0]
+
+
+def start_listener_on_request(**_kwargs: object) -> None:
+    """Start the listener of a process on its first request, not on load.
+
+    With --preload, gunicorn loads the app in its master, which serves no
+    requests, so it would hold a listener connection that it never needs.
+    """
+    start_listener()
+
+
+def restart_listener() -> None:
+    """Start a listener in a forked process, if its parent had one.
+
+    Threads do not survive a fork, so the child only inherits a dead one.
+    """
+    if listeners:
+        listeners.clear()
+        start_listener()
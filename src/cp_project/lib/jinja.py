@@ -0,0 +1,256 @@
+from __future__ import annotations
+
+import logging
+import re
+from dataclasses import dataclass
+from itertools import zip_longest
+from typing import TYPE_CHECKING, NoReturn
+
+from jinja2 import TemplateNotFound
+from jinja2.ext import Extension
+from jinja2.lexer import Token
+
+from cp_project.lib.exceptions import UnsplittableTemplateError
+
+if TYPE_CHECKING:
+    from collections.abc import Iterator, Mapping, Sequence
+
+    from jinja2 import Template
+    from jinja2.lexer import TokenStream
+
+BLOCK_TAGS = (
+    "body|br|div|h[1-6]|head|hr|html|img|li|link|meta|ol|p|table|tbody|td|tfoot|th"
+    "|thead|title|tr|ul"
+)
+AT_RULE = re.compile(r"@[^{};]*(?:;|\{(?:[^{}]*\{[^{}]*\})*[^{}]*\})")
+ATTRIBUTE = re.compile(r'([a-zA-Z][\w-]*)\s*=\s*"([^"]*)"')
+CSS_COMMENT = re.compile(r"/\*.*?\*/", re.DOTALL)
+CSS_RULE = re.compile(r"([^{}@]+)\{([^{}]*)\}")
+# A comment around a Jinja tag is kept, since removing it would drop the tag.
+HTML_COMMENT = re.compile(r"<!--(?!\[if)[^\x1a]*?-->")
+JINJA_PLACEHOLDER = re.compile("\x1aJiNjA&([0-9]+)\x1a")
+SLOT_PLACEHOLDER = re.compile("\x1aSlOt&([0-9]+)\x1a")
+SELECTOR = re.compile(r"^([a-z][\w-]*)?(?:([.#])([\w-]+))?$")
+SPACE_AFTER_BLOCK = re.compile(rf"(</?(?:{BLOCK_TAGS})\b[^<>]*>)\s+", re.IGNORECASE)
+SPACE_BEFORE_BLOCK = re.compile(rf"\s+(?=</?(?:{BLOCK_TAGS})\b)", re.IGNORECASE)
+STYLE_ATTRIBUTE = re.compile(r'\s+style\s*=\s*"([^"]*)"', re.IGNORECASE)
+START_TAG = re.compile(r"<([a-zA-Z][\w-]*)(\s[^<>]*?)?(\s*/?)>")
+WHITESPACE = re.compile(r"\s+")
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True, slots=True, order=True)
+class CSSRule:
+    specificity: tuple[int, int, int]
+    position: int
+    tag: str | None
+    kind: str | None
+    name: str | None
+    declarations: str
+
+    def matches(self, tag: str, attributes: dict[str, str]) -> bool:
+        if self.tag is not None and self.tag != tag.lower():
+            return False
+        if self.kind == "#":
+            return attributes.get("id") == self.name
+        if self.kind == ".":
+            return self.name in attributes.get("class", "").split()
+        return True
+
+
+def parse_stylesheet(css: str) -> list[CSSRule]:
+    """Parse the rules with simple selectors, ordered by precedence.
+
+    Only `tag`, `.class`, `#id` and `tag.class` selectors can be inlined,
+    so anything else, at-rules included, is skipped.
+    """
+    rules = []
+    css = AT_RULE.sub("", CSS_COMMENT.sub("", css))
+    for position, (selectors, body) in enumerate(CSS_RULE.findall(css)):
+        declarations = "; ".join(
+            WHITESPACE.sub(" ", declaration.strip())
+            for declaration in body.split(";")
+            if declaration.strip()
+        )
+        for selector in selectors.split(","):
+            if (match := SELECTOR.match(selector.strip())) is None:
+                continue
+            tag, kind, name = match.groups()
+            specificity = (int(kind == "#"), int(kind == "."), int(tag is not None))
+            rules.append(CSSRule(specificity, position, tag, kind, name, declarations))
+    return sorted(rules)
+
+
+def inline_css(html: str, rules: list[CSSRule]) -> str:
+    def inline(match: re.Match[str]) -> str:
+        tag, attributes, end = match.groups()
+        attributes = attributes or ""
+        values = dict(ATTRIBUTE.findall(attributes))
+        selected = values.get("class", "") + values.get("id", "")
+        if JINJA_PLACEHOLDER.search(selected):
+            logger.warning(
+                "Only the tag rules are inlined in `<%s%s>`, since its class or "
+                "id is rendered",
+                tag,
+                JINJA_PLACEHOLDER.sub("{…}", attributes),
+            )
+        declarations = [
+            rule.declarations for rule in rules if rule.matches(tag, values)
+        ]
+        if not declarations:
+            return match.group(0)
+        # Inline styles in the template keep the highest precedence. They
+        # stay in place, so that the Jinja tags of the attributes keep their
+        # order.
+        if style := STYLE_ATTRIBUTE.search(attributes):
+            declarations.append(style.group(1).strip().rstrip(";"))
+            style_attribute = "; ".join(declarations)
+            before, after = attributes[: style.start()], attributes[style.end() :]
+            return f'<{tag}{before} style="{style_attribute}"{after}{end}>'
+        style_attribute = "; ".join(declarations)
+        return f'<{tag}{attributes} style="{style_attribute}"{end}>'
+
+    return START_TAG.sub(inline, html)
+
+
+def minify_html(html: str) -> str:
+    html = HTML_COMMENT.sub("", html)
+    html = WHITESPACE.sub(" ", html)
+    html = SPACE_BEFORE_BLOCK.sub("", html)
+    return SPACE_AFTER_BLOCK.sub(r"\1", html)
+
+
+class EmailHTMLExtension(Extension):
+    """Inline the email stylesheet and minify static HTML at compile time.
+
+    Only the template data is rewritten, so rendering a compiled template
+    just interpolates the variables. The data is joined, with a
+    placeholder for each Jinja token, so that a tag with an expression in
+    its attributes is still styled.
+    """
+
+    stylesheet = "base/email.css"
+    suffix = ".html.jinja"
+
+    def filter_stream(self, stream: TokenStream) -> Iterator[Token]:
+        if not (stream.name or "").endswith(self.suffix):
+            yield from stream
+            return
+
+        # The runs of consecutive Jinja tokens, each with a placeholder.
+        runs: list[list[Token]] = []
+        html = []
+        in_run = False
+        for token in stream:
+            if token.type == "data":
+                html.append(token.value)
+            elif in_run:
+                runs[-1].append(token)
+            else:
+                html.append(f"\x1aJiNjA&{len(runs)}\x1a")
+                runs.append([token])
+            in_run = token.type != "data"
+
+        output = minify_html(inline_css("".join(html), self.get_rules()))
+        pieces = JINJA_PLACEHOLDER.split(output)
+        lineno = 1
+        for data, index in zip_longest(pieces[::2], pieces[1::2]):
+            if data:
+                yield Token(lineno, "data", data)
+            if index is not None:
+                run = runs[int(index)]
+                lineno = run[-1].lineno
+                yield from run
+
+    def get_rules(self) -> list[CSSRule]:
+        loader = self.environment.loader
+        if loader is None:
+            return []
+        try:
+            css, _, _ = loader.get_source(self.environment, self.stylesheet)
+        except TemplateNotFound:
+            return []
+        return parse_stylesheet(css)
+
+
+class Slot:
+    """A stand-in for a per-recipient value while a skeleton is rendered.
+
+    A slot can only be looked into or printed as is. Anything that would
+    make the output depend on its value raises UnsplittableTemplateError.
+    """
+
+    __slots__ = ("path", "registry")
+
+    def __init__(self, path: tuple[str, ...], registry: list[tuple[str, ...]]) -> None:
+        self.path = path
+        self.registry = registry
+
+    def __getattr__(self, name: str) -> Slot:
+        if name.startswith("__"):
+            raise AttributeError(name)
+        return Slot((*self.path, name), self.registry)
+
+    def __getitem__(self, key: str) -> Slot:
+        return Slot((*self.path, str(key)), self.registry)
+
+    def _unsplittable(self, *_args: object, **_kwargs: object) -> NoReturn:
+        raise UnsplittableTemplateError(".".join(self.path))
+
+    # Without __iter__, iter() would call __getitem__ with 0, 1, 2, ...
+    __bool__ = __call__ = __contains__ = __hash__ = __iter__ = __len__ = _unsplittable
+    __eq__ = __ne__ = __lt__ = __le__ = __gt__ = __ge__ = _unsplittable
+    __add__ = __radd__ = __sub__ = __rsub__ = __mul__ = __rmul__ = _unsplittable
+    __truediv__ = __rtruediv__ = __floordiv__ = __rfloordiv__ = _unsplittable
+    __mod__ = __rmod__ = __pow__ = __rpow__ = __neg__ = __pos__ = _unsplittable
+    __str__ = __int__ = __float__ = __index__ = _unsplittable
+
+    def placeholder(self) -> str:
+        # Mixed case and an ampersand, so that case and escaping filters
+        # applied after printing are caught by Skeleton.render.
+        self.registry.append(self.path)
+        return f"\x1aSlOt&{len(self.registry) - 1}\x1a"
+
+
+def finalize(value: object) -> object:
+    return value.placeholder() if isinstance(value, Slot) else value
+
+
+@dataclass(frozen=True, slots=True)
+class Skeleton:
+    """A rendered template with holes for the per-recipient values."""
+
+    template: Template
+    parts: Sequence[str]
+    slots: Sequence[tuple[str, ...]]
+
+    @classmethod
+    def render(
+        cls,
+        template: Template,
+        slot_names: Sequence[str],
+        context: Mapping[str, object],
+    ) -> Skeleton:
+        registry: list[tuple[str, ...]] = []
+        slots = {name: Slot((name,), registry) for name in slot_names}
+        pieces = SLOT_PLACEHOLDER.split(template.render({**context, **slots}))
+        parts = pieces[::2]
+        indices = [int(index) for index in pieces[1::2]]
+        if indices != list(range(len(registry))):
+            # A placeholder was transformed after it was printed, e.g. by a
+            # filter block, so the slots cannot be filled in verbatim.
+            raise UnsplittableTemplateError(template.name)
+        return cls(template=template, parts=parts, slots=registry)
+
+    def fill(self, context: Mapping[str, object]) -> str:
+        getattr_ = self.template.environment.getattr
+        output = [self.parts[0]]
+        for path, part in zip(self.slots, self.parts[1:], strict=True):
+            name, *attributes = path
+            value = context[name]
+            for attribute in attributes:
+                value = getattr_(value, attribute)
+            output.append(str(value))
+            output.append(part)
+        return "".join(output)
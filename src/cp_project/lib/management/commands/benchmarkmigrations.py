@@ -0,0 +1,79 @@
+from __future__ import annotations
+
+import json
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from pyutilkit.date_utils import now
+
+from cp_project.lib.migration_benchmark import benchmark_migrations
+
+if TYPE_CHECKING:
+    from argparse import ArgumentParser
+
+
+class Command(BaseCommand):
+    help = "Time the pending migrations against a seeded scratch database"
+
+    def add_arguments(self, parser: ArgumentParser) -> None:
+        parser.add_argument(
+            "--rows",
+            action="append",
+            default=[],
+            metavar="APP.MODEL=COUNT",
+            help="Rows to seed for a model, overriding the configured ones",
+        )
+        parser.add_argument(
+            "--base",
+            action="append",
+            default=[],
+            metavar="APP:MIGRATION",
+            help="Apply an app up to this migration before seeding (or `zero`)",
+        )
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=0.05,
+            help="Seconds between two samples of the held locks",
+        )
+        parser.add_argument("--output", type=Path, help="Where to save the results")
+        parser.add_argument(
+            "--keep", action="store_true", help="Keep the scratch database"
+        )
+
+    @staticmethod
+    def get_rows(overrides: list[str]) -> dict[str, int]:
+        rows = dict(settings.MIGRATION_BENCHMARK_ROWS)
+        for override in overrides:
+            label, sep, count = override.partition("=")
+            if not sep or not count.isdigit():
+                msg = f"Invalid row count `{override}`, expected APP.MODEL=COUNT"
+                raise CommandError(msg)
+            rows[label] = int(count)
+        return rows
+
+    def handle(self, *_args: object, **options: object) -> None:
+        rows = self.get_rows(options["rows"])  # type: ignore[arg-type]
+        results = {
+            "started_at": now().isoformat(),
+            **benchmark_migrations(
+                rows,
+                options["base"],  # type: ignore[arg-type]
+                interval=options["interval"],  # type: ignore[arg-type]
+                keep=bool(options["keep"]),
+            ),
+        }
+        output = options["output"] or settings.BASE_DIR.joinpath(
+            "local", "benchmarks", f"migrations-{now():%Y%m%dT%H%M%S}.json"
+        )
+        assert isinstance(output, Path)  # noqa: S101
+        output.parent.mkdir(parents=True, exist_ok=True)
+        output.write_text(json.dumps(results, indent=2) + "\n")
+
+        for timing in results["migrations"]:  # type: ignore[union-attr]
+            self.stdout.write(
+                f"⏱️ {timing['app']}::{timing['name']}: {timing['seconds']:.3f}s"  # type: ignore[index,call-overload]
+            )
+        self.stdout.write(f"✔️ Results saved in {output}")
@@ -1,7 +1,12 @@
 from django.core.management.base import CommandError
 from django.core.management.commands.makemigrations import Command as MakeMigrations
 
-from cp_project.lib.utils import validate_migration_hashes, validate_migration_names
+from cp_project.lib.utils import (
+    get_migration_loader,
+    validate_migration_hashes,
+    validate_migration_locks,
+    validate_migration_names,
+)
 
 
 class Command(MakeMigrations):
@@ -30,7 +35,8 @@ class Command(MakeMigrations):
             raise CommandError(msg) from exc
         self.stdout.write("✔️ All changes are reflected in migrations")
 
-        if not validate_migration_hashes():
+        loader = get_migration_loader()
+        if not validate_migration_hashes(loader):
             msg = "Migration hashes have changed"
             raise CommandError(msg)
         self.stdout.write("✔️ All hashes are as expected")
@@ -39,3 +45,8 @@ class Command(MakeMigrations):
             msg = "Migration names are not as expected"
             raise CommandError(msg)
         self.stdout.write("✔️ All migration names are as expected")
+
+        if not validate_migration_locks(loader):
+            msg = "Migrations lock large tables"
+            raise CommandError(msg)
+        self.stdout.write("✔️ No migration locks a large table")
@@ -4,7 +4,7 @@ from typing import TYPE_CHECKING
 
 from django.core.management.commands.makemigrations import Command as MakeMigrations
 
-from cp_project.lib.utils import format_app_migrations, save_migration_hashes
+from cp_project.lib.utils import format_migrations, save_migration_hashes
 
 if TYPE_CHECKING:
     from django.db.migrations import Migration
@@ -36,5 +36,8 @@ class Command(MakeMigrations):
         self.format_migrations(changes)
 
     def format_migrations(self, changes: dict[str, list[Migration]]) -> None:
-        for app_label, app_migrations in changes.items():
-            format_app_migrations(app_label, app_migrations)
+        format_migrations(
+            migration
+            for app_migrations in changes.values()
+            for migration in app_migrations
+        )
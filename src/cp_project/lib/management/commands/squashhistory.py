@@ -0,0 +1,165 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.migrations.executor import MigrationExecutor
+
+from cp_project.lib.migration_squash import (
+    get_migration_files,
+    get_partly_applied,
+    get_squashed_migrations,
+    prune_app,
+    purge_migration_modules,
+    squash_app,
+    time_loader,
+)
+from cp_project.lib.utils import (
+    format_migration_files,
+    get_migration_loader,
+    get_migrations_info,
+    save_migration_hashes,
+)
+
+if TYPE_CHECKING:
+    from argparse import ArgumentParser
+    from pathlib import Path
+
+    from django.db.migrations.loader import MigrationLoader
+    from django.db.migrations.state import ProjectState
+
+
+class Command(BaseCommand):
+    help = "Squash the migrations of each app up to a prefix"
+
+    def add_arguments(self, parser: ArgumentParser) -> None:
+        parser.add_argument(
+            "prefix", nargs="?", help="The prefix of the last migration to squash"
+        )
+        parser.add_argument(
+            "--app",
+            action="append",
+            default=[],
+            dest="apps",
+            help="The app to squash (default: every app of the project)",
+        )
+        parser.add_argument(
+            "--prune",
+            action="store_true",
+            help=(
+                "Delete the migrations that squashed ones replace, once every "
+                "database has migrated past the squash"
+            ),
+        )
+
+    @staticmethod
+    def verify_state(
+        project_apps: list[str], original_state: ProjectState
+    ) -> MigrationLoader:
+        purge_migration_modules(project_apps)
+        loader = get_migration_loader()
+        if loader.project_state() != original_state:
+            msg = "The squashed migrations do not produce the same state"
+            raise CommandError(msg)
+        return loader
+
+    def prune(self, apps: list[str], project_apps: list[str]) -> None:
+        """Delete the replaced migrations, unless this database needs them."""
+        executor = MigrationExecutor(connections[DEFAULT_DB_ALIAS])
+        loader = executor.loader
+        partly_applied = [
+            f"`{app}::{name}`"
+            for app in apps
+            for name in get_partly_applied(loader, app)
+        ]
+        if partly_applied:
+            msg = (
+                "The database applied only some of the migrations replaced by "
+                f"{', '.join(partly_applied)}"
+            )
+            raise CommandError(msg)
+
+        # A squash whose migrations were all applied must be recorded
+        # before it loses `replaces`, as migrate would do.
+        executor.check_replacements()
+        loader_time = time_loader(project_apps)
+        files = [
+            path
+            for app in project_apps
+            for path in get_migration_files(loader, app).values()
+        ]
+        pruned = False
+        for app in apps:
+            for name, paths in prune_app(loader, app, files).items():
+                pruned = True
+                self.stdout.write(
+                    f"✔️ Pruned {len(paths)} migrations replaced by `{app}::{name}`"
+                )
+        if not pruned:
+            self.stdout.write("💤 Nothing to prune")
+            return
+        format_migration_files(file for file in files if file.exists())
+        purge_migration_modules(project_apps)
+        save_migration_hashes()
+        self.stdout.write(
+            f"⏱️ Migration graph loaded in {loader_time:.3f}s before pruning, "
+            f"{time_loader(project_apps):.3f}s after"
+        )
+
+    def handle(self, *_args: object, **options: object) -> None:
+        project_apps = sorted(get_migrations_info())
+        apps = options["apps"] or project_apps
+        assert isinstance(apps, list)  # noqa: S101
+        if options["prune"]:
+            self.prune(apps, project_apps)
+            return
+        if options["prefix"] is None:
+            msg = "The prefix of the last migration to squash is required"
+            raise CommandError(msg)
+        prefix = str(options["prefix"]).zfill(4)
+
+        loader = get_migration_loader()
+        unpruned = [app for app in apps if get_squashed_migrations(loader, app)]
+        if unpruned:
+            msg = f"Prune the squashed migrations of {', '.join(unpruned)} first"
+            raise CommandError(msg)
+        original_state = loader.project_state()
+        snapshot = {
+            path: path.read_text()
+            for app in project_apps
+            for path in get_migration_files(loader, app).values()
+        }
+        created: list[Path] = []
+        try:
+            for app in apps:
+                squashed = squash_app(loader, app, prefix)
+                if squashed is None:
+                    self.stdout.write(f"💤 Nothing to squash in `{app}`")
+                    continue
+                path, replaced = squashed
+                created.append(path)
+                purge_migration_modules(project_apps)
+                loader = get_migration_loader()
+                self.stdout.write(f"✔️ Squashed {len(replaced)} migrations of `{app}`")
+
+            if not created:
+                return
+            format_migration_files(
+                file for file in [*snapshot, *created] if file.exists()
+            )
+            loader = self.verify_state(project_apps, original_state)
+        except BaseException:
+            for path in created:
+                path.unlink(missing_ok=True)
+            for path, source in snapshot.items():
+                path.write_text(source)
+            purge_migration_modules(project_apps)
+            raise
+
+        save_migration_hashes(loader)
+        self.stdout.write("✔️ The squashed migrations produce the same state")
+        # The graph only gets smaller once the replaced files are gone.
+        self.stdout.write(
+            "💡 Run with --prune once every database has migrated past the squash"
+        )
@@ -0,0 +1,62 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
+from django.conf import settings
+from django.middleware.gzip import GZipMiddleware as BaseGZipMiddleware, re_accepts_gzip
+from django.utils.cache import patch_vary_headers
+
+from cp_project.lib.http import compress
+
+if TYPE_CHECKING:
+    from django.http import HttpRequest
+    from django.http.response import HttpResponseBase
+
+
+class GZipMiddleware(BaseGZipMiddleware):
+    """Compress the responses of GZIP_MIN_LENGTH bytes or more.
+
+    Streaming responses are compressed chunk by chunk, whatever their
+    size. Views opt out with a truthy `gzip_exempt` attribute, which
+    APIView.as_view copies from the class. A response that carries its
+    `gzip_content`, like a cached one, is not compressed again.
+    """
+
+    def process_view(
+        self,
+        request: HttpRequest,
+        view_func: object,
+        _view_args: object,
+        _view_kwargs: object,
+    ) -> None:
+        if getattr(view_func, "gzip_exempt", False):
+            request.gzip_exempt = True  # type: ignore[attr-defined]
+
+    def process_response(
+        self, request: HttpRequest, response: HttpResponseBase
+    ) -> HttpResponseBase:
+        if getattr(request, "gzip_exempt", False):
+            return response
+        if response.streaming:
+            return super().process_response(request, response)
+
+        content: bytes = response.content  # type: ignore[attr-defined]
+        if len(content) < settings.GZIP_MIN_LENGTH:
+            return response
+        if response.has_header("Content-Encoding"):
+            return response
+        patch_vary_headers(response, ("Accept-Encoding",))
+        if not re_accepts_gzip.search(request.headers.get("Accept-Encoding", "")):
+            return response
+
+        compressed = getattr(response, "gzip_content", None) or compress(content)
+        if len(compressed) >= len(content):
+            return response
+        response.content = compressed  # type: ignore[attr-defined]
+        response.headers["Content-Length"] = str(len(compressed))
+        # The bytes changed, so a strong ETag has to become a weak one.
+        etag = response.get("ETag")
+        if etag and etag.startswith('"'):
+            response.headers["ETag"] = f"W/{etag}"
+        response.headers["Content-Encoding"] = "gzip"
+        return response
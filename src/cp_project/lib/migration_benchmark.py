@@ -0,0 +1,292 @@
+from __future__ import annotations
+
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING
+
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.migrations.executor import MigrationExecutor
+from django.db.migrations.recorder import MigrationRecorder
+from django.db.migrations.state import ProjectState
+
+if TYPE_CHECKING:
+    from collections.abc import Iterable, Iterator
+
+    from django.db.backends.base.base import BaseDatabaseWrapper
+    from django.db.backends.utils import CursorWrapper
+    from django.db.migrations import Migration
+    from django.db.models import Field, Model
+
+    from cp_project.lib.types import JSONDict, JSONList
+
+SCRATCH_SUFFIX = "migration_benchmark"
+LOCK_MODES = (
+    "AccessShareLock",
+    "RowShareLock",
+    "RowExclusiveLock",
+    "ShareUpdateExclusiveLock",
+    "ShareLock",
+    "ShareRowExclusiveLock",
+    "ExclusiveLock",
+    "AccessExclusiveLock",
+)
+LOCKS_QUERY = """
+SELECT c.relname, l.mode
+FROM pg_locks l
+JOIN pg_class c ON c.oid = l.relation
+WHERE l.pid = %s AND c.relkind = 'r' AND c.relnamespace = 'public'::regnamespace
+"""
+LOCK_WAIT_QUERY = "SELECT wait_event_type = 'Lock' FROM pg_stat_activity WHERE pid = %s"
+TABLE_SIZES_QUERY = """
+SELECT relname, pg_total_relation_size(oid)
+FROM pg_class
+WHERE relkind = 'r' AND relnamespace = 'public'::regnamespace
+"""
+
+MigrationKey = tuple[str, str]
+
+
+@dataclass(slots=True)
+class MigrationTiming:
+    app: str
+    name: str
+    seconds: float = 0
+    lock_wait_seconds: float = 0
+    locks: dict[str, str] = field(default_factory=dict)
+    size_deltas: dict[str, int] = field(default_factory=dict)
+
+    def as_dict(self) -> JSONDict:
+        return {
+            "app": self.app,
+            "name": self.name,
+            "seconds": round(self.seconds, 6),
+            "lock_wait_seconds": round(self.lock_wait_seconds, 6),
+            "locks": dict(self.locks),
+            "size_deltas": dict(self.size_deltas),
+        }
+
+
+class LockMonitor(threading.Thread):
+    """Sample the locks that a backend holds and waits for.
+
+    The sampling runs on its own connection, so it can see the locks that
+    the migration takes inside its transaction.
+    """
+
+    def __init__(self, timing: MigrationTiming, pid: int, interval: float) -> None:
+        super().__init__(daemon=True)
+        self.timing = timing
+        self.pid = pid
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def run(self) -> None:
+        connection = connections[DEFAULT_DB_ALIAS]
+        try:
+            with connection.cursor() as cursor:
+                while not self.stopped.wait(self.interval):
+                    self.sample(cursor)
+        finally:
+            connection.close()
+
+    def sample(self, cursor: CursorWrapper) -> None:
+        cursor.execute(LOCKS_QUERY, [self.pid])
+        for table, mode in cursor.fetchall():
+            held = self.timing.locks.get(table, LOCK_MODES[0])
+            if mode in LOCK_MODES and LOCK_MODES.index(mode) >= LOCK_MODES.index(held):
+                self.timing.locks[table] = mode
+        cursor.execute(LOCK_WAIT_QUERY, [self.pid])
+        row = cursor.fetchone()
+        if row is not None and row[0]:
+            self.timing.lock_wait_seconds += self.interval
+
+    def stop(self) -> None:
+        self.stopped.set()
+        self.join()
+
+
+@contextmanager
+def scratch_database(*, keep: bool) -> Iterator[BaseDatabaseWrapper]:
+    """Point the default connection to an empty database, as the test runner does.
+
+    Data migrations use the alias of the schema editor, so they run against
+    the scratch database as well.
+    """
+    connection = connections[DEFAULT_DB_ALIAS]
+    original_name = connection.settings_dict["NAME"]
+    name = f"{original_name}_{SCRATCH_SUFFIX}"
+    quoted_name = connection.ops.quote_name(name)
+    with connection._nodb_cursor() as cursor:  # noqa: SLF001
+        cursor.execute(f"DROP DATABASE IF EXISTS {quoted_name}")
+        cursor.execute(f"CREATE DATABASE {quoted_name}")
+    # A pool keeps the connection parameters it was opened with.
+    connection.close()
+    connection.close_pool()  # type: ignore[attr-defined]
+    connection.settings_dict["NAME"] = name
+    try:
+        yield connection
+    finally:
+        connection.close()
+        connection.close_pool()  # type: ignore[attr-defined]
+        connection.settings_dict["NAME"] = original_name
+        if not keep:
+            with connection._nodb_cursor() as cursor:  # noqa: SLF001
+                cursor.execute(f"DROP DATABASE {quoted_name}")
+
+
+def get_applied_migrations(base: Iterable[str]) -> set[MigrationKey]:
+    """Get the migrations to apply before seeding.
+
+    By default, these are the ones applied to the default database. Each
+    `app:migration` in base overrides the migrations of its app.
+    """
+    recorder = MigrationRecorder(connections[DEFAULT_DB_ALIAS])
+    applied = set(recorder.applied_migrations()) if recorder.has_table() else set()
+    graph = MigrationExecutor(connections[DEFAULT_DB_ALIAS]).loader.graph
+    for target in base:
+        app_label, name = target.split(":")
+        applied = {key for key in applied if key[0] != app_label}
+        if name != "zero":
+            applied.update(graph.forwards_plan((app_label, name)))
+    return applied
+
+
+def get_seed_expression(
+    field: Field[object, object], foreign_keys: dict[str, tuple[int, int]]
+) -> str | None:
+    """Get the SQL for the i-th value of a column, with i from generate_series."""
+    if field.is_relation:
+        first_id, count = foreign_keys[field.column]
+        return f"{first_id} + (i - 1) %% {count}"
+    internal_type = field.get_internal_type()
+    if field.unique or internal_type == "EmailField":
+        value = f"'{field.column}-' || i"
+        if internal_type == "EmailField":
+            value += " || '@example.com'"
+        return value
+    expressions = {
+        "BooleanField": "false",
+        "CharField": f"'{field.column}-' || i",
+        "DateField": "current_date",
+        "DateTimeField": "now() - i * interval '1 second'",
+        "DecimalField": "i",
+        "FloatField": "i",
+        "IntegerField": "i",
+        "JSONField": "'{}'",
+        "BigIntegerField": "i",
+        "PositiveIntegerField": "i",
+        "SmallIntegerField": "i",
+        "TextField": f"'{field.column}-' || i",
+        "UUIDField": "gen_random_uuid()",
+    }
+    if internal_type in expressions:
+        return expressions[internal_type]
+    return "NULL" if field.null else None
+
+
+def seed_model(connection: BaseDatabaseWrapper, model: type[Model], rows: int) -> int:
+    """Fill a table with generated rows, in a single statement."""
+    quote_name = connection.ops.quote_name
+    meta = model._meta  # noqa: SLF001
+    fields = [model_field for model_field in meta.fields if model_field.concrete]
+    foreign_keys = {}
+    with connection.cursor() as cursor:
+        for model_field in fields:
+            if model_field.related_model is None:
+                continue
+            target = model_field.related_model._meta  # type: ignore[union-attr]  # noqa: SLF001
+            cursor.execute(
+                f"SELECT min({quote_name(target.pk.column)}), count(*) "  # noqa: S608
+                f"FROM {quote_name(target.db_table)}"
+            )
+            first_id, count = cursor.fetchone()
+            if not count:
+                return 0
+            if model_field.unique:
+                rows = min(rows, count)
+            foreign_keys[model_field.column] = (first_id, count)
+
+        columns, expressions = [], []
+        for model_field in fields:
+            if model_field.primary_key:
+                continue
+            expression = get_seed_expression(model_field, foreign_keys)
+            if expression is None:
+                return 0
+            columns.append(quote_name(model_field.column))
+            expressions.append(expression)
+        cursor.execute(
+            f"INSERT INTO {quote_name(meta.db_table)} "  # noqa: S608
+            f"({', '.join(columns)}) "
+            f"SELECT {', '.join(expressions)} FROM generate_series(1, %s) AS i",
+            [rows],
+        )
+        cursor.execute(f"ANALYZE {quote_name(meta.db_table)}")
+    return rows
+
+
+def get_table_sizes(connection: BaseDatabaseWrapper) -> dict[str, int]:
+    with connection.cursor() as cursor:
+        cursor.execute(TABLE_SIZES_QUERY)
+        return dict(cursor.fetchall())
+
+
+def time_migration(
+    executor: MigrationExecutor,
+    state: ProjectState,
+    migration: Migration,
+    interval: float,
+) -> tuple[ProjectState, MigrationTiming]:
+    connection = executor.connection
+    timing = MigrationTiming(app=migration.app_label, name=migration.name)
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT pg_backend_pid()")
+        (pid,) = cursor.fetchone()
+    sizes_before = get_table_sizes(connection)
+    monitor = LockMonitor(timing, pid, interval)
+    monitor.start()
+    start = time.perf_counter()
+    try:
+        state = executor.apply_migration(state, migration)
+    finally:
+        timing.seconds = time.perf_counter() - start
+        monitor.stop()
+    sizes_after = get_table_sizes(connection)
+    for table in sizes_before.keys() | sizes_after.keys():
+        delta = sizes_after.get(table, 0) - sizes_before.get(table, 0)
+        if delta:
+            timing.size_deltas[table] = delta
+    return state, timing
+
+
+def benchmark_migrations(
+    rows: dict[str, int], base: Iterable[str], *, interval: float, keep: bool
+) -> JSONDict:
+    """Time the pending migrations against a seeded scratch database."""
+    applied = get_applied_migrations(base)
+    seeded: JSONDict = {}
+    timings: JSONList = []
+    with scratch_database(keep=keep) as connection:
+        executor = MigrationExecutor(connection)
+        plan = executor.migration_plan(executor.loader.graph.leaf_nodes())
+        state = ProjectState(real_apps=executor.loader.unmigrated_apps)
+        pending = []
+        for migration, _ in plan:
+            if (migration.app_label, migration.name) in applied:
+                state = executor.apply_migration(state, migration)
+            else:
+                pending.append(migration)
+
+        for label, count in rows.items():
+            app_label, model_name = label.split(".")
+            if (app_label, model_name.lower()) in state.models:
+                model = state.apps.get_model(app_label, model_name)
+                seeded[label] = seed_model(connection, model, count)
+
+        for migration in pending:
+            state, timing = time_migration(executor, state, migration, interval)
+            timings.append(timing.as_dict())
+
+    return {"seeded": seeded, "migrations": timings}
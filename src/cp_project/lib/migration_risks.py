@@ -0,0 +1,198 @@
+from __future__ import annotations
+
+import re
+import sys
+from dataclasses import dataclass
+from pathlib import Path
+from typing import TYPE_CHECKING, Literal
+
+from django.conf import settings
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import connection
+from django.db.migrations import operations
+from django.db.migrations.state import ProjectState
+from django.db.models import NOT_PROVIDED, Value
+
+if TYPE_CHECKING:
+    from collections.abc import Iterator
+
+    from django.db.migrations import Migration
+    from django.db.migrations.loader import MigrationLoader
+    from django.db.migrations.operations.base import Operation
+    from django.db.models import Field
+
+Risk = Literal["medium", "high"]
+
+ACCESS_EXCLUSIVE = "ACCESS EXCLUSIVE"
+ROW_EXCLUSIVE = "ROW EXCLUSIVE"
+SHARE = "SHARE"
+VARCHAR = re.compile(r"varchar\(([0-9]+)\)")
+
+
+@dataclass(frozen=True, slots=True)
+class OperationRisk:
+    app: str
+    migration: str
+    operation: str
+    table: str
+    lock: str
+    cost: str
+    risk: Risk
+
+    def __str__(self) -> str:
+        return (
+            f"`{self.app}::{self.migration}` {self.operation} on `{self.table}`: "
+            f"{self.lock} lock, {self.cost}"
+        )
+
+    @property
+    def blocking(self) -> bool:
+        return self.risk == "high" and self.table in settings.MIGRATION_LARGE_TABLES
+
+
+def get_table(state: ProjectState, app_label: str, model_name: str) -> str:
+    model_state = state.models[app_label, model_name.lower()]
+    db_table = model_state.options.get("db_table")
+    return str(db_table or f"{app_label}_{model_name.lower()}")
+
+
+def get_db_type(field: Field[object, object]) -> str | None:
+    if field.is_relation:
+        # Relations take the type of the target, which needs rendered models.
+        return None
+    return field.db_type(connection)
+
+
+def is_widening(old_type: str, new_type: str) -> bool:
+    """Whether postgres can change the column type without a rewrite."""
+    old_match = VARCHAR.fullmatch(old_type)
+    if new_type == "text":
+        return old_match is not None
+    new_match = VARCHAR.fullmatch(new_type)
+    if old_match is None or new_match is None:
+        return False
+    return int(new_match.group(1)) >= int(old_match.group(1))
+
+
+def is_indexed(field: Field[object, object]) -> bool:
+    return field.unique or field.db_index  # type: ignore[attr-defined]
+
+
+def adds_index(old: Field[object, object] | None, new: Field[object, object]) -> bool:
+    if new.primary_key or not is_indexed(new):
+        return False
+    return old is None or not is_indexed(old)
+
+
+def classify_add_field(
+    operation: operations.AddField,
+) -> tuple[str, str, Risk] | None:
+    field = operation.field
+    if field.db_default is not NOT_PROVIDED and not isinstance(field.db_default, Value):
+        return ACCESS_EXCLUSIVE, "table rewrite for a volatile default", "high"
+    if adds_index(None, field):
+        return SHARE, "index build", "high"
+    return None
+
+
+def classify_alter_field(
+    operation: operations.AlterField, state: ProjectState, app_label: str
+) -> tuple[str, str, Risk] | None:
+    model_state = state.models[app_label, operation.model_name_lower]
+    old, new = model_state.fields[operation.name], operation.field
+    old_type, new_type = get_db_type(old), get_db_type(new)
+    if old_type != new_type and not is_widening(old_type or "", new_type or ""):
+        return ACCESS_EXCLUSIVE, f"table rewrite from {old_type} to {new_type}", "high"
+    if old.null and not new.null:
+        return ACCESS_EXCLUSIVE, "table scan for NOT NULL", "high"
+    if adds_index(old, new):
+        return SHARE, "index build", "high"
+    return None
+
+
+def classify(
+    operation: Operation, state: ProjectState, app_label: str
+) -> tuple[str, str, Risk] | None:
+    if isinstance(operation, operations.AddIndex) and not isinstance(
+        operation, AddIndexConcurrently
+    ):
+        return SHARE, "index build without CONCURRENTLY", "high"
+    if isinstance(operation, operations.AddField):
+        return classify_add_field(operation)
+    if isinstance(operation, operations.AlterField):
+        return classify_alter_field(operation, state, app_label)
+    if isinstance(operation, operations.RunPython):
+        # Every row the function updates stays locked until the migration
+        # commits, which only matters when it goes over a large table.
+        risk: Risk = "high" if "model_name" in operation.hints else "medium"
+        return ROW_EXCLUSIVE, "row updates in a single transaction", risk
+    return None
+
+
+def get_target(operation: Operation, state: ProjectState, app_label: str) -> str | None:
+    if isinstance(operation, operations.RunPython):
+        model_name = operation.hints.get("model_name")
+        return get_table(state, app_label, model_name) if model_name else "?"
+    model_name = getattr(operation, "model_name", None) or getattr(
+        operation, "name", None
+    )
+    if model_name is None or (app_label, model_name.lower()) not in state.models:
+        return None
+    return get_table(state, app_label, model_name)
+
+
+def is_project_migration(migration: Migration, source: Path) -> bool:
+    module_file = sys.modules[migration.__module__].__file__
+    return module_file is not None and Path(module_file).is_relative_to(source)
+
+
+def analyze_migration(
+    migration: Migration, state: ProjectState
+) -> Iterator[OperationRisk]:
+    """Yield the risky operations of a migration, advancing the state."""
+    created_tables = set()
+    for operation in migration.operations:
+        table = get_target(operation, state, migration.app_label)
+        if table is not None and table not in created_tables:
+            classification = classify(operation, state, migration.app_label)
+            if classification is not None:
+                lock, cost, risk = classification
+                yield OperationRisk(
+                    app=migration.app_label,
+                    migration=migration.name,
+                    operation=type(operation).__name__,
+                    table=table,
+                    lock=lock,
+                    cost=cost,
+                    risk=risk,
+                )
+        operation.state_forwards(migration.app_label, state)
+        if isinstance(operation, operations.CreateModel):
+            # A table created in the same migration is still empty.
+            created_tables.add(get_target(operation, state, migration.app_label))
+
+
+def analyze_lock_risks(loader: MigrationLoader) -> list[OperationRisk]:
+    """Classify the operations of the project migrations by lock level.
+
+    The migrations are replayed in order on an unrendered project state,
+    so that each operation sees the fields it alters. Migrations that set
+    `lock_risk_reviewed = True` are replayed, but not reported.
+    """
+    risks = []
+    source = settings.BASE_DIR.joinpath("src")
+    state = ProjectState(real_apps=loader.unmigrated_apps)
+    seen = set()
+    for leaf in sorted(loader.graph.leaf_nodes()):
+        for key in loader.graph.forwards_plan(leaf):
+            if key in seen:
+                continue
+            seen.add(key)
+            migration = loader.graph.nodes[key]
+            migration_risks = list(analyze_migration(migration, state))
+            if getattr(migration, "lock_risk_reviewed", False):
+                continue
+            if not is_project_migration(migration, source):
+                continue
+            risks.extend(migration_risks)
+    return risks
@@ -0,0 +1,160 @@
+from __future__ import annotations
+
+import ast
+import re
+import sys
+import time
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+from django.core.management import call_command
+from django.db.migrations.loader import MigrationLoader
+
+if TYPE_CHECKING:
+    from collections.abc import Iterable
+
+SQUASHED_NAME = "squashed"
+SQUASHED_MIGRATION = re.compile(rf"([0-9]+)_{SQUASHED_NAME}")
+
+
+def get_migration_files(loader: MigrationLoader, app_label: str) -> dict[str, Path]:
+    files = {}
+    for (app, name), migration in loader.disk_migrations.items():
+        module_file = sys.modules[migration.__module__].__file__
+        if app == app_label and module_file is not None:
+            files[name] = Path(module_file)
+    return files
+
+
+def purge_migration_modules(app_labels: Iterable[str]) -> None:
+    """Forget the imported migrations, so that the loader reads them from disk."""
+    packages = [MigrationLoader.migrations_module(app)[0] for app in app_labels]
+    for module in list(sys.modules):
+        if any(module.startswith(f"{package}.") for package in packages if package):
+            del sys.modules[module]
+
+
+def time_loader(app_labels: Iterable[str]) -> float:
+    purge_migration_modules(app_labels)
+    start = time.perf_counter()
+    MigrationLoader(None, ignore_no_migrations=True)
+    return time.perf_counter() - start
+
+
+def rewrite_dependencies(
+    files: Iterable[Path], app_label: str, replaced: Iterable[str], squashed: str
+) -> None:
+    """Point the dependencies on the replaced migrations to the squashed one."""
+    names = "|".join(re.escape(name) for name in replaced)
+    app = re.escape(app_label)
+    dependency = re.compile(rf"""\(\s*["']{app}["'],\s*["'](?:{names})["'],?\s*\)""")
+    for file in files:
+        source = file.read_text()
+        rewritten = dependency.sub(f'("{app_label}", "{squashed}")', source)
+        if rewritten != source:
+            file.write_text(rewritten)
+
+
+def drop_replaces(path: Path) -> None:
+    """Remove the `replaces` of a squashed migration, once nothing needs it.
+
+    Django refuses to squash a migration that replaces others, so a
+    squashed migration becomes a plain one, which the next squash can
+    replace in turn.
+    """
+    source = path.read_text()
+    lines = source.splitlines(keepends=True)
+    for node in ast.walk(ast.parse(source)):
+        if (
+            isinstance(node, ast.Assign)
+            and len(node.targets) == 1
+            and isinstance(node.targets[0], ast.Name)
+            and node.targets[0].id == "replaces"
+            and node.end_lineno is not None
+        ):
+            del lines[node.lineno - 1 : node.end_lineno]
+            path.write_text("".join(lines))
+            return
+
+
+def squash_app(
+    loader: MigrationLoader, app_label: str, prefix: str
+) -> tuple[Path, list[str]] | None:
+    """Squash the history of an app, up to the migration with the prefix.
+
+    The squashed migration takes the prefix of the last one it replaces,
+    so the prefixes after it stay sequential. The replaced files are kept
+    until every database has applied them, since a database that applied
+    only some of them still needs their nodes. See `prune_app`.
+    """
+    files = get_migration_files(loader, app_label)
+    names = sorted(files)
+    last = next((name for name in names if name.split("_")[0] == prefix), None)
+    if last is None or names.index(last) == 0:
+        return None
+
+    # Django names it after 0001, which a previous squash could have taken.
+    squashed_name = f"{SQUASHED_NAME}_{prefix}"
+    call_command(
+        "squashmigrations",
+        app_label,
+        last,
+        squashed_name=squashed_name,
+        interactive=False,
+        include_header=False,
+        verbosity=0,
+    )
+    replaced = names[: names.index(last) + 1]
+    written = files[last].with_name(f"0001_{squashed_name}.py")
+    squashed = f"{prefix}_{SQUASHED_NAME}"
+    path = written.rename(written.with_name(f"{squashed}.py"))
+    return path, replaced
+
+
+def get_squashed_migrations(
+    loader: MigrationLoader, app_label: str
+) -> dict[str, list[str]]:
+    """Get the squashed migrations of an app whose replaced files still exist."""
+    files = get_migration_files(loader, app_label)
+    squashed = {}
+    for name in files:
+        if SQUASHED_MIGRATION.fullmatch(name) is None:
+            continue
+        replaces = loader.disk_migrations[app_label, name].replaces
+        if any(replaced in files for _, replaced in replaces):
+            squashed[name] = [replaced for _, replaced in replaces]
+    return squashed
+
+
+def get_partly_applied(loader: MigrationLoader, app_label: str) -> list[str]:
+    """Get the squashed migrations that the database applied only part of."""
+    partly_applied = []
+    for name, replaced in get_squashed_migrations(loader, app_label).items():
+        applied = [(app_label, key) in loader.applied_migrations for key in replaced]
+        if any(applied) and not all(applied):
+            partly_applied.append(name)
+    return partly_applied
+
+
+def prune_app(
+    loader: MigrationLoader, app_label: str, files: Iterable[Path]
+) -> dict[str, list[Path]]:
+    """Delete the files of the migrations that the squashed ones replace.
+
+    The dependencies on them are pointed to the squashed migration, and
+    its `replaces` is dropped, so the next squash can replace it. The
+    databases must have recorded it as applied by then, if they applied
+    the migrations that it replaces.
+    """
+    files = list(files)
+    app_files = get_migration_files(loader, app_label)
+    pruned = {}
+    for name, replaced in get_squashed_migrations(loader, app_label).items():
+        paths = [app_files[key] for key in replaced if key in app_files]
+        for path in paths:
+            path.unlink()
+        drop_replaces(app_files[name])
+        dependents = [file for file in files if file.exists()]
+        rewrite_dependencies(dependents, app_label, replaced, name)
+        pruned[name] = paths
+    return pruned
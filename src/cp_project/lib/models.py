@@ -1,13 +1,93 @@
-from collections.abc import Collection, Iterable
+import hashlib
+import time
+from collections.abc import Collection, Iterable, Iterator
+from contextlib import contextmanager
 from typing import ClassVar, Self, TypeVar, cast
 
-from django.db import models
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import caches
+from django.db import models, router, transaction
 from django.db.models.base import ModelBase
+from django.dispatch import receiver
 from pyutilkit.date_utils import now
 
+from cp_project.lib.cache import TieredCache
+from cp_project.lib.db import Pipeline, in_transaction, pipeline
+from cp_project.lib.invalidation import invalidated, publish
 from cp_project.lib.utils import Optimus
 
 _T_co = TypeVar("_T_co", bound=models.Model, covariant=True)
+GENERATION_KEY = "query:generation:{}"
+RESULT_KEY = "query:result:{}:{}"
+
+
+def get_generation_keys(labels: Iterable[str]) -> list[str]:
+    return [GENERATION_KEY.format(label) for label in sorted(labels)]
+
+
+def get_generations(keys: list[str]) -> list[int]:
+    """Get the generations of some models, starting the missing ones.
+
+    A generation starts from the current time, so a counter that was
+    evicted never goes back to a value that older results were cached at.
+    """
+    cache = caches[settings.QUERY_CACHE_ALIAS]
+    generations = cache.get_many(keys)
+    for key in keys:
+        if key not in generations:
+            start = time.time_ns()
+            cache.add(key, start, timeout=None)
+            generations[key] = cache.get(key, start)
+    return [int(generations[key]) for key in keys]
+
+
+def bump_generations(labels: Iterable[str]) -> None:
+    cache = caches[settings.QUERY_CACHE_ALIAS]
+    for key in get_generation_keys(labels):
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.add(key, time.time_ns(), timeout=None)
+
+
+def invalidate(
+    *model_classes: type[models.Model],
+    using: str | None = None,
+    pks: list[object] | None = None,
+) -> None:
+    """Make the cached results of queries over some models stale.
+
+    The generations are bumped on commit, so that neither the rows of a
+    transaction that rolls back nor the results that other transactions
+    cached before the commit are ever read. A transaction does not use the
+    query cache, so it needs no earlier bump to read its own writes. The
+    other workers are told on commit too, to evict their local entries.
+    """
+    labels = {model._meta.label_lower for model in model_classes}  # noqa: SLF001
+
+    def on_commit() -> None:
+        bump_generations(labels)
+        publish(labels, pks, using)
+
+    if in_transaction(using):
+        transaction.on_commit(on_commit, using=using)
+    else:
+        # The write is already in, and the commit hooks of test cases never run.
+        on_commit()
+
+
+@receiver(invalidated)
+def evict_generations(sender: type[models.Model] | None, **_kwargs: object) -> None:
+    """Drop the generations that another worker bumped from the local tier."""
+    cache = caches[settings.QUERY_CACHE_ALIAS]
+    if not isinstance(cache, TieredCache):
+        return
+    if sender is None:
+        cache.evict_local()
+    else:
+        label = sender._meta.label_lower  # noqa: SLF001
+        cache.evict_local(GENERATION_KEY.format(label))
 
 
 class BaseQuerySet(models.QuerySet[_T_co]):
@@ -21,10 +101,11 @@ class BaseQuerySet(models.QuerySet[_T_co]):
         unique_fields: Collection[str] | None = None,
     ) -> list[_T_co]:
         dt = now()
+        objs = list(objs)
         for obj in objs:
             obj.updated_at = dt  # type: ignore[attr-defined]
             obj.created_at = dt  # type: ignore[attr-defined]
-        return super().bulk_create(
+        created = super().bulk_create(
             objs,
             batch_size,
             ignore_conflicts,
@@ -32,6 +113,8 @@ class BaseQuerySet(models.QuerySet[_T_co]):
             update_fields,
             unique_fields,
         )
+        invalidate(self.model, using=self.write_db)
+        return created
 
     def bulk_update(
         self,
@@ -44,7 +127,31 @@ class BaseQuerySet(models.QuerySet[_T_co]):
             obj.updated_at = dt  # type: ignore[attr-defined]
         if "updated_at" not in fields:
             fields = [*fields, "updated_at"]
-        return super().bulk_update(objs, fields, batch_size)
+        updated = super().bulk_update(objs, fields, batch_size)
+        invalidate(self.model, using=self.write_db)
+        return updated
+
+    @property
+    def write_db(self) -> str:
+        """Get the database for the statements that write in raw SQL."""
+        db: str | None = self._db  # type: ignore[attr-defined]
+        return db or router.db_for_write(self.model, **self._hints)  # type: ignore[attr-defined]
+
+    @contextmanager
+    def pipeline(self) -> Iterator[Pipeline]:
+        """Batch statements in one round trip to the database that gets the writes.
+
+        The models that the statements write to are invalidated when the
+        block ends, even if it raised, since invalidating too much is harmless.
+        """
+        using = self.write_db
+        batch: Pipeline | None = None
+        try:
+            with pipeline(using=using) as batch:
+                yield batch
+        finally:
+            if batch is not None and batch.written:
+                invalidate(*batch.written, using=using)
 
     def flat_values(self, key: str) -> models.QuerySet[_T_co]:
         return cast(models.QuerySet[_T_co], self.values_list(key, flat=True))
@@ -60,9 +167,67 @@ class BaseQuerySet(models.QuerySet[_T_co]):
         optimus = Optimus()
         return self.filter(id__in={optimus.decode(oid_) for oid_ in oid})
 
+    def pk_ranges(self, batch_size: int) -> Iterator[tuple[object, object]]:
+        """Split the matching rows in primary key ranges of up to batch_size rows.
+
+        Each range is found by seeking past the previous one, so the whole
+        iteration reads the primary key index once.
+        """
+        queryset = self.order_by("pk").flat_values("pk")
+        batch = list(queryset[:batch_size])
+        while batch:
+            yield batch[0], batch[-1]
+            batch = list(queryset.filter(pk__gt=batch[-1])[:batch_size])
+
     def update(self, **kwargs: object) -> int:
         kwargs.setdefault("updated_at", now())
-        return super().update(**kwargs)
+        updated = super().update(**kwargs)
+        invalidate(self.model, using=self.write_db)
+        return updated
+
+    def delete(self) -> tuple[int, dict[str, int]]:
+        deleted = super().delete()
+        # The cascades can delete the rows of other models too.
+        invalidate(
+            *(apps.get_model(label) for label in deleted[1]), using=self.write_db
+        )
+        return deleted
+
+    def get_model_labels(self) -> set[str]:
+        """Get the labels of the models whose tables the query reads from."""
+        tables = {alias.table_name for alias in self.query.alias_map.values()}
+        tables.add(self.model._meta.db_table)  # noqa: SLF001
+        return {
+            meta.label_lower
+            for meta in (model._meta for model in apps.get_models())  # noqa: SLF001
+            if meta.db_table in tables
+        }
+
+    def cached(self, ttl: int | None = None, key: str | None = None) -> list[_T_co]:
+        """Evaluate the queryset, or get its result from the query cache.
+
+        The cache key is the key, if given, or a hash of the SQL, scoped by
+        the generations of the models that the query reads from. Any write
+        through BaseModel or BaseQuerySet to one of these models bumps its
+        generation, so the stale results are never read again. Writes that
+        bypass them must call invalidate.
+
+        In a transaction the queryset is evaluated, since the generations
+        are only bumped on commit, and its rows must not outlive a rollback.
+        """
+        if in_transaction(self.db):
+            return list(self.all())
+        cache = caches[settings.QUERY_CACHE_ALIAS]
+        generations = get_generations(get_generation_keys(self.get_model_labels()))
+        if key is None:
+            sql, params = self.query.sql_with_params()
+            key = hashlib.sha256(f"{self.db}:{sql}:{params!r}".encode()).hexdigest()
+        version = ":".join(map(str, generations))
+        result_key = RESULT_KEY.format(key, version)
+
+        timeout = settings.QUERY_CACHE_TTL if ttl is None else ttl
+        result = cache.get_or_set(result_key, lambda: list(self.all()), timeout=timeout)
+        return cast(list[_T_co], result)
 
 
 class BaseModel(models.Model):
@@ -88,6 +253,17 @@ class BaseModel(models.Model):
             using=using,
             update_fields=update_fields,
         )
+        invalidate(type(self), using=self._state.db, pks=[self.pk])
+
+    def delete(
+        self,
+        using: str | None = None,
+        keep_parents: bool = False,  # noqa: FBT001, FBT002
+    ) -> tuple[int, dict[str, int]]:
+        db = self._state.db
+        deleted = super().delete(using=using, keep_parents=keep_parents)
+        invalidate(*(apps.get_model(label) for label in deleted[1]), using=db)
+        return deleted
 
     @property
     def oid(self) -> int:
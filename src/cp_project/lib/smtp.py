@@ -0,0 +1,504 @@
+from __future__ import annotations
+
+import logging
+import os
+import re
+import smtplib
+import threading
+import time
+from collections import deque
+from dataclasses import asdict, dataclass
+from typing import TYPE_CHECKING, Literal
+
+from django.conf import settings
+from django.core.mail.backends.smtp import EmailBackend
+from django.core.mail.message import sanitize_address
+from django.core.mail.utils import DNS_NAME
+
+from cp_project.lib.emails import get_message_size, iter_message_chunks, split_message
+from cp_project.lib.exceptions import CircuitOpenError, PoolExhaustedError
+
+if TYPE_CHECKING:
+    from collections.abc import Callable, Sequence
+
+    from django.core.mail import EmailMessage
+
+    from cp_project.lib.types import JSONDict
+
+DOT_AT_LINE_START = re.compile(rb"^\.", re.MULTILINE)
+PING_AFTER = 5.0
+SMTP_OK = 250
+SMTP_SERVICE_UNAVAILABLE = 421
+SMTP_START_INPUT = 354
+SMTP_WILL_FORWARD = 251
+
+RelayKey = tuple[str, int, str, bool, bool]
+Refused = dict[str, tuple[int, bytes]]
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True, slots=True)
+class PoolStats:
+    size: int
+    idle: int
+    in_use: int
+    created: int
+    reused: int
+    discarded: int
+
+
+@dataclass(frozen=True, slots=True)
+class BreakerStats:
+    state: Literal["closed", "open", "half-open"]
+    failures: int
+    times_opened: int
+
+
+class CircuitBreaker:
+    """Fail fast once the relay has failed `threshold` times in a row.
+
+    After `reset_timeout` seconds a single trial request is let through;
+    its outcome decides whether the circuit closes or opens again.
+    """
+
+    def __init__(self, threshold: int, reset_timeout: float) -> None:
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.times_opened = 0
+        self.opened_at: float | None = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> Literal["closed", "open", "half-open"]:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at < self.reset_timeout:
+            return "open"
+        return "half-open"
+
+    def allow(self) -> bool:
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "open" or self._trial_running:
+                return False
+            self._trial_running = True
+            return True
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_running = False
+
+    def release_trial(self) -> None:
+        """Let another trial through, when the last one had no outcome."""
+        with self._lock:
+            self._trial_running = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            self._trial_running = False
+            if self.opened_at is None and self.failures < self.threshold:
+                return
+            if self.opened_at is None:
+                self.times_opened += 1
+            self.opened_at = time.monotonic()
+
+    def stats(self) -> BreakerStats:
+        return BreakerStats(
+            state=self.state, failures=self.failures, times_opened=self.times_opened
+        )
+
+
+class ConnectionPool:
+    """A bounded pool of keep-alive SMTP connections.
+
+    At most `size` connections are checked out at once; further callers
+    wait for a free slot, which is the backpressure on a slow relay.
+    """
+
+    def __init__(self, size: int, max_idle: float) -> None:
+        self.size = size
+        self.max_idle = max_idle
+        self.pid = os.getpid()
+        self.created = 0
+        self.reused = 0
+        self.discarded = 0
+        self._in_use = 0
+        self._idle: deque[tuple[smtplib.SMTP, float]] = deque()
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+
+    def acquire(
+        self, connect: Callable[[], smtplib.SMTP], timeout: float
+    ) -> smtplib.SMTP:
+        if not self._slots.acquire(timeout=timeout):
+            msg = f"No SMTP connection became available within {timeout}s"
+            raise PoolExhaustedError(msg)
+        try:
+            connection = self._checkout()
+            if connection is None:
+                connection = connect()
+                with self._lock:
+                    self.created += 1
+        except BaseException:
+            self._slots.release()
+            raise
+        with self._lock:
+            self._in_use += 1
+        return connection
+
+    def release(self, connection: smtplib.SMTP) -> None:
+        released_at = time.monotonic()
+        stale = []
+        with self._lock:
+            while self._idle and released_at - self._idle[0][1] >= self.max_idle:
+                stale.append(self._idle.popleft()[0])
+            self._idle.append((connection, released_at))
+            self._in_use -= 1
+        self._slots.release()
+        for stale_connection in stale:
+            self._quit(stale_connection)
+
+    def discard(self, connection: smtplib.SMTP) -> None:
+        with self._lock:
+            self._in_use -= 1
+        self._slots.release()
+        self._quit(connection)
+
+    def clear(self) -> None:
+        with self._lock:
+            idle = [connection for connection, _ in self._idle]
+            self._idle.clear()
+        for connection in idle:
+            self._quit(connection)
+
+    def stats(self) -> PoolStats:
+        with self._lock:
+            return PoolStats(
+                size=self.size,
+                idle=len(self._idle),
+                in_use=self._in_use,
+                created=self.created,
+                reused=self.reused,
+                discarded=self.discarded,
+            )
+
+    def _checkout(self) -> smtplib.SMTP | None:
+        while True:
+            with self._lock:
+                if not self._idle:
+                    return None
+                connection, released_at = self._idle.pop()
+            idle_for = time.monotonic() - released_at
+            if idle_for < self.max_idle and (
+                idle_for < PING_AFTER or self._ping(connection)
+            ):
+                with self._lock:
+                    self.reused += 1
+                return connection
+            self._quit(connection)
+
+    @staticmethod
+    def _ping(connection: smtplib.SMTP) -> bool:
+        try:
+            code, _ = connection.noop()
+        except (OSError, smtplib.SMTPException):
+            return False
+        return code == SMTP_OK
+
+    def _quit(self, connection: smtplib.SMTP) -> None:
+        with self._lock:
+            self.discarded += 1
+        try:
+            connection.quit()
+        except (OSError, smtplib.SMTPException):
+            connection.close()
+
+
+@dataclass(frozen=True, slots=True)
+class Relay:
+    pool: ConnectionPool
+    breaker: CircuitBreaker
+
+
+_relays: dict[RelayKey, Relay] = {}
+_relays_lock = threading.Lock()
+
+
+def get_relay(key: RelayKey) -> Relay:
+    with _relays_lock:
+        relay = _relays.get(key)
+        if relay is None or relay.pool.pid != os.getpid():
+            # Sockets inherited through a fork belong to the parent, so
+            # they are dropped without a QUIT rather than reused.
+            relay = _relays[key] = Relay(
+                pool=ConnectionPool(
+                    size=settings.EMAIL_POOL_SIZE,
+                    max_idle=settings.EMAIL_POOL_MAX_IDLE,
+                ),
+                breaker=CircuitBreaker(
+                    threshold=settings.EMAIL_CIRCUIT_BREAKER_THRESHOLD,
+                    reset_timeout=settings.EMAIL_CIRCUIT_BREAKER_RESET_TIMEOUT,
+                ),
+            )
+        return relay
+
+
+def reset_relays() -> None:
+    with _relays_lock:
+        relays = list(_relays.values())
+        _relays.clear()
+    for relay in relays:
+        if relay.pool.pid == os.getpid():
+            relay.pool.clear()
+
+
+def get_relay_metrics() -> dict[str, JSONDict]:
+    with _relays_lock:
+        relays = dict(_relays)
+    return {
+        f"{host}:{port}": {
+            "pool": asdict(relay.pool.stats()),
+            "breaker": asdict(relay.breaker.stats()),
+        }
+        for (host, port, *_), relay in relays.items()
+    }
+
+
+class PooledEmailBackend(EmailBackend):
+    """An SMTP backend that shares keep-alive connections per worker.
+
+    Connections are borrowed from a per-process pool instead of being
+    opened for every message, and a circuit breaker makes sends fail
+    fast while the relay is erroring or timing out. Messages are written
+    to the socket chunk by chunk, so file attachments are streamed from
+    disk instead of being flattened into one bytes object.
+
+    Recipients that the relay refuses do not count against the breaker,
+    since they say nothing about the health of the relay.
+    """
+
+    supports_streamed_attachments = True
+
+    def __init__(
+        self,
+        connect_timeout: float | None = None,
+        send_timeout: float | None = None,
+        pool_timeout: float | None = None,
+        *,
+        fail_silently: bool = False,
+        **kwargs: object,
+    ) -> None:
+        super().__init__(fail_silently=fail_silently, **kwargs)
+        self.connect_timeout: float = (
+            settings.EMAIL_CONNECT_TIMEOUT
+            if connect_timeout is None
+            else connect_timeout
+        )
+        self.send_timeout: float = (
+            settings.EMAIL_SEND_TIMEOUT if send_timeout is None else send_timeout
+        )
+        self.pool_timeout: float = (
+            settings.EMAIL_POOL_TIMEOUT if pool_timeout is None else pool_timeout
+        )
+        # Whether this backend holds the trial of a half-open breaker.
+        self.trial = False
+        self.relay_errors = 0
+        relay = get_relay(
+            (self.host, self.port, self.username, self.use_ssl, self.use_tls)
+        )
+        self.pool = relay.pool
+        self.breaker = relay.breaker
+
+    def open(self) -> bool | None:
+        if self.connection:
+            return False
+        if not self.breaker.allow():
+            if self.fail_silently:
+                return None
+            msg = f"Circuit to {self.host}:{self.port} is open"
+            raise CircuitOpenError(msg)
+        self.trial = self.breaker.state == "half-open"
+        try:
+            self.connection = self.pool.acquire(
+                self._connect, timeout=self.pool_timeout
+            )
+        except (OSError, smtplib.SMTPException):
+            self.record_failure()
+            if self.fail_silently:
+                return None
+            raise
+        return True
+
+    def close(self) -> None:
+        if self.trial:
+            # Opened, e.g. as a context manager, but nothing was sent.
+            self.trial = False
+            self.breaker.release_trial()
+        if self.connection is None:
+            return
+        self.pool.release(self.connection)
+        self.connection = None
+
+    def record_success(self) -> None:
+        self.trial = False
+        self.breaker.record_success()
+
+    def record_failure(self) -> None:
+        self.trial = False
+        self.breaker.record_failure()
+
+    def discard(self) -> None:
+        if self.connection is not None:
+            self.pool.discard(self.connection)
+            self.connection = None
+
+    def send_messages(self, email_messages: Sequence[EmailMessage]) -> int:
+        if not email_messages:
+            return 0
+        with self._lock:
+            new_conn_created = self.open()
+            if not self.connection or new_conn_created is None:
+                return 0
+            self.relay_errors = 0
+            try:
+                # The connection is already open, so the parent neither
+                # opens nor closes one and only loops over the messages.
+                num_sent = super().send_messages(email_messages)
+            except smtplib.SMTPRecipientsRefused:
+                self.record_success()
+                if new_conn_created:
+                    self.close()
+                raise
+            except (OSError, smtplib.SMTPException):
+                self.record_failure()
+                self.discard()
+                raise
+            if self.relay_errors:
+                # With fail_silently, the parent swallows the errors.
+                self.record_failure()
+                self.discard()
+                return num_sent
+            self.record_success()
+            if new_conn_created:
+                self.close()
+        return num_sent
+
+    def _send(self, email_message: EmailMessage) -> bool:
+        if not email_message.recipients() or self.connection is None:
+            return False
+        encoding = email_message.encoding or settings.DEFAULT_CHARSET
+        from_email = sanitize_address(email_message.from_email, encoding)
+        recipients = [
+            sanitize_address(address, encoding)
+            for address in email_message.recipients()
+        ]
+        try:
+            refused = self._transmit(
+                self.connection, from_email, recipients, email_message
+            )
+        except smtplib.SMTPRecipientsRefused:
+            if not self.fail_silently:
+                raise
+            return False
+        except smtplib.SMTPException:
+            self.relay_errors += 1
+            if not self.fail_silently:
+                raise
+            return False
+        if refused:
+            logger.warning("The relay refused some recipients: %s", refused)
+        return True
+
+    @staticmethod
+    def _abort(connection: smtplib.SMTP, code: int) -> None:
+        if code == SMTP_SERVICE_UNAVAILABLE:
+            connection.close()
+        else:
+            connection.rset()
+
+    @classmethod
+    def _transmit(
+        cls,
+        connection: smtplib.SMTP,
+        from_email: str,
+        recipients: list[str],
+        email_message: EmailMessage,
+    ) -> Refused:
+        """Send a message like `SMTP.sendmail`, but chunk by chunk.
+
+        The recipients that the relay refused are returned, and an error is
+        only raised if it refused all of them.
+        """
+        parts = split_message(email_message)
+        connection.ehlo_or_helo_if_needed()
+        options = []
+        if connection.does_esmtp and connection.has_extn("size"):
+            options.append(f"size={get_message_size(parts)}")
+        code, response = connection.mail(from_email, options)
+        if code != SMTP_OK:
+            cls._abort(connection, code)
+            raise smtplib.SMTPSenderRefused(code, response, from_email)
+        refused: Refused = {}
+        for recipient in recipients:
+            code, response = connection.rcpt(recipient)
+            if code not in {SMTP_OK, SMTP_WILL_FORWARD}:
+                refused[recipient] = (code, response)
+            if code == SMTP_SERVICE_UNAVAILABLE:
+                # The relay is going away, which is no refusal of the address.
+                connection.close()
+                raise smtplib.SMTPServerDisconnected(response.decode())
+        if len(refused) == len(recipients):
+            connection.rset()
+            raise smtplib.SMTPRecipientsRefused(refused)
+        code, response = connection.docmd("data")
+        if code != SMTP_START_INPUT:
+            cls._abort(connection, code)
+            raise smtplib.SMTPDataError(code, response)
+
+        chunk = b""
+        for chunk in iter_message_chunks(parts):
+            connection.send(DOT_AT_LINE_START.sub(b"..", chunk))
+        connection.send(b".\r\n" if chunk.endswith(b"\r\n") else b"\r\n.\r\n")
+        code, response = connection.getreply()
+        if code != SMTP_OK:
+            cls._abort(connection, code)
+            raise smtplib.SMTPDataError(code, response)
+        return refused
+
+    def _connect(self) -> smtplib.SMTP:
+        local_hostname = DNS_NAME.get_fqdn()
+        connection: smtplib.SMTP
+        if self.use_ssl:
+            connection = smtplib.SMTP_SSL(
+                self.host,
+                self.port,
+                local_hostname=local_hostname,
+                timeout=self.connect_timeout,
+                context=self.ssl_context,  # type: ignore[attr-defined]
+            )
+        else:
+            connection = smtplib.SMTP(
+                self.host,
+                self.port,
+                local_hostname=local_hostname,
+                timeout=self.connect_timeout,
+            )
+        try:
+            if not self.use_ssl and self.use_tls:
+                connection.starttls(context=self.ssl_context)  # type: ignore[attr-defined]
+            if self.username and self.password:
+                connection.login(self.username, self.password)
+        except (OSError, smtplib.SMTPException):
+            connection.close()
+            raise
+        if connection.sock is not None:
+            connection.sock.settimeout(self.send_timeout)
+        return connection
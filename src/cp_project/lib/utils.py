@@ -1,6 +1,7 @@
 from __future__ import annotations
 
 import subprocess
+import sys
 from collections import defaultdict
 from dataclasses import asdict, dataclass
 from itertools import pairwise
@@ -16,7 +17,12 @@ from pyutilkit.date_utils import now
 from pyutilkit.files import hash_file
 from pyutilkit.term import SGRCodes, SGRString
 
+from cp_project.lib.migration_risks import analyze_lock_risks
+from cp_project.lib.migration_squash import SQUASHED_MIGRATION
+
 if TYPE_CHECKING:
+    from collections.abc import Iterable
+
     from django.db.migrations import Migration
 
     from cp_project.accounts.models import User
@@ -60,9 +66,16 @@ class MigrationInfo:
         return f"{self.app}::{self.name}::{self.hash}"
 
     @classmethod
-    def from_writer_info(cls, app: str, migration_name: str, path: Path) -> Self:
+    def from_writer_info(
+        cls,
+        app: str,
+        migration_name: str,
+        path: Path,
+        cache: MigrationHashCache | None = None,
+    ) -> Self:
         prefix, *_ = migration_name.split("_")
-        return cls(app=app, prefix=prefix, name=migration_name, hash=hash_file(path))
+        file_hash = hash_file(path) if cache is None else cache.hash_file(path)
+        return cls(app=app, prefix=prefix, name=migration_name, hash=file_hash)
 
     @classmethod
     def from_lockfile(cls, lockfile_line: str) -> Self:
@@ -71,6 +84,60 @@ class MigrationInfo:
         return cls(app=app, prefix=prefix, name=migration_name, hash=hash_value)
 
 
+@dataclass(frozen=True, slots=True)
+class CachedHash:
+    mtime_ns: int
+    size: int
+    hash: str
+
+
+class MigrationHashCache:
+    """Hashes of migration files, keyed by path, mtime and size.
+
+    Only files that changed since the last run are hashed again.
+    """
+
+    def __init__(self, path: Path, entries: dict[str, CachedHash]) -> None:
+        self.path = path
+        self.entries = entries
+        self.seen: set[str] = set()
+        self.changed = False
+
+    @classmethod
+    def load(cls, path: Path) -> Self:
+        entries = {}
+        try:
+            with path.open() as file:
+                for line in file:
+                    name, mtime_ns, size, hash_value = line.strip().split("::")
+                    entries[name] = CachedHash(int(mtime_ns), int(size), hash_value)
+        except (OSError, ValueError):
+            entries = {}
+        return cls(path, entries)
+
+    def hash_file(self, path: Path) -> str:
+        stat = path.stat()
+        name = path.as_posix()
+        self.seen.add(name)
+        entry = self.entries.get(name)
+        if entry and (entry.mtime_ns, entry.size) == (stat.st_mtime_ns, stat.st_size):
+            return entry.hash
+
+        self.entries[name] = CachedHash(stat.st_mtime_ns, stat.st_size, hash_file(path))
+        self.changed = True
+        return self.entries[name].hash
+
+    def save(self) -> None:
+        if not self.changed and self.seen == self.entries.keys():
+            return
+        temp_path = self.path.with_suffix(".tmp")
+        with temp_path.open("w") as file:
+            for name in sorted(self.seen):
+                entry = self.entries[name]
+                file.write(f"{name}::{entry.mtime_ns}::{entry.size}::{entry.hash}\n")
+        temp_path.replace(self.path)
+
+
 class Optimus:
     def __init__(
         self,
@@ -100,34 +167,48 @@ def get_app_url(path: str, **kwargs: str | list[str]) -> URL:
     )
 
 
-def format_app_migrations(app_label: str, app_migrations: list[Migration]) -> None:
-    SGRString(
-        f"Reformatting migrations for `{app_label}`:",
-        params=[SGRCodes.BOLD, SGRCodes.CYAN],
-    ).print()
-
-    for migration in app_migrations:
-        file = MigrationWriter(migration).path
-        SGRString(
-            f"  📜 Reformatting migration `{migration}`...", params=[SGRCodes.BOLD]
-        ).print(end="\t")
-        subprocess.run(["black", "--quiet", file], check=True)  # noqa: S603,S607
-        subprocess.run(  # noqa: S603
-            ["ruff", "check", "--fix-only", "--quiet", file], check=True  # noqa: S607
-        )
-        SGRString("✔️", params=[SGRCodes.BOLD]).print()
+def format_migrations(migrations: Iterable[Migration]) -> None:
+    format_migration_files(MigrationWriter(migration).path for migration in migrations)
+
+
+def format_migration_files(paths: Iterable[str | Path]) -> None:
+    files = [str(path) for path in paths]
+    if not files:
+        return
+
+    SGRString("Reformatting migrations:", params=[SGRCodes.BOLD, SGRCodes.CYAN]).print()
+    for file in files:
+        SGRString(f"  📜 {file}", params=[SGRCodes.BOLD]).print()
+    # Both tools rewrite the same files, so they have to run one after the
+    # other, but each one formats all the files in a single process.
+    subprocess.run(["black", "--quiet", *files], check=True)  # noqa: S603,S607
+    subprocess.run(  # noqa: S603
+        ["ruff", "check", "--fix-only", "--quiet", *files], check=True  # noqa: S607
+    )
+    SGRString("✔️ Done", params=[SGRCodes.BOLD]).print()
+
 
+def get_migration_loader() -> MigrationLoader:
+    return MigrationLoader(None, ignore_no_migrations=True)
 
-def get_migrations_info() -> dict[str, list[MigrationInfo]]:
-    loader = MigrationLoader(None, ignore_no_migrations=True)
+
+def get_migrations_info(
+    loader: MigrationLoader | None = None,
+) -> dict[str, list[MigrationInfo]]:
+    loader = loader or get_migration_loader()
+    cache = MigrationHashCache.load(settings.MIGRATION_HASH_CACHE_PATH)
     hashes: dict[str, list[MigrationInfo]] = defaultdict(list)
     source = settings.BASE_DIR.joinpath("src")
     for (app, migration_name), migration in loader.graph.nodes.items():
-        path = Path(MigrationWriter(migration).path)
+        module_file = sys.modules[migration.__module__].__file__
+        if module_file is None:
+            continue
+        path = Path(module_file)
         if path.is_relative_to(source):
             hashes[app].append(
-                MigrationInfo.from_writer_info(app, migration_name, path)
+                MigrationInfo.from_writer_info(app, migration_name, path, cache)
             )
+    cache.save()
     return {app: sorted(migrations) for app, migrations in hashes.items()}
 
 
@@ -135,10 +216,10 @@ def get_app_migrations(app_migrations: list[MigrationInfo]) -> dict[str, Migrati
     return {migration.name: migration for migration in app_migrations}
 
 
-def save_migration_hashes() -> None:
-    all_migrations = get_migrations_info()
+def save_migration_hashes(loader: MigrationLoader | None = None) -> None:
+    all_migrations = get_migrations_info(loader)
     with settings.MIGRATION_HASHES_PATH.open("w") as file:
-        for app in sorted(get_migrations_info()):
+        for app in sorted(all_migrations):
             for migration_info in all_migrations[app]:
                 file.write(f"{migration_info}\n")
 
@@ -156,13 +237,17 @@ def validate_migration_names() -> bool:
     valid = True
     for app_name, migrations in get_saved_hashes().items():
         migration_prefixes = [migration.prefix for migration in migrations]
+        # A squashed history starts from the prefix of its last replaced one.
+        start = 1
+        if migrations and SQUASHED_MIGRATION.fullmatch(migrations[0].name):
+            start = int(migration_prefixes[0])
         for prefix in {a for a, b in pairwise(migration_prefixes) if a == b}:
             SGRString(
                 f"❌ Two migrations in `{app_name}` have the same prefix `{prefix}`"
             ).print()
             valid = False
-        for index, migration_prefix in enumerate(migration_prefixes, start=1):
-            name = migrations[index - 1].name
+        for index, migration_prefix in enumerate(migration_prefixes, start=start):
+            name = migrations[index - start].name
             try:
                 migration_order = int(migration_prefix)
             except ValueError:
@@ -181,8 +266,8 @@ def validate_migration_names() -> bool:
     return valid
 
 
-def validate_migration_hashes() -> bool:
-    actual_hashes = get_migrations_info()
+def validate_migration_hashes(loader: MigrationLoader | None = None) -> bool:
+    actual_hashes = get_migrations_info(loader)
     saved_hashes = get_saved_hashes()
     if actual_hashes != saved_hashes:
         for key in actual_hashes.keys() - saved_hashes.keys():
@@ -206,3 +291,14 @@ def validate_migration_hashes() -> bool:
         return False
 
     return True
+
+
+def validate_migration_locks(loader: MigrationLoader | None = None) -> bool:
+    valid = True
+    for risk in analyze_lock_risks(loader or get_migration_loader()):
+        if risk.blocking:
+            SGRString(f"❌ {risk} on a large table").print()
+            valid = False
+        else:
+            SGRString(f"⚠️ {risk} ({risk.risk} risk)").print()
+    return valid
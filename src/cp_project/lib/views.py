@@ -1,28 +1,80 @@
 from __future__ import annotations
 
+import hashlib
 import json
 import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+from dataclasses import dataclass
+from functools import partial
 from http import HTTPMethod, HTTPStatus
+from itertools import groupby
 from typing import TYPE_CHECKING, cast
 
+from django.conf import settings
 from django.contrib.auth.models import AnonymousUser
+from django.core.cache import caches
+from django.db import connections
 from django.http import HttpRequest
+from django.urls import Resolver404, resolve
 
 from cp_project.accounts.models import User
+from cp_project.lib.cache import LOCK_POLL_INTERVAL
+from cp_project.lib.db import (
+    advisory_lock,
+    is_stuck_to_primary,
+    route_reads,
+    stick_to_primary,
+)
 from cp_project.lib.exceptions import ValidationError
-from cp_project.lib.http import JsonResponse
-from cp_project.lib.types import JSONType
+from cp_project.lib.http import (
+    CachedResponse,
+    JsonResponse,
+    SubRequest,
+    build_response,
+    decompress,
+    etag_matches,
+    make_etag,
+    not_modified,
+)
+from cp_project.lib.models import get_generation_keys, get_generations
+from cp_project.lib.types import JSONDict, JSONType
 
 if TYPE_CHECKING:
     from collections.abc import Callable
+    from contextvars import Context
 
+    from django.db.models import Model
     from django.http import HttpRequest
 
 logger = logging.getLogger(__name__)
+SAFE_METHODS = {HTTPMethod.GET, HTTPMethod.HEAD, HTTPMethod.OPTIONS}
+RESPONSE_KEY = "response:{}:{}:{}"
+IDEMPOTENCY_KEY = "idempotency:{}:{}:{}"
+
+
+@dataclass(frozen=True, slots=True)
+class BatchItem:
+    method: HTTPMethod
+    path: str
+    body: JSONType = None
+
+    @property
+    def safe(self) -> bool:
+        return self.method in SAFE_METHODS
 
 
 class APIView:
     csrf_exempt = True
+    gzip_exempt = False
+    # The responses to GET are cached for that many seconds, if set, and
+    # expire early on any write to the cache models.
+    cache_timeout: int | None = None
+    cache_models: tuple[type[Model], ...] = ()
+    # The responses to POST with an Idempotency-Key are replayed to its
+    # retries, unless the view is exempt.
+    idempotency_exempt = False
 
     def __init__(self, **kwargs: object) -> None:
         # Called in the URLconf
@@ -61,6 +113,7 @@ class APIView:
         view.view_class = cls  # type: ignore[attr-defined]
         view.view_initkwargs = initkwargs  # type: ignore[attr-defined]
         view.csrf_exempt = cls.csrf_exempt  # type: ignore[attr-defined]
+        view.gzip_exempt = cls.gzip_exempt  # type: ignore[attr-defined]
 
         view.__doc__ = cls.__doc__
         view.__module__ = cls.__module__
@@ -74,10 +127,8 @@ class APIView:
         if hasattr(self, "get") and not hasattr(self, "head"):
 
             def head(**kwargs: object) -> JsonResponse:
-                response = self.get(**kwargs)
-                return JsonResponse(
-                    None, status=response.status_code, headers=response.headers
-                )
+                response = self.get_conditional_response(self.get, **kwargs)
+                return build_response(b"", response.headers, response.status_code)
 
             self.head = head
 
@@ -90,16 +141,22 @@ class APIView:
         method = self.request.method
         if method not in self._allowed_methods:
             return self.http_method_not_allowed()
-        try:
-            user: User | AnonymousUser = User.from_request(self.request)
-        except LookupError:
-            user = AnonymousUser()
+        user = self.authenticate()
 
         handler = getattr(self, method.lower())
+        if method == HTTPMethod.GET:
+            handler = partial(self.get_conditional_response, handler)
+        elif method == HTTPMethod.POST and not self.idempotency_exempt:
+            handler = partial(self.get_idempotent_response, handler)
         if self.has_permissions(user):
             self.request.user = user
 
-            return cast(JsonResponse, handler(**kwargs))
+            safe = method in SAFE_METHODS and not is_stuck_to_primary(user)
+            with route_reads(replica=safe) as routing:
+                response = cast(JsonResponse, handler(**kwargs))
+            if routing.wrote:
+                stick_to_primary(user)
+            return response
         if user.is_anonymous:
             return JsonResponse(
                 {"error": {"message": "You must be logged in to perform this action."}},
@@ -115,9 +172,151 @@ class APIView:
             status=HTTPStatus.FORBIDDEN,
         )
 
+    def authenticate(self) -> User | AnonymousUser:
+        if isinstance(self.request, SubRequest):
+            # The user of a batch is resolved once, for all its requests.
+            return self.request.user
+        try:
+            return User.from_request(self.request)
+        except LookupError:
+            return AnonymousUser()
+
+    def get_validator(self, **_kwargs: object) -> object | None:
+        """Get a cheap stand-in for the response to GET, like an `updated_at`.
+
+        It must change whenever the response does. If set, a request whose
+        If-None-Match matches it gets a 304 before the handler runs.
+        """
+        return None
+
+    def get_cache_key(self) -> str:
+        metas = [model._meta for model in self.cache_models]  # noqa: SLF001
+        generations = get_generations(
+            get_generation_keys(meta.label_lower for meta in metas)
+        )
+        path = hashlib.sha256(self.request.get_full_path().encode()).hexdigest()
+        version = ":".join(map(str, generations))
+        return RESPONSE_KEY.format(self.request.user.pk, path, version)
+
+    def get_conditional_response(  # type: ignore[misc]
+        self, get: Callable[..., JsonResponse], **kwargs: object
+    ) -> JsonResponse:
+        """Answer a GET from its validator or from the cache, if possible.
+
+        Otherwise, the handler runs, and a successful response gets a strong
+        ETag from its validator or its bytes.
+        """
+        if_none_match = self.request.headers.get("If-None-Match", "")
+        validator = self.get_validator(**kwargs)
+        etag = None
+        if validator is not None:
+            etag = make_etag(
+                self.request.get_full_path(), self.request.user.pk, validator
+            )
+            if etag_matches(etag, if_none_match):
+                return not_modified(etag)
+
+        cache = caches[settings.RESPONSE_CACHE_ALIAS]
+        key = None if self.cache_timeout is None else self.get_cache_key()
+        cached = None if key is None else cast(CachedResponse | None, cache.get(key))
+        if cached is not None:
+            response = cached.to_response()
+        else:
+            response = get(**kwargs)
+            if response.status_code != HTTPStatus.OK:
+                return response
+            response.headers["ETag"] = etag or make_etag(response.content)
+            if key is not None:
+                cached = CachedResponse.from_response(
+                    response, gzip=not self.gzip_exempt
+                )
+                cache.set(key, cached, timeout=self.cache_timeout)
+                response.gzip_content = cached.gzip_content
+
+        if etag_matches(response.headers["ETag"], if_none_match):
+            return not_modified(response.headers["ETag"])
+        return response
+
+    def get_idempotency_key(self, idempotency_key: str) -> str:
+        path = hashlib.sha256(self.request.get_full_path().encode()).hexdigest()
+        digest = hashlib.sha256(idempotency_key.encode()).hexdigest()
+        return IDEMPOTENCY_KEY.format(self.request.user.pk, path, digest)
+
+    def get_idempotent_response(  # type: ignore[misc]
+        self, post: Callable[..., JsonResponse], **kwargs: object
+    ) -> JsonResponse:
+        """Answer the retries of a POST with the response to the first one.
+
+        The first request with an Idempotency-Key runs the handler under an
+        advisory lock in the database, and its concurrent duplicates wait
+        for it, on any host. Any response but a server error is kept, along
+        with a digest of the body, so the key cannot be reused for another
+        request.
+        """
+        idempotency_key = self.request.headers.get("Idempotency-Key")
+        if not idempotency_key:
+            return post(**kwargs)
+        cache = caches[settings.RESPONSE_CACHE_ALIAS]
+        key = self.get_idempotency_key(idempotency_key)
+        digest = hashlib.sha256(self.request.body).hexdigest()
+        deadline = time.monotonic() + settings.IDEMPOTENCY_LOCK_TIMEOUT
+        stored = cast(tuple[str, CachedResponse] | None, cache.get(key))
+        while stored is None:
+            with advisory_lock(key) as locked:
+                if locked:
+                    # The first request could have finished since the lookup.
+                    stored = cast(tuple[str, CachedResponse] | None, cache.get(key))
+                    if stored is None:
+                        return self.store_response(post(**kwargs), key, digest)
+                    break
+            if time.monotonic() >= deadline:
+                return JsonResponse(
+                    {"error": {"message": "The request is still in progress"}},
+                    status=HTTPStatus.CONFLICT,
+                )
+            time.sleep(LOCK_POLL_INTERVAL)
+            stored = cast(tuple[str, CachedResponse] | None, cache.get(key))
+
+        stored_digest, cached = stored
+        if stored_digest != digest:
+            return JsonResponse(
+                {
+                    "error": {
+                        "message": "The Idempotency-Key is used by another request"
+                    }
+                },
+                status=HTTPStatus.UNPROCESSABLE_CONTENT,
+            )
+        response = cached.to_response()
+        response.headers["Idempotent-Replayed"] = "true"
+        return response
+
+    def store_response(
+        self, response: JsonResponse, key: str, digest: str
+    ) -> JsonResponse:
+        if response.status_code >= HTTPStatus.INTERNAL_SERVER_ERROR:
+            return response
+        cached = CachedResponse.from_response(response, gzip=not self.gzip_exempt)
+        cache = caches[settings.RESPONSE_CACHE_ALIAS]
+        cache.set(key, (digest, cached), timeout=settings.IDEMPOTENCY_KEY_TTL)
+        response.gzip_content = cached.gzip_content
+        return response
+
+    def read_body(self) -> bytes:
+        """Read the body, decoding it if it was sent compressed."""
+        encoding = self.request.headers.get("Content-Encoding", "identity").lower()
+        if encoding == "identity":
+            return self.request.body
+        if encoding != "gzip":
+            msg = f"Unsupported Content-Encoding: {encoding}"
+            raise ValidationError(msg)
+        max_size = settings.REQUEST_MAX_DECOMPRESSED_SIZE
+        return decompress(self.request.read, max_size)
+
     def get_data(self) -> JSONType:
+        body = self.read_body()
         try:
-            return cast(JSONType, json.loads(self.request.body))
+            return cast(JSONType, json.loads(body))
         except (json.JSONDecodeError, TypeError) as exc:
             msg = "Invalid JSON"
             raise ValidationError(msg) from exc
@@ -158,3 +357,93 @@ class SuperuserAPIView(APIView):
     @staticmethod
     def has_permissions(user: User | AnonymousUser) -> bool:
         return user.is_superuser
+
+
+class BatchAPIView(APIView):
+    """Run several API requests in one call, in-process.
+
+    The user is resolved once, for the whole batch. The requests run in
+    order, unless the batch is `parallel`, in which case consecutive safe
+    requests run at the same time, each on its own database connection.
+    Once a request of the batch writes, the later ones read from the primary.
+    """
+
+    @staticmethod
+    def parse_item(data: JSONType) -> BatchItem:
+        if not isinstance(data, dict):
+            msg = "Invalid request"
+            raise ValidationError(msg)
+        method, path = data.get("method"), data.get("path")
+        if not isinstance(method, str) or method.upper() not in HTTPMethod:
+            msg = f"Invalid method: {method}"
+            raise ValidationError(msg)
+        if not isinstance(path, str) or not path.startswith("/"):
+            msg = f"Invalid path: {path}"
+            raise ValidationError(msg)
+        return BatchItem(HTTPMethod(method.upper()), path, data.get("body"))
+
+    def get_items(self) -> tuple[list[BatchItem], bool]:
+        data = self.get_data()
+        if not isinstance(data, dict) or not isinstance(data.get("requests"), list):
+            msg = "A batch needs a list of requests"
+            raise ValidationError(msg)
+        requests = cast(list[JSONType], data["requests"])
+        if len(requests) > settings.BATCH_MAX_REQUESTS:
+            msg = f"A batch has up to {settings.BATCH_MAX_REQUESTS} requests"
+            raise ValidationError(msg)
+        parallel = data.get("parallel", False)
+        if not isinstance(parallel, bool):
+            msg = "Invalid parallel flag"
+            raise ValidationError(msg)
+        return [self.parse_item(request) for request in requests], parallel
+
+    def run_item(self, item: BatchItem) -> JSONDict:
+        not_found: JSONDict = {
+            "status": HTTPStatus.NOT_FOUND,
+            "body": {"error": {"message": f"No endpoint at {item.path}"}},
+        }
+        try:
+            match = resolve(item.path.partition("?")[0])
+        except Resolver404:
+            return not_found
+        view_class = getattr(match.func, "view_class", None)
+        if not isinstance(view_class, type) or not issubclass(view_class, APIView):
+            return not_found
+        if issubclass(view_class, BatchAPIView):
+            return not_found
+
+        request = SubRequest(
+            self.request, self.request.user, item.method, item.path, item.body
+        )
+        response = cast(JsonResponse, match.func(request, *match.args, **match.kwargs))
+        return {"status": response.status_code, "body": response.data}
+
+    def run_in_thread(self, item: BatchItem, context: Context) -> JSONDict:
+        try:
+            # The routing of the batch, so that the reads see its writes.
+            return context.run(self.run_item, item)
+        finally:
+            connections.close_all()
+
+    def post(self) -> JsonResponse:
+        try:
+            items, parallel = self.get_items()
+        except ValidationError as exc:
+            return JsonResponse(
+                {"error": {"message": str(exc)}}, status=HTTPStatus.BAD_REQUEST
+            )
+
+        responses: list[JSONType] = []
+        with ThreadPoolExecutor(settings.BATCH_MAX_WORKERS) as executor:
+            for concurrent, group in groupby(
+                items, key=lambda item: parallel and item.safe
+            ):
+                if concurrent:
+                    safe_items = list(group)
+                    contexts = [copy_context() for _ in safe_items]
+                    responses.extend(
+                        executor.map(self.run_in_thread, safe_items, contexts)
+                    )
+                else:
+                    responses.extend(map(self.run_item, group))
+        return JsonResponse({"responses": responses})
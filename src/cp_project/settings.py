@@ -1,4 +1,5 @@
 import contextlib
+import copy
 from datetime import timedelta
 from functools import partial
 from pathlib import Path
@@ -27,6 +28,9 @@ signup_token_expiry = project_setting(
     "CP_PREFIX_SIGNUP_TOKEN_EXPIRY", sections=["project", "tokens"], rtype=dict
 )
 SIGNUP_TOKEN_EXPIRY = timedelta(**signup_token_expiry)
+SIGNUP_TOKEN_STATELESS = project_setting(
+    "CP_PREFIX_SIGNUP_TOKEN_STATELESS", sections=["project", "tokens"], rtype=bool
+)
 access_token_expiry = project_setting(
     "CP_PREFIX_ACCESS_TOKEN_EXPIRY", sections=["project", "tokens"], rtype=dict
 )
@@ -78,9 +82,31 @@ if DEBUG and not CI_MODE:  # pragma: no cover
 
 MIDDLEWARE = [
     "django.middleware.security.SecurityMiddleware",
+    "cp_project.lib.middleware.GZipMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
     "corsheaders.middleware.CorsMiddleware",
 ]
+# Smaller responses, like tokens, are not worth the CPU to compress.
+GZIP_MIN_LENGTH = project_setting(
+    "CP_PREFIX_GZIP_MIN_LENGTH", sections=["project", "app"], rtype=int
+)
+REQUEST_MAX_DECOMPRESSED_SIZE = project_setting(
+    "CP_PREFIX_REQUEST_MAX_DECOMPRESSED_SIZE", sections=["project", "app"], rtype=int
+)
+BATCH_MAX_REQUESTS = project_setting(
+    "CP_PREFIX_BATCH_MAX_REQUESTS", sections=["project", "app"], rtype=int
+)
+BATCH_MAX_WORKERS = project_setting(
+    "CP_PREFIX_BATCH_MAX_WORKERS", sections=["project", "app"], rtype=int
+)
+IDEMPOTENCY_KEY_TTL = project_setting(
+    "CP_PREFIX_IDEMPOTENCY_KEY_TTL", sections=["project", "app"], rtype=int
+)
+# Duplicates wait that long for the first request, which should be longer
+# than any POST takes.
+IDEMPOTENCY_LOCK_TIMEOUT = project_setting(
+    "CP_PREFIX_IDEMPOTENCY_LOCK_TIMEOUT", sections=["project", "app"], rtype=int
+)
 
 TEMPLATES = [
     {
@@ -115,12 +141,69 @@ email_file_path = project_setting(
     "CP_PREFIX_EMAIL_FILE_PATH", sections=["project", "app", "email"]
 )
 EMAIL_FILE_PATH = BASE_DIR.joinpath(email_file_path)
+EMAIL_HOST = project_setting(
+    "CP_PREFIX_EMAIL_HOST", sections=["project", "app", "email", "smtp"]
+)
+EMAIL_PORT = project_setting(
+    "CP_PREFIX_EMAIL_PORT", sections=["project", "app", "email", "smtp"], rtype=int
+)
+EMAIL_CONNECT_TIMEOUT = project_setting(
+    "CP_PREFIX_EMAIL_CONNECT_TIMEOUT",
+    sections=["project", "app", "email", "smtp"],
+    rtype=float,
+)
+EMAIL_SEND_TIMEOUT = project_setting(
+    "CP_PREFIX_EMAIL_SEND_TIMEOUT",
+    sections=["project", "app", "email", "smtp"],
+    rtype=float,
+)
+EMAIL_POOL_SIZE = project_setting(
+    "CP_PREFIX_EMAIL_POOL_SIZE",
+    sections=["project", "app", "email", "smtp"],
+    rtype=int,
+)
+# How long a send waits for a free connection, when the pool is exhausted.
+EMAIL_POOL_TIMEOUT = project_setting(
+    "CP_PREFIX_EMAIL_POOL_TIMEOUT",
+    sections=["project", "app", "email", "smtp"],
+    rtype=float,
+)
+EMAIL_POOL_MAX_IDLE = project_setting(
+    "CP_PREFIX_EMAIL_POOL_MAX_IDLE",
+    sections=["project", "app", "email", "smtp"],
+    rtype=float,
+)
+EMAIL_CIRCUIT_BREAKER_THRESHOLD = project_setting(
+    "CP_PREFIX_EMAIL_CIRCUIT_BREAKER_THRESHOLD",
+    sections=["project", "app", "email", "smtp"],
+    rtype=int,
+)
+EMAIL_CIRCUIT_BREAKER_RESET_TIMEOUT = project_setting(
+    "CP_PREFIX_EMAIL_CIRCUIT_BREAKER_RESET_TIMEOUT",
+    sections=["project", "app", "email", "smtp"],
+    rtype=float,
+)
 email_template_dir = project_setting(
     "CP_PREFIX_EMAIL_TEMPLATE_DIR", sections=["project", "app", "email"]
 )
 EMAIL_TEMPLATE_DIR = PROJECT_DIR.joinpath(email_template_dir)
+EMAIL_MAX_ATTACHMENT_SIZE = project_setting(
+    "CP_PREFIX_EMAIL_MAX_ATTACHMENT_SIZE",
+    sections=["project", "app", "email"],
+    rtype=int,
+)
+EMAIL_BULK_CHUNK_SIZE = project_setting(
+    "CP_PREFIX_EMAIL_BULK_CHUNK_SIZE", sections=["project", "app", "email"], rtype=int
+)
 
 MIGRATION_HASHES_PATH = BASE_DIR.joinpath("migrations.lock")
+MIGRATION_HASH_CACHE_PATH = BASE_DIR.joinpath("migrations.lock.cache")
+MIGRATION_LARGE_TABLES = project_setting(
+    "CP_PREFIX_MIGRATION_LARGE_TABLES", sections=["project", "database"], rtype=list
+)
+MIGRATION_BENCHMARK_ROWS = project_setting(
+    "CP_PREFIX_MIGRATION_BENCHMARK_ROWS", sections=["project", "database"], rtype=dict
+)
 
 OPTIMUS_PRIME = project_setting(
     "CP_PREFIX_OPTIMUS_PRIME", sections=["project", "app", "optimus"], rtype=int
@@ -135,9 +218,134 @@ OPTIMUS_RANDOM = project_setting(
 
 # region Databases
 db_name = project_setting("CP_PREFIX_DB_NAME", sections=["project", "database"])
+db_conn_max_age = project_setting(
+    "CP_PREFIX_DB_CONN_MAX_AGE", sections=["project", "database"], rtype=int
+)
+db_conn_health_checks = project_setting(
+    "CP_PREFIX_DB_CONN_HEALTH_CHECKS", sections=["project", "database"], rtype=bool
+)
+db_pool = project_setting(
+    "CP_PREFIX_DB_POOL", sections=["project", "database", "pool"], rtype=bool
+)
+db_pool_min_size = project_setting(
+    "CP_PREFIX_DB_POOL_MIN_SIZE", sections=["project", "database", "pool"], rtype=int
+)
+db_pool_max_size = project_setting(
+    "CP_PREFIX_DB_POOL_MAX_SIZE", sections=["project", "database", "pool"], rtype=int
+)
+db_pool_timeout = project_setting(
+    "CP_PREFIX_DB_POOL_TIMEOUT", sections=["project", "database", "pool"], rtype=float
+)
+db_prepared_statements = project_setting(
+    "CP_PREFIX_DB_PREPARED_STATEMENTS", sections=["project", "database"], rtype=bool
+)
+db_prepare_threshold = project_setting(
+    "CP_PREFIX_DB_PREPARE_THRESHOLD", sections=["project", "database"], rtype=int
+)
+# The test runner creates and drops databases, which pooled connections block.
+DB_POOL = db_pool and not CI_MODE
 DATABASES = {
-    "default": {"ENGINE": "django.db.backends.postgresql", "NAME": db_name},
+    "default": {
+        "ENGINE": "django.db.backends.postgresql",
+        "NAME": db_name,
+        # A pooled connection goes back to the pool, so it is never persistent.
+        "CONN_MAX_AGE": 0 if DB_POOL else db_conn_max_age,
+        "CONN_HEALTH_CHECKS": db_conn_health_checks,
+        "OPTIONS": {
+            "pool": (
+                {
+                    "min_size": db_pool_min_size,
+                    "max_size": db_pool_max_size,
+                    "timeout": db_pool_timeout,
+                }
+                if DB_POOL
+                else False
+            ),
+            # Prepared statements belong to a server session, so they only
+            # work behind poolers that keep one, like the one above, and not
+            # behind pgbouncer in transaction mode.
+            "prepare_threshold": (
+                db_prepare_threshold if db_prepared_statements else None
+            ),
+        },
+    },
+}
+db_replicas = project_setting(
+    "CP_PREFIX_DB_REPLICAS", sections=["project", "database", "replicas"], rtype=dict
+)
+DB_REPLICA_STICKY_SECONDS = project_setting(
+    "CP_PREFIX_DB_REPLICA_STICKY_SECONDS",
+    sections=["project", "database", "replicas"],
+    rtype=int,
+)
+DATABASE_REPLICAS = list(db_replicas)
+for alias, replica_settings in db_replicas.items():
+    DATABASES[alias] = copy.deepcopy(DATABASES["default"]) | replica_settings
+if CI_MODE:
+    # A second database stands in for a replica in the tests. It is not
+    # in DATABASE_REPLICAS, so it gets migrated and nothing is routed to it
+    # unless a test overrides that.
+    DATABASES.setdefault(
+        "replica", copy.deepcopy(DATABASES["default"]) | {"NAME": f"{db_name}_replica"}
+    )
+DATABASE_ROUTERS = ["cp_project.lib.db.ReplicaRouter"]
+# endregion
+
+# region Caches
+CACHE_BACKENDS = {
+    "locmem": "django.core.cache.backends.locmem.LocMemCache",
+    "file": "django.core.cache.backends.filebased.FileBasedCache",
+    "database": "django.core.cache.backends.db.DatabaseCache",
+    "redis": "django.core.cache.backends.redis.RedisCache",
+    "shared_memory": "cp_project.lib.cache.SharedMemoryCache",
 }
+cache_tiers = project_setting(
+    "CP_PREFIX_CACHE_TIERS", sections=["project", "caches"], rtype=dict
+)
+cache_l1 = project_setting("CP_PREFIX_CACHE_L1", sections=["project", "caches"])
+cache_l2 = project_setting("CP_PREFIX_CACHE_L2", sections=["project", "caches"])
+cache_l1_timeout = project_setting(
+    "CP_PREFIX_CACHE_L1_TIMEOUT", sections=["project", "caches"], rtype=float
+)
+cache_lock_timeout = project_setting(
+    "CP_PREFIX_CACHE_LOCK_TIMEOUT", sections=["project", "caches"], rtype=float
+)
+CACHES = {
+    "default": {
+        "BACKEND": "cp_project.lib.cache.TieredCache",
+        "OPTIONS": {
+            "L1": cache_l1,
+            "L2": cache_l2,
+            "L1_TIMEOUT": cache_l1_timeout,
+            "LOCK_TIMEOUT": cache_lock_timeout,
+        },
+    },
+}
+for alias, tier in cache_tiers.items():
+    backend = tier.get("BACKEND", "locmem")
+    location = tier.get("LOCATION", alias)
+    if CI_MODE:
+        # The tests run against in-process tiers only, so that they neither
+        # need servers nor share entries across runs.
+        backend, location = "locmem", alias
+    elif backend in {"file", "shared_memory"}:
+        # A relative location is under the project, an absolute one is kept.
+        location = BASE_DIR.joinpath(location)
+    CACHES[alias] = tier | {"BACKEND": CACHE_BACKENDS[backend], "LOCATION": location}
+QUERY_CACHE_ALIAS = project_setting(
+    "CP_PREFIX_QUERY_CACHE_ALIAS", sections=["project", "caches"]
+)
+QUERY_CACHE_TTL = project_setting(
+    "CP_PREFIX_QUERY_CACHE_TTL", sections=["project", "caches"], rtype=int
+)
+RESPONSE_CACHE_ALIAS = project_setting(
+    "CP_PREFIX_RESPONSE_CACHE_ALIAS", sections=["project", "caches"]
+)
+cache_invalidation_bus = project_setting(
+    "CP_PREFIX_CACHE_INVALIDATION_BUS", sections=["project", "caches"], rtype=bool
+)
+# The tiers are in-process in the tests, so there is nobody to tell.
+CACHE_INVALIDATION_BUS = cache_invalidation_bus and not CI_MODE
 # endregion
 
 # region i18n/l10n
@@ -1,5 +1,8 @@
 from django.urls import include, path
 
+from cp_project.lib.views import BatchAPIView
+
 urlpatterns = [
     path("accounts/", include("cp_project.accounts.urls", namespace="accounts")),
+    path("batch", BatchAPIView.as_view(), name="batch"),
 ]
@@ -1,3 +1,7 @@
+from django.core.signals import request_started
 from django.core.wsgi import get_wsgi_application
 
+from cp_project.lib.invalidation import start_listener_on_request
+
 application = get_wsgi_application()
+request_started.connect(start_listener_on_request)
@@ -1,4 +1,5 @@
 import pytest
+from django.core.cache import caches
 
 from cp_project.accounts.models import User
 from cp_project.lib.utils import JWT
@@ -38,3 +39,9 @@ def user_tokens(active_user: User) -> dict[str, JWT]:
         "access": JWT.for_user(active_user, "access"),
         "refresh": JWT.for_user(active_user, "refresh"),
     }
+
+
+@pytest.fixture(autouse=True)
+def _clear_caches() -> None:
+    for cache in caches.all(initialized_only=True):
+        cache.clear()
@@ -0,0 +1,59 @@
+from __future__ import annotations
+
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+import pytest
+from django.core.management import call_command
+from django.test import override_settings
+from pyutilkit.date_utils import now
+
+from cp_project.accounts.models import SignupToken, User
+
+
+@pytest.fixture
+def _expired_signups() -> None:
+    for index in range(5):
+        user = User.objects.create_user(f"user{index}@example.com", is_active=False)
+        user.get_signup_token()
+    User.objects.create_user("active@example.com", is_active=True)
+    old = now() - timedelta(days=2)
+    User.objects.update(created_at=old)
+    SignupToken.objects.update(created_at=old)
+    User.objects.create_user("new@example.com", is_active=False).get_signup_token()
+
+
+@pytest.mark.django_db
+@pytest.mark.usefixtures("_expired_signups")
+@override_settings(SIGNUP_TOKEN_EXPIRY=timedelta(days=1))
+@mock.patch("cp_project.accounts.management.commands.purgeexpired.time.sleep")
+def test_purge_expired(mock_sleep: mock.MagicMock) -> None:
+    stdout = StringIO()
+    call_command("purgeexpired", batch_size=2, pause=0.5, stdout=stdout)
+
+    assert set(User.objects.flat_values("email")) == {
+        "active@example.com",
+        "new@example.com",
+    }
+    assert SignupToken.objects.count() == 1
+    assert stdout.getvalue().splitlines() == [
+        "🗑️ Deleted 5 expired signup tokens in 3 batches",
+        "🗑️ Deleted 5 abandoned users in 3 batches",
+    ]
+    assert mock_sleep.call_args_list == [mock.call(0.5)] * 4
+
+
+@pytest.mark.django_db
+@pytest.mark.usefixtures("_expired_signups")
+@override_settings(SIGNUP_TOKEN_EXPIRY=timedelta(days=1))
+def test_purge_expired_dry_run() -> None:
+    stdout = StringIO()
+    call_command("purgeexpired", batch_size=10, dry_run=True, stdout=stdout)
+
+    assert User.objects.count() == 7
+    assert SignupToken.objects.count() == 6
+    assert stdout.getvalue().splitlines() == [
+        "🗑️ Would delete 5 expired signup tokens in 1 batches",
+        "🗑️ Would delete 5 abandoned users in 1 batches",
+    ]
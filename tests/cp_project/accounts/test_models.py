@@ -5,6 +5,7 @@ from typing import TYPE_CHECKING, Protocol
 
 import pytest
 from django.test import RequestFactory, override_settings
+from pyutilkit.date_utils import now
 
 from cp_project.accounts.models import SignupToken, User
 
@@ -106,3 +107,59 @@ def test_signup_token_str() -> None:
     signup_token = SignupTokenFactory().build(user=user)
     signup_token.save()
     assert str(signup_token).startswith("Signup token for ")
+
+
+@pytest.mark.django_db
+@override_settings(SIGNUP_TOKEN_EXPIRY=timedelta(days=1))
+def test_abandoned_users() -> None:
+    old = now() - timedelta(days=2)
+    User.objects.create_user("a@b.c", is_active=False)
+    expired_token = User.objects.create_user("d@e.f", is_active=False)
+    expired_token.get_signup_token()
+    SignupToken.objects.update(created_at=old)
+    live_token = User.objects.create_user("g@h.i", is_active=False)
+    live_token.get_signup_token()
+    User.objects.create_user("j@k.l", is_active=True)
+    User.objects.update(created_at=old)
+    User.objects.create_user("m@n.o", is_active=False)
+
+    assert set(User.objects.abandoned().flat_values("email")) == {"a@b.c", "d@e.f"}
+
+
+@pytest.mark.django_db
+def test_get_signup_token_replaces_previous_one(
+    inactive_user: User, django_assert_num_queries: DjangoAssertNumQueries
+) -> None:
+    with django_assert_num_queries(1):
+        first = inactive_user.get_signup_token()
+    with django_assert_num_queries(1):
+        second = inactive_user.get_signup_token()
+
+    assert second.id != first.id
+    assert second.user_id == inactive_user.id
+    assert second.created_at >= first.created_at
+    assert list(SignupToken.objects.flat_values("id")) == [second.id]
+
+
+@pytest.mark.django_db
+@override_settings(SIGNUP_TOKEN_STATELESS=True)
+def test_stateless_signup_token(
+    inactive_user: User, django_assert_num_queries: DjangoAssertNumQueries
+) -> None:
+    with django_assert_num_queries(0):
+        signup_token = inactive_user.get_signup_token()
+        link = signup_token.signup_link
+
+    assert "/confirm-email/signed/" in str(link)
+    assert not SignupToken.objects.exists()
+
+
+@pytest.mark.django_db
+@override_settings(SIGNUP_TOKEN_STATELESS=True)
+def test_confirm_signed_is_single_use(inactive_user: User) -> None:
+    token = inactive_user.get_signup_token().signed
+
+    assert SignupToken.objects.confirm_signed(token)
+    inactive_user.refresh_from_db()
+    assert inactive_user.is_active
+    assert not SignupToken.objects.confirm_signed(token)
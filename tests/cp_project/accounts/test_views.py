@@ -1,14 +1,23 @@
+from __future__ import annotations
+
 from http import HTTPStatus
+from typing import TYPE_CHECKING
 
 import pytest
 from freezegun import freeze_time
 
-from cp_project.accounts.models import User
-from cp_project.lib.utils import JWT
+from cp_project.accounts.models import SignupToken, User
 
-from tests.helpers.client import JsonTestClient
 from tests.helpers.factories.account import SignupTokenFactory, UserFactory
 
+if TYPE_CHECKING:
+    from pytest_django import DjangoAssertNumQueries
+
+    from cp_project.lib.types import JSONDict
+    from cp_project.lib.utils import JWT
+
+    from tests.helpers.client import JsonTestClient
+
 
 class TestObtainTokenView:
     email = "jon.snow@winterfell.org"
@@ -82,6 +91,34 @@ def test_account_creation_success(json_client: JsonTestClient) -> None:
     assert response.status_code == HTTPStatus.CREATED
 
 
+@pytest.mark.django_db
+def test_account_creation_retries_are_replayed(json_client: JsonTestClient) -> None:
+    data: JSONDict = {
+        "email": "jon.snow@winterfell.org",
+        "password": "WwOQa7;S#8HAr#L^",
+    }
+    headers = {"Idempotency-Key": "signup-1"}
+    first = json_client.post("/accounts/", data=data, headers=headers)
+    retry = json_client.post("/accounts/", data=data, headers=headers)
+    assert first.status_code == retry.status_code == HTTPStatus.CREATED
+    assert retry.headers["Idempotent-Replayed"] == "true"
+    assert User.objects.filter(email=data["email"]).count() == 1
+
+
+@pytest.mark.django_db
+def test_account_creation_reused_idempotency_key(json_client: JsonTestClient) -> None:
+    headers = {"Idempotency-Key": "signup-1"}
+    data: JSONDict = {
+        "email": "jon.snow@winterfell.org",
+        "password": "WwOQa7;S#8HAr#L^",
+    }
+    json_client.post("/accounts/", data=data, headers=headers)
+    data["email"] = "arya.stark@winterfell.org"
+    response = json_client.post("/accounts/", data=data, headers=headers)
+    assert response.status_code == HTTPStatus.UNPROCESSABLE_CONTENT
+    assert not User.objects.filter(email=data["email"]).exists()
+
+
 @pytest.mark.django_db
 @pytest.mark.parametrize(
     ("email", "password"),
@@ -196,12 +233,20 @@ def test_refresh_token_wrong_format(
 
 
 @pytest.mark.django_db
-def test_confirm_email(inactive_user: User, json_client: JsonTestClient) -> None:
+def test_confirm_email(
+    inactive_user: User,
+    json_client: JsonTestClient,
+    django_assert_num_queries: DjangoAssertNumQueries,
+) -> None:
     signup_token = SignupTokenFactory().build(user=inactive_user)
     signup_token.save()
-    response = json_client.post(f"/accounts/confirm-email/{signup_token.oid}")
+    with django_assert_num_queries(1):
+        response = json_client.post(f"/accounts/confirm-email/{signup_token.oid}")
     assert response.status_code == HTTPStatus.NO_CONTENT
     assert response.data is None
+    inactive_user.refresh_from_db()
+    assert inactive_user.is_active
+    assert not SignupToken.objects.exists()
 
 
 @pytest.mark.django_db
@@ -223,7 +268,47 @@ def test_confirm_email_expired_token(
     signup_token.save()
     response = json_client.post(f"/accounts/confirm-email/{signup_token.oid}")
     assert response.status_code == HTTPStatus.UNAUTHORIZED
+    inactive_user.refresh_from_db()
+    assert not inactive_user.is_active
+    assert SignupToken.objects.exists()
     assert isinstance(response.data, dict)
     assert "error" in response.data
     assert isinstance(response.data["error"], dict)
     assert "message" in response.data["error"]
+
+
+@pytest.mark.django_db
+def test_confirm_signed_email(
+    inactive_user: User,
+    json_client: JsonTestClient,
+    django_assert_num_queries: DjangoAssertNumQueries,
+) -> None:
+    token = SignupToken(user=inactive_user).signed
+    with django_assert_num_queries(2):
+        response = json_client.post(f"/accounts/confirm-email/signed/{token}")
+    assert response.status_code == HTTPStatus.NO_CONTENT
+    assert response.data is None
+    inactive_user.refresh_from_db()
+    assert inactive_user.is_active
+
+
+@pytest.mark.django_db
+def test_confirm_signed_email_bad_signature(json_client: JsonTestClient) -> None:
+    response = json_client.post("/accounts/confirm-email/signed/not-signed")
+    assert response.status_code == HTTPStatus.NOT_FOUND
+    assert isinstance(response.data, dict)
+    assert "error" in response.data
+
+
+@pytest.mark.django_db
+def test_confirm_signed_email_expired_token(
+    inactive_user: User, json_client: JsonTestClient
+) -> None:
+    with freeze_time("1970-01-01"):
+        token = SignupToken(user=inactive_user).signed
+    response = json_client.post(f"/accounts/confirm-email/signed/{token}")
+    assert response.status_code == HTTPStatus.UNAUTHORIZED
+    inactive_user.refresh_from_db()
+    assert not inactive_user.is_active
+    assert isinstance(response.data, dict)
+    assert "error" in response.data
@@ -0,0 +1,46 @@
+from __future__ import annotations
+
+import json
+from typing import TYPE_CHECKING
+
+import pytest
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+
+if TYPE_CHECKING:
+    from pathlib import Path
+
+
+@pytest.mark.django_db(transaction=True)
+def test_seeds_the_migrated_models(tmp_path: Path) -> None:
+    output = tmp_path.joinpath("results.json")
+    call_command(
+        "benchmarkmigrations",
+        rows=["accounts.User=20", "accounts.SignupToken=30"],
+        output=output,
+    )
+
+    results = json.loads(output.read_text())
+    assert results["seeded"] == {"accounts.User": 20, "accounts.SignupToken": 20}
+    assert results["migrations"] == []
+    assert connection.settings_dict["NAME"] == "test_cp_database"
+
+
+@pytest.mark.django_db(transaction=True)
+def test_times_the_pending_migrations(tmp_path: Path) -> None:
+    output = tmp_path.joinpath("results.json")
+    call_command("benchmarkmigrations", base=["accounts:zero"], rows=[], output=output)
+
+    results = json.loads(output.read_text())
+    assert results["seeded"] == {}
+    timing, *_ = results["migrations"]
+    assert timing["app"] == "accounts"
+    assert timing["name"] == "0001_initial"
+    assert timing["seconds"] > 0
+    assert timing["size_deltas"]["accounts_user"] > 0
+
+
+def test_invalid_rows() -> None:
+    with pytest.raises(CommandError):
+        call_command("benchmarkmigrations", rows=["accounts.User"])
@@ -12,6 +12,10 @@ from cp_project.lib.management.commands.checkmigrations import Command
     "cp_project.lib.management.commands.checkmigrations.validate_migration_hashes",
     new=mock.MagicMock(return_value=True),
 )
+@mock.patch(
+    "cp_project.lib.management.commands.checkmigrations.validate_migration_locks",
+    new=mock.MagicMock(return_value=True),
+)
 @mock.patch(
     "cp_project.lib.management.commands.checkmigrations.validate_migration_names",
     new=mock.MagicMock(return_value=True),
@@ -39,6 +43,10 @@ def test_command_call_args(mock_super_handle: mock.Mock) -> None:
     "cp_project.lib.management.commands.checkmigrations.validate_migration_hashes",
     new=mock.MagicMock(return_value=True),
 )
+@mock.patch(
+    "cp_project.lib.management.commands.checkmigrations.validate_migration_locks",
+    new=mock.MagicMock(return_value=True),
+)
 @mock.patch(
     "cp_project.lib.management.commands.checkmigrations.validate_migration_names",
     new=mock.MagicMock(return_value=True),
@@ -53,6 +61,10 @@ def test_command_parent_error() -> None:
     "cp_project.lib.management.commands.checkmigrations.validate_migration_hashes",
     new=mock.MagicMock(return_value=False),
 )
+@mock.patch(
+    "cp_project.lib.management.commands.checkmigrations.validate_migration_locks",
+    new=mock.MagicMock(return_value=True),
+)
 @mock.patch(
     "cp_project.lib.management.commands.checkmigrations.validate_migration_names",
     new=mock.MagicMock(return_value=True),
@@ -67,6 +79,10 @@ def test_command_hashes_error() -> None:
     "cp_project.lib.management.commands.checkmigrations.validate_migration_hashes",
     new=mock.MagicMock(return_value=True),
 )
+@mock.patch(
+    "cp_project.lib.management.commands.checkmigrations.validate_migration_locks",
+    new=mock.MagicMock(return_value=True),
+)
 @mock.patch(
     "cp_project.lib.management.commands.checkmigrations.validate_migration_names",
     new=mock.MagicMock(return_value=False),
@@ -74,3 +90,21 @@ def test_command_hashes_error() -> None:
 def test_command_names_error() -> None:
     with pytest.raises(CommandError):
         Command().handle()
+
+
+@mock.patch.object(MakeMigrations, "handle", new=mock.MagicMock())
+@mock.patch(
+    "cp_project.lib.management.commands.checkmigrations.validate_migration_hashes",
+    new=mock.MagicMock(return_value=True),
+)
+@mock.patch(
+    "cp_project.lib.management.commands.checkmigrations.validate_migration_locks",
+    new=mock.MagicMock(return_value=False),
+)
+@mock.patch(
+    "cp_project.lib.management.commands.checkmigrations.validate_migration_names",
+    new=mock.MagicMock(return_value=True),
+)
+def test_command_locks_error() -> None:
+    with pytest.raises(CommandError):
+        Command().handle()
@@ -33,17 +33,17 @@ def test_command_call_args_real_run(
     assert mock_save.call_count == 1
 
 
-@mock.patch("cp_project.lib.management.commands.makemigrations.format_app_migrations")
+@mock.patch("cp_project.lib.management.commands.makemigrations.format_migrations")
 def test_command_formatter(mock_format: mock.Mock) -> None:
     first_mock = mock.MagicMock(name="first")
     second_mock = mock.MagicMock(name="second")
-    Command().format_migrations({"first": first_mock, "second": second_mock})
-    excepted_call_args_list = [
-        mock.call("first", first_mock),
-        mock.call("second", second_mock),
-    ]
-    assert mock_format.call_count == 2
-    assert mock_format.call_args_list == excepted_call_args_list
+    third_mock = mock.MagicMock(name="third")
+    Command().format_migrations(
+        {"first": [first_mock, second_mock], "second": [third_mock]}
+    )
+    assert mock_format.call_count == 1
+    (migrations,) = mock_format.call_args.args
+    assert list(migrations) == [first_mock, second_mock, third_mock]
 
 
 @mock.patch.object(MakeMigrations, "write_migration_files")
@@ -0,0 +1,184 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+from unittest import mock
+
+import pytest
+from django.conf import settings
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.db.migrations.recorder import MigrationRecorder
+from django.test import override_settings
+
+from cp_project.lib import utils
+from cp_project.lib.migration_squash import purge_migration_modules
+
+if TYPE_CHECKING:
+    from collections.abc import Iterator
+    from pathlib import Path
+
+PACKAGE = "squashed_accounts_migrations"
+MIGRATIONS = {
+    "0002_user_nickname": """
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [("accounts", "0001_initial")]
+    operations = [
+        migrations.AddField(
+            "user", "nickname", models.CharField(default="", max_length=10)
+        ),
+    ]
+""",
+    "0003_alter_user_nickname": """
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [("accounts", "0002_user_nickname")]
+    operations = [
+        migrations.AlterField(
+            "user", "nickname", models.CharField(default="", max_length=20)
+        ),
+    ]
+""",
+    "0004_signuptoken_note": """
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [("accounts", "0003_alter_user_nickname")]
+    operations = [
+        migrations.AddField("signuptoken", "note", models.TextField(default="")),
+    ]
+""",
+}
+
+
+@pytest.fixture
+def migrations_dir(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> Iterator[Path]:
+    package = tmp_path.joinpath("src", PACKAGE)
+    package.mkdir(parents=True)
+    package.joinpath("__init__.py").touch()
+    initial = settings.BASE_DIR.joinpath(
+        "src", "cp_project", "accounts", "migrations", "0001_initial.py"
+    )
+    package.joinpath("0001_initial.py").write_text(initial.read_text())
+    for name, source in MIGRATIONS.items():
+        package.joinpath(f"{name}.py").write_text(source)
+    monkeypatch.syspath_prepend(str(tmp_path.joinpath("src")))
+    with override_settings(
+        BASE_DIR=tmp_path,
+        MIGRATION_MODULES={"accounts": PACKAGE},
+        MIGRATION_HASHES_PATH=tmp_path.joinpath("migrations.lock"),
+        MIGRATION_HASH_CACHE_PATH=tmp_path.joinpath("migrations.lock.cache"),
+    ):
+        utils.save_migration_hashes()
+        yield package
+        purge_migration_modules(["accounts"])
+
+
+@pytest.mark.django_db
+@mock.patch("cp_project.lib.management.commands.squashhistory.format_migration_files")
+def test_squash_history(mock_format: mock.MagicMock, migrations_dir: Path) -> None:
+    call_command("squashhistory", "3")
+
+    assert sorted(path.name for path in migrations_dir.glob("0*.py")) == [
+        "0001_initial.py",
+        "0002_user_nickname.py",
+        "0003_alter_user_nickname.py",
+        "0003_squashed.py",
+        "0004_signuptoken_note.py",
+    ]
+    squashed = migrations_dir.joinpath("0003_squashed.py").read_text()
+    assert "replaces" in squashed
+    assert "0002_user_nickname" in squashed
+    assert mock_format.call_count == 1
+    assert [info.name for info in utils.get_saved_hashes()["accounts"]] == [
+        "0003_squashed",
+        "0004_signuptoken_note",
+    ]
+    assert utils.validate_migration_names()
+    assert utils.validate_migration_hashes()
+    with pytest.raises(CommandError, match="Prune the squashed migrations"):
+        call_command("squashhistory", "4")
+
+
+def record_applied(*names: str) -> None:
+    recorder = MigrationRecorder(connection)
+    for name in names:
+        recorder.record_applied("accounts", name)
+
+
+@pytest.mark.django_db
+@mock.patch("cp_project.lib.management.commands.squashhistory.format_migration_files")
+def test_prune_squashed_history(
+    mock_format: mock.MagicMock, migrations_dir: Path
+) -> None:
+    call_command("squashhistory", "3")
+    record_applied("0002_user_nickname", "0003_alter_user_nickname")
+
+    call_command("squashhistory", prune=True)
+
+    assert sorted(path.name for path in migrations_dir.glob("0*.py")) == [
+        "0003_squashed.py",
+        "0004_signuptoken_note.py",
+    ]
+    last = migrations_dir.joinpath("0004_signuptoken_note.py").read_text()
+    assert '("accounts", "0003_squashed")' in last
+    assert "replaces" not in migrations_dir.joinpath("0003_squashed.py").read_text()
+    assert ("accounts", "0003_squashed") in MigrationRecorder(
+        connection
+    ).applied_migrations()
+    assert mock_format.call_count == 2
+    assert utils.validate_migration_names()
+    assert utils.validate_migration_hashes()
+
+
+@pytest.mark.django_db
+@mock.patch("cp_project.lib.management.commands.squashhistory.format_migration_files")
+def test_squash_history_twice(
+    mock_format: mock.MagicMock, migrations_dir: Path
+) -> None:
+    call_command("squashhistory", "3")
+    record_applied("0002_user_nickname", "0003_alter_user_nickname")
+    call_command("squashhistory", prune=True)
+    migrations_dir.joinpath("0005_user_title.py").write_text(
+        MIGRATIONS["0002_user_nickname"]
+        .replace("0001_initial", "0004_signuptoken_note")
+        .replace("nickname", "title")
+    )
+
+    call_command("squashhistory", "5")
+    record_applied("0004_signuptoken_note", "0005_user_title")
+    call_command("squashhistory", prune=True)
+
+    assert [path.name for path in migrations_dir.glob("0*.py")] == ["0005_squashed.py"]
+    assert mock_format.call_count == 4
+    assert [info.name for info in utils.get_saved_hashes()["accounts"]] == [
+        "0005_squashed"
+    ]
+
+
+@pytest.mark.django_db
+@mock.patch("cp_project.lib.management.commands.squashhistory.format_migration_files")
+def test_prune_refuses_partly_applied_squashes(
+    mock_format: mock.MagicMock, migrations_dir: Path
+) -> None:
+    call_command("squashhistory", "3")
+    record_applied("0002_user_nickname")
+
+    with pytest.raises(CommandError, match="`accounts::0003_squashed`"):
+        call_command("squashhistory", prune=True)
+
+    assert len(list(migrations_dir.glob("0*.py"))) == 5
+    assert mock_format.call_count == 1
+
+
+@mock.patch("cp_project.lib.management.commands.squashhistory.format_migration_files")
+def test_nothing_to_squash(mock_format: mock.MagicMock, migrations_dir: Path) -> None:
+    call_command("squashhistory", "1")
+
+    assert len(list(migrations_dir.glob("0*.py"))) == 4
+    assert mock_format.call_count == 0
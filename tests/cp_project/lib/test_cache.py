@@ -0,0 +1,276 @@
+from __future__ import annotations
+
+import os
+import threading
+import time
+from typing import TYPE_CHECKING
+
+import pytest
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.test import override_settings
+
+from cp_project.lib.cache import VERSION, SharedMemoryCache, TieredCache, tables
+
+if TYPE_CHECKING:
+    from collections.abc import Iterator
+    from pathlib import Path
+
+    from django.core.cache.backends.base import BaseCache
+
+    from cp_project.lib.types import JSONDict
+
+
+@pytest.fixture
+def tiered() -> TieredCache:
+    cache = caches["default"]
+    assert isinstance(cache, TieredCache)
+    return cache
+
+
+@pytest.fixture
+def shared(tmp_path: Path) -> SharedMemoryCache:
+    # A single bucket, so that the keys compete for the same slots.
+    options: JSONDict = {"MAX_ENTRIES": 4, "WAYS": 4, "SLOT_SIZE": 128}
+    return SharedMemoryCache(str(tmp_path.joinpath("cache")), {"OPTIONS": options})
+
+
+@pytest.fixture
+def file_tiered(tmp_path: Path) -> Iterator[TieredCache]:
+    backends: JSONDict = {
+        "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+        "file": {
+            "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+            "LOCATION": str(tmp_path),
+        },
+    }
+    with override_settings(CACHES=backends):
+        yield TieredCache("", {"OPTIONS": {"L1": "default", "L2": "file"}})
+
+
+@pytest.fixture
+def l1(tiered: TieredCache) -> BaseCache:
+    return tiered.l1
+
+
+@pytest.fixture
+def l2(tiered: TieredCache) -> BaseCache:
+    return tiered.l2
+
+
+def test_tiers_are_local(l1: BaseCache, l2: BaseCache) -> None:
+    assert isinstance(l1, LocMemCache)
+    assert isinstance(l2, LocMemCache)
+    assert l1 is not l2
+
+
+def test_set_writes_both_tiers(
+    tiered: TieredCache, l1: BaseCache, l2: BaseCache
+) -> None:
+    tiered.set("key", "value")
+
+    key = tiered.make_key("key")
+    assert l1.get(key) == "value"
+    assert l2.get(key) == "value"
+
+
+def test_get_fills_the_local_tier(
+    tiered: TieredCache, l1: BaseCache, l2: BaseCache
+) -> None:
+    key = tiered.make_key("key")
+    l2.set(key, "shared")
+
+    assert tiered.get("key") == "shared"
+    assert l1.get(key) == "shared"
+
+
+def test_delete_clears_both_tiers(
+    tiered: TieredCache, l1: BaseCache, l2: BaseCache
+) -> None:
+    tiered.set("key", "value")
+    tiered.delete("key")
+
+    key = tiered.make_key("key")
+    assert l1.get(key) is None
+    assert l2.get(key) is None
+
+
+def test_incr_is_shared(tiered: TieredCache, l1: BaseCache, l2: BaseCache) -> None:
+    tiered.set("counter", 1)
+
+    assert tiered.incr("counter") == 2
+    key = tiered.make_key("counter")
+    assert l1.get(key) is None
+    assert l2.get(key) == 2
+
+
+def test_incr_outlives_a_concurrent_get(
+    tiered: TieredCache, l2: BaseCache, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    tiered.set("counter", 1)
+    incr = l2.incr
+
+    def incr_after_a_get(key: str, delta: int = 1) -> int:
+        # Another thread reads the counter before the shared one changes.
+        tiered.get("counter")
+        return incr(key, delta)
+
+    monkeypatch.setattr(l2, "incr", incr_after_a_get)
+
+    assert tiered.incr("counter") == 2
+    assert tiered.get("counter") == 2
+
+
+def test_incr_is_atomic_on_a_file_based_shared_cache(
+    file_tiered: TieredCache,
+) -> None:
+    file_tiered.set("counter", 0)
+    pids = []
+    for _ in range(4):
+        pid = os.fork()
+        if pid == 0:  # pragma: no cover
+            for _ in range(50):
+                file_tiered.incr("counter")
+            os._exit(0)
+        pids.append(pid)
+    for pid in pids:
+        _, status = os.waitpid(pid, 0)
+        assert os.waitstatus_to_exitcode(status) == 0
+
+    assert file_tiered.l2.get(file_tiered.make_key("counter")) == 200
+
+
+def test_get_or_set_computes_once(tiered: TieredCache) -> None:
+    calls = []
+
+    def compute() -> str:
+        calls.append(1)
+        time.sleep(0.05)
+        return "value"
+
+    results = []
+    threads = [
+        threading.Thread(
+            target=lambda: results.append(tiered.get_or_set("key", compute))
+        )
+        for _ in range(8)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert results == ["value"] * 8
+
+
+def test_get_or_set_waits_for_another_worker(
+    tiered: TieredCache, l2: BaseCache
+) -> None:
+    lock_key = tiered.make_key("key:lock")
+    l2.add(lock_key, value=True)
+    # Another worker holds the lock, and stores the value a bit later.
+    timer = threading.Timer(0.1, lambda: l2.set(tiered.make_key("key"), "theirs"))
+    timer.start()
+
+    assert tiered.get_or_set("key", lambda: "ours") == "theirs"
+    timer.join()
+
+
+def test_evict_local(tiered: TieredCache, l1: BaseCache, l2: BaseCache) -> None:
+    tiered.set("key", "value")
+    tiered.set("other", "value")
+    tiered.evict_local("key")
+
+    assert l1.get(tiered.make_key("key")) is None
+    assert l1.get(tiered.make_key("other")) == "value"
+    assert l2.get(tiered.make_key("key")) == "value"
+
+    tiered.evict_local()
+    assert l1.get(tiered.make_key("other")) is None
+    assert tiered.get("other") == "value"
+
+
+def test_shared_memory_cache(shared: SharedMemoryCache) -> None:
+    assert shared.get("key") is None
+    assert shared.add("key", {"value": 1})
+    assert not shared.add("key", "other")
+    assert shared.get("key") == {"value": 1}
+
+    shared.set("key", "other")
+    assert shared.get("key") == "other"
+    assert shared.delete("key")
+    assert not shared.delete("key")
+    assert shared.get("key", "default") == "default"
+
+
+def test_shared_memory_cache_expires(shared: SharedMemoryCache) -> None:
+    shared.set("key", "value", timeout=0)
+    assert shared.get("key") is None
+    assert shared.add("key", "value", timeout=None)
+    assert shared.touch("key", timeout=0)
+    assert not shared.has_key("key")
+
+
+def test_shared_memory_cache_incr(shared: SharedMemoryCache) -> None:
+    shared.set("counter", 1)
+
+    assert shared.incr("counter", 2) == 3
+    assert shared.get("counter") == 3
+    with pytest.raises(ValueError, match="not found"):
+        shared.incr("missing")
+
+
+def test_shared_memory_cache_skips_large_values(shared: SharedMemoryCache) -> None:
+    shared.set("key", "small")
+    shared.set("key", "large" * 100)
+
+    assert shared.get("key") is None
+
+
+def test_shared_memory_cache_evicts_least_recently_used(
+    shared: SharedMemoryCache,
+) -> None:
+    for key in "abcd":
+        shared.set(key, key)
+    shared.get("a")
+    shared.set("e", "e")
+
+    assert shared.get_many(["a", "b", "c", "d", "e"]) == {
+        "a": "a",
+        "c": "c",
+        "d": "d",
+        "e": "e",
+    }
+    shared.clear()
+    assert shared.get_many(["a", "c", "d", "e"]) == {}
+
+
+def test_shared_memory_cache_is_shared_across_processes(
+    shared: SharedMemoryCache,
+) -> None:
+    shared.set("key", "parent")
+    pid = os.fork()
+    if pid == 0:  # pragma: no cover
+        # The child maps the file anew, as a worker that was not forked would.
+        tables.clear()
+        del shared.table
+        shared.set("key", "child")
+        os._exit(0)
+    _, status = os.waitpid(pid, 0)
+
+    assert os.waitstatus_to_exitcode(status) == 0
+    assert shared.get("key") == "child"
+
+
+def test_shared_memory_cache_recovers_from_an_interrupted_write(
+    shared: SharedMemoryCache,
+) -> None:
+    table = shared.table
+    offset = table.get_offsets(0).start
+    # A writer died halfway, leaving the version of the slot odd.
+    VERSION.pack_into(table.map, offset, 1)
+
+    table.write(offset, 1, 0, b"key", b"value")
+
+    assert table.read(offset) == (1, 0, b"key", b"value")
@@ -0,0 +1,216 @@
+from __future__ import annotations
+
+import os
+from typing import TYPE_CHECKING
+
+import pytest
+from django.db import DatabaseError, DataError, connection, transaction
+from django.test import RequestFactory, override_settings
+from django.urls import path
+
+from cp_project.accounts.models import User
+from cp_project.lib.db import pipeline, route_reads
+from cp_project.lib.http import JsonResponse
+from cp_project.lib.views import APIView, BatchAPIView
+
+from tests.helpers.factories.account import UserFactory
+
+if TYPE_CHECKING:
+    from cp_project.lib.utils import JWT
+
+
+class EmailsAPIView(APIView):
+    @staticmethod
+    def get() -> JsonResponse:
+        return JsonResponse(list(User.objects.flat_values("email")), safe=False)
+
+    @staticmethod
+    def post() -> JsonResponse:
+        User.objects.create_user("new@example.com")
+        return JsonResponse(list(User.objects.flat_values("email")), safe=False)
+
+
+urlpatterns = [
+    path("batch", BatchAPIView.as_view()),
+    path("emails", EmailsAPIView.as_view()),
+]
+
+
+@pytest.fixture
+def replica_user() -> User:
+    user = UserFactory().build(email="replica@example.com")
+    user.save(using="replica")
+    return user
+
+
+@pytest.mark.django_db
+def test_forked_process_forgets_connections() -> None:
+    connection.ensure_connection()
+    pid = os.fork()
+    if pid == 0:  # pragma: no cover
+        os._exit(0 if connection.connection is None else 1)
+    _, status = os.waitpid(pid, 0)
+
+    assert os.waitstatus_to_exitcode(status) == 0
+    assert connection.connection is not None
+    assert connection.is_usable()
+
+
+@pytest.mark.usefixtures("replica_user")
+@pytest.mark.parametrize("replica", [True, False])
+@pytest.mark.django_db(databases=["default", "replica"])
+def test_route_reads_without_replicas(*, replica: bool) -> None:
+    with route_reads(replica=replica) as routing:
+        assert not User.objects.exists()
+    assert routing.replica is None
+
+
+@pytest.mark.usefixtures("replica_user")
+@pytest.mark.django_db(databases=["default", "replica"])
+@override_settings(DATABASE_REPLICAS=["replica"])
+def test_reads_after_a_write_go_to_the_primary() -> None:
+    with route_reads(replica=True) as routing:
+        assert User.objects.exists()
+        User.objects.create_user("primary@example.com")
+        emails = list(User.objects.flat_values("email"))
+
+    assert routing.wrote
+    assert emails == ["primary@example.com"]
+
+
+@pytest.mark.usefixtures("replica_user")
+@pytest.mark.django_db(databases=["default", "replica"])
+@override_settings(DATABASE_REPLICAS=["replica"])
+def test_safe_requests_read_from_a_replica() -> None:
+    view = EmailsAPIView.as_view()
+
+    response = view(RequestFactory().get("/"))
+
+    assert response.data == ["replica@example.com"]
+
+
+@pytest.mark.usefixtures("replica_user")
+@pytest.mark.django_db(databases=["default", "replica"])
+@override_settings(DATABASE_REPLICAS=["replica"])
+def test_unsafe_requests_read_from_the_primary() -> None:
+    view = EmailsAPIView.as_view()
+
+    response = view(RequestFactory().post("/"))
+
+    assert response.data == ["new@example.com"]
+
+
+@pytest.mark.usefixtures("replica_user")
+@pytest.mark.django_db(databases=["default", "replica"])
+@override_settings(DATABASE_REPLICAS=["replica"], DB_REPLICA_STICKY_SECONDS=60)
+def test_users_stick_to_the_primary_after_a_write(
+    user_tokens: dict[str, JWT],
+) -> None:
+    view = EmailsAPIView.as_view()
+    headers = {"authorization": f"Bearer {user_tokens['access']}"}
+    anonymous = view(RequestFactory().get("/"))
+    view(RequestFactory().post("/", headers=headers))
+
+    response = view(RequestFactory().get("/", headers=headers))
+
+    assert anonymous.data == ["replica@example.com"]
+    assert isinstance(response.data, list)
+    assert set(map(str, response.data)) == {
+        "jon.snow@winterfell.org",
+        "new@example.com",
+    }
+
+
+@pytest.mark.urls(__name__)
+@pytest.mark.usefixtures("replica_user")
+@pytest.mark.parametrize("parallel", [True, False])
+@pytest.mark.django_db(databases=["default", "replica"], transaction=True)
+@override_settings(DATABASE_REPLICAS=["replica"])
+def test_batch_reads_after_a_write_go_to_the_primary(*, parallel: bool) -> None:
+    data = {
+        "requests": [
+            {"method": "POST", "path": "/emails"},
+            {"method": "GET", "path": "/emails"},
+        ],
+        "parallel": parallel,
+    }
+    request = RequestFactory().post(
+        "/batch", data=data, content_type="application/json"
+    )
+
+    response = BatchAPIView.as_view()(request)
+
+    assert isinstance(response.data, dict)
+    responses = response.data["responses"]
+    assert isinstance(responses, list)
+    assert [item["body"] for item in responses] == [  # type: ignore[call-overload,index]
+        ["new@example.com"],
+        ["new@example.com"],
+    ]
+
+
+@pytest.mark.django_db
+def test_pipeline_batches_writes_and_reads(active_user: User) -> None:
+    with User.objects.pipeline() as batch:
+        update = batch.execute(
+            "UPDATE accounts_user SET is_staff = %s WHERE id = %s",
+            [True, active_user.pk],
+            writes=[User],
+        )
+        emails = batch.fetch(User.objects.values_list("email"))
+        staff = batch.execute("SELECT is_staff FROM accounts_user")
+
+    assert update.rowcount == 1
+    assert update.result() == []
+    assert emails.result() == [(active_user.email,)]
+    assert staff.result() == [(True,)]
+    assert all(statement.cursor.closed for statement in batch.statements)
+
+
+@pytest.mark.django_db
+def test_pipeline_writes_invalidate(active_user: User) -> None:
+    queryset = User.objects.flat_values("email")
+    assert queryset.cached() == [active_user.email]
+
+    with User.objects.pipeline() as batch:
+        batch.execute(
+            "UPDATE accounts_user SET email = %s WHERE id = %s",
+            ["arya.stark@winterfell.org", active_user.pk],
+            writes=[User],
+        )
+
+    assert queryset.cached() == ["arya.stark@winterfell.org"]
+
+
+@pytest.mark.django_db
+def test_pipeline_writes_send_reads_to_the_primary() -> None:
+    with route_reads(replica=True) as routing:
+        with pipeline() as batch:
+            batch.execute("SELECT 1")
+        assert not routing.wrote
+
+        with pipeline() as batch:
+            batch.execute("UPDATE accounts_user SET is_staff = true", writes=[User])
+        assert routing.wrote
+
+
+@pytest.mark.django_db
+def test_pipeline_errors_per_statement() -> None:
+    statements = ["SELECT 1", "SELECT 1 / 0", "SELECT 2"]
+    with (  # noqa: PT012
+        pytest.raises(DataError) as exc_info,
+        transaction.atomic(),
+        pipeline() as batch,
+    ):
+        for sql in statements:
+            batch.execute(sql)
+
+    # The error can be raised before the last statement is queued.
+    first, failed, *aborted = batch.statements
+    assert exc_info.value.__notes__ == ["Failed statement: SELECT 1 / 0"]
+    assert first.result() == [(1,)]
+    with pytest.raises(DataError):
+        failed.result()
+    for statement in aborted:
+        with pytest.raises(DatabaseError, match="Aborted after: SELECT 1 / 0"):
+            statement.result()
@@ -1,18 +1,34 @@
 from __future__ import annotations
 
+from email import message_from_bytes
 from smtplib import SMTPException
 from typing import TYPE_CHECKING
 from unittest import mock
 
 import pytest
-
-from cp_project.lib.emails import Attachment
+from django.conf import settings
+from django.core import mail
+from django.core.mail import EmailMessage, get_connection
+from django.core.mail.backends import locmem
+from django.test import override_settings
+
+from cp_project.accounts.models import User
+from cp_project.lib.emails import (
+    Attachment,
+    BaseTransactionalEmail,
+    FileAttachment,
+    get_environment,
+    get_message_size,
+    iter_message_chunks,
+    split_message,
+)
+from cp_project.lib.exceptions import AttachmentTooLargeError
 from cp_project.notifications.emails import SignupEmail
 
 if TYPE_CHECKING:
-    from django.core.mail import EmailMultiAlternatives
+    from pathlib import Path
 
-    from cp_project.accounts.models import User
+    from django.core.mail import EmailMultiAlternatives
 
 
 @pytest.mark.django_db
@@ -59,3 +75,126 @@ def test_send_email_smtp_exception(
     mock_mail.send.assert_called_once()
 
     assert result is False
+
+
+@pytest.mark.parametrize("streamed", [True, False])
+def test_file_attachment_is_encoded(tmp_path: Path, streamed: bool) -> None:
+    content = bytes(range(256)) * 1000
+    path = tmp_path.joinpath("report.bin")
+    path.write_bytes(content)
+    attachment = FileAttachment("report.bin", path, "application/octet-stream")
+    email = EmailMessage("Report", "See attached.", to=["jon.snow@winterfell.org"])
+    email.attach(attachment.to_mime(streamed=streamed))
+
+    parts = split_message(email)
+    content_bytes = b"".join(iter_message_chunks(parts))
+    message = message_from_bytes(content_bytes)
+
+    assert get_message_size(parts) == len(content_bytes)
+
+    (part,) = [part for part in message.walk() if part.get_filename()]
+    assert part.get_filename() == "report.bin"
+    assert part.get_payload(decode=True) == content
+
+
+@override_settings(EMAIL_MAX_ATTACHMENT_SIZE=10)
+def test_file_attachment_size_cap(tmp_path: Path) -> None:
+    path = tmp_path.joinpath("report.txt")
+    path.write_bytes(b"x" * 11)
+    attachment = FileAttachment("report.txt", path, "text/plain")
+
+    with pytest.raises(AttachmentTooLargeError):
+        attachment.to_mime(streamed=True)
+
+
+@override_settings(EMAIL_MAX_ATTACHMENT_SIZE=10)
+def test_attachment_size_cap() -> None:
+    attachment = Attachment("report.txt", b"x" * 11, "text/plain")
+    recipient = User(email="jon.snow@winterfell.org")
+    connection = get_connection()
+
+    with pytest.raises(AttachmentTooLargeError):
+        SignupEmail.get_mail(
+            recipient, "plain", "<p>html</p>", [attachment], connection
+        )
+
+
+def get_bulk_recipients() -> list[tuple[User, dict[str, object]]]:
+    return [
+        (User(email=f"user{i}@winterfell.org"), {"signup_link": f"https://a.b/{i}"})
+        for i in range(3)
+    ]
+
+
+def test_bulk_messages_match_single_messages() -> None:
+    recipients = get_bulk_recipients()
+
+    assert SignupEmail.plain_messages(recipients) == [
+        SignupEmail.plain_message(recipient, **context)
+        for recipient, context in recipients
+    ]
+    assert SignupEmail.html_messages(recipients) == [
+        SignupEmail.html_message(recipient, **context)
+        for recipient, context in recipients
+    ]
+
+
+@pytest.mark.parametrize(
+    "source",
+    [
+        "{{ recipient.email|upper }}",
+        "{% if recipient.email %}{{ recipient.email.upper() }}{% endif %}",
+        "{% filter upper %}{{ recipient.email }}{% endfilter %}",
+        "{% for c in recipient.email %}{{ c|upper }}{% endfor %}",
+        "{{ recipient.email.upper() }}",
+        "{{ recipient.email|upper if recipient.email > 'a' }}",
+    ],
+)
+def test_bulk_render_falls_back_to_full_render(source: str) -> None:
+    env = get_environment(settings.EMAIL_TEMPLATE_DIR.as_posix())
+    template = env.from_string(source)
+    recipients = get_bulk_recipients()
+
+    messages = BaseTransactionalEmail.render_bulk(template, recipients)
+
+    assert messages == [recipient.email.upper() for recipient, _ in recipients]
+
+
+def test_bulk_render_with_different_contexts() -> None:
+    env = get_environment(settings.EMAIL_TEMPLATE_DIR.as_posix())
+    template = env.from_string("{{ recipient.email }} {{ link|default('-') }}")
+    recipients: list[tuple[User, dict[str, object]]] = [
+        (User(email="jon.snow@winterfell.org"), {}),
+        (User(email="arya.stark@winterfell.org"), {"link": "https://a.b"}),
+    ]
+
+    messages = BaseTransactionalEmail.render_bulk(template, recipients)
+
+    assert messages == [
+        "jon.snow@winterfell.org -",
+        "arya.stark@winterfell.org https://a.b",
+    ]
+
+
+@override_settings(
+    EMAIL_BACKEND="django.core.mail.backends.locmem.EmailBackend",
+    EMAIL_BULK_CHUNK_SIZE=2,
+)
+def test_send_bulk_counts_the_chunks_sent() -> None:
+    recipients = get_bulk_recipients()
+    send_messages = mock.Mock(side_effect=[SMTPException("Relay down"), 1])
+
+    with mock.patch.object(locmem.EmailBackend, "send_messages", send_messages):
+        assert SignupEmail.send_bulk(recipients) == 1
+
+    assert [len(call.args[0]) for call in send_messages.call_args_list] == [2, 1]
+
+
+@override_settings(EMAIL_BACKEND="django.core.mail.backends.locmem.EmailBackend")
+def test_send_bulk() -> None:
+    recipients = get_bulk_recipients()
+
+    assert SignupEmail.send_bulk(recipients) == 3
+    assert [message.to for message in mail.outbox] == [
+        [recipient.email] for recipient, _ in recipients
+    ]
@@ -0,0 +1,98 @@
+from __future__ import annotations
+
+import threading
+from typing import TYPE_CHECKING
+
+import pytest
+from django.core.cache import caches
+from django.test import override_settings
+
+from cp_project.accounts.models import User
+from cp_project.lib.cache import TieredCache
+from cp_project.lib.invalidation import Listener, dispatch, invalidated, start_listener
+from cp_project.lib.models import GENERATION_KEY, get_generations
+
+from tests.helpers.factories.account import UserFactory
+
+if TYPE_CHECKING:
+    from collections.abc import Iterator
+
+
+@pytest.fixture
+def listener() -> Iterator[Listener]:
+    listener = Listener()
+    listener.start()
+    assert listener.listening.wait(5)
+    yield listener
+    listener.stop()
+
+
+def test_start_listener_when_disabled() -> None:
+    assert start_listener() is None
+
+
+@pytest.mark.usefixtures("listener")
+@override_settings(CACHE_INVALIDATION_BUS=True)
+@pytest.mark.django_db(transaction=True)
+def test_save_notifies_the_workers() -> None:
+    received = []
+    done = threading.Event()
+
+    def receive(sender: type[User] | None, pks: list[object], **_: object) -> None:
+        received.append((sender, pks))
+        done.set()
+
+    user = UserFactory().build(email="bus@example.com")
+    invalidated.connect(receive, weak=False)
+    try:
+        user.save()
+        assert done.wait(5)
+    finally:
+        invalidated.disconnect(receive)
+
+    assert received == [(User, [user.pk])]
+
+
+def test_invalidation_evicts_local_generations() -> None:
+    cache = caches["default"]
+    assert isinstance(cache, TieredCache)
+    key = GENERATION_KEY.format("accounts.user")
+    (generation,) = get_generations([key])
+    # Another worker bumps the shared generation.
+    cache.l2.incr(cache.make_key(key))
+    assert get_generations([key]) == [generation]
+
+    invalidated.send(sender=User, pks=None)
+
+    assert get_generations([key]) == [generation + 1]
+
+
+def test_dispatch_unreadable_notification(caplog: pytest.LogCaptureFixture) -> None:
+    received = []
+
+    def receive(
+        sender: type[User] | None, pks: list[object] | None, **_: object
+    ) -> None:
+        received.append((sender, pks))
+
+    invalidated.connect(receive, weak=False)
+    try:
+        dispatch('{"models": ["accounts.nope"], "pks": [1]}')
+    finally:
+        invalidated.disconnect(receive)
+
+    assert received == [(None, None)]
+    assert "Unreadable invalidation" in caplog.text
+
+
+def test_dispatch_survives_failing_receivers(caplog: pytest.LogCaptureFixture) -> None:
+    def receive(**_: object) -> None:
+        raise RuntimeError
+
+    invalidated.connect(receive, weak=False)
+    try:
+        dispatch('{"models": ["accounts.user"], "pks": null}')
+    finally:
+        invalidated.disconnect(receive)
+
+    assert "failed to invalidate" in caplog.text
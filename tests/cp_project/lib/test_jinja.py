@@ -0,0 +1,99 @@
+from __future__ import annotations
+
+import logging
+
+import pytest
+from jinja2 import DictLoader, Environment
+
+from cp_project.accounts.models import User
+from cp_project.lib import jinja
+from cp_project.notifications.emails import SignupEmail
+
+STYLESHEET = """
+/* The signature at the bottom of every email */
+p { margin: 0 }
+.signature, #footer { font-size: 12px; text-align: center; }
+p.signature { color: gray }
+@media (max-width: 600px) { p { margin: 4px } }
+"""
+
+
+def test_parse_stylesheet() -> None:
+    rules = jinja.parse_stylesheet(STYLESHEET)
+    assert [rule.declarations for rule in rules] == [
+        "margin: 0",
+        "font-size: 12px; text-align: center",
+        "color: gray",
+        "font-size: 12px; text-align: center",
+    ]
+
+
+@pytest.mark.parametrize(
+    ("html", "expected"),
+    [
+        ("<p>Hi</p>", '<p style="margin: 0">Hi</p>'),
+        (
+            '<p class="signature" style="color: red;">Hi</p>',
+            '<p class="signature" style="margin: 0; font-size: 12px; text-align: center; color: gray; color: red">Hi</p>',
+        ),
+        (
+            '<div id="footer">',
+            '<div id="footer" style="font-size: 12px; text-align: center">',
+        ),
+        ('<div class="preview">', '<div class="preview">'),
+        ("<br />", "<br />"),
+    ],
+)
+def test_inline_css(html: str, expected: str) -> None:
+    rules = jinja.parse_stylesheet(STYLESHEET)
+    assert jinja.inline_css(html, rules) == expected
+
+
+@pytest.mark.parametrize(
+    ("html", "expected"),
+    [
+        ("<p>\n    Hello,\n    <b>world</b>\n</p>\n", "<p>Hello, <b>world</b></p>"),
+        ("<head>\n  <!-- meta -->\n  <title>", "<head><title>"),
+        ("<!--[if mso]><table><![endif]-->", "<!--[if mso]><table><![endif]-->"),
+        ("Follow  ", "Follow "),
+    ],
+)
+def test_minify_html(html: str, expected: str) -> None:
+    assert jinja.minify_html(html) == expected
+
+
+def compile_template(source: str) -> str:
+    loader = DictLoader({"base/email.css": STYLESHEET, "test.html.jinja": source})
+    environment = Environment(  # noqa: S701
+        loader=loader, extensions=[jinja.EmailHTMLExtension]
+    )
+    return environment.get_template("test.html.jinja").render(n=1, style="color: red")
+
+
+def test_tags_with_expressions_are_styled() -> None:
+    html = compile_template(
+        '<p class="signature" data-n="{{ n }}"\n   style="{{ style }}">\n'
+        "  {% if n %}{{ n }}{% endif %}\n</p>"
+    )
+    assert html == (
+        '<p class="signature" data-n="1" style="margin: 0; font-size: 12px; '
+        'text-align: center; color: gray; color: red">1</p>'
+    )
+
+
+def test_rendered_classes_are_reported(caplog: pytest.LogCaptureFixture) -> None:
+    with caplog.at_level(logging.WARNING):
+        html = compile_template('<p class="{{ style }}"><!-- {{ n }} --></p>')
+    assert html == '<p class="color: red" style="margin: 0"><!-- 1 --></p>'
+    assert '<p class="{…}">' in caplog.text
+
+
+def test_html_email_is_compiled() -> None:
+    html = SignupEmail.html_message(User(email="a@b.c"), signup_link="https://a.b")
+    assert "\n" not in html
+    assert '<p class="signature" style="font-size: 12px; text-align: center">' in html
+
+
+def test_plain_email_is_not_compiled() -> None:
+    plain = SignupEmail.plain_message(User(email="a@b.c"), signup_link="https://a.b")
+    assert plain == "Please follow https://a.b to complete the signup process."
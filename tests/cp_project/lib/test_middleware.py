@@ -0,0 +1,95 @@
+from __future__ import annotations
+
+import gzip
+from typing import TYPE_CHECKING
+
+from django.http import StreamingHttpResponse
+from django.test import RequestFactory, override_settings
+
+from cp_project.lib.http import JsonResponse
+from cp_project.lib.middleware import GZipMiddleware
+from cp_project.lib.views import APIView
+
+if TYPE_CHECKING:
+    from django.http import HttpRequest
+    from django.http.response import HttpResponseBase
+
+LARGE = {"items": ["item"] * 500}
+GZIP = {"accept-encoding": "gzip, deflate"}
+
+
+def compress_response(
+    response: HttpResponseBase, request: HttpRequest | None = None
+) -> HttpResponseBase:
+    middleware = GZipMiddleware(lambda _: response)
+    request = request or RequestFactory().get("/", headers=GZIP)
+    return middleware.process_response(request, response)
+
+
+@override_settings(GZIP_MIN_LENGTH=1024)
+def test_small_responses_are_not_compressed() -> None:
+    response = compress_response(JsonResponse({"access": "token"}))
+
+    assert not response.has_header("Content-Encoding")
+    assert not response.has_header("Vary")
+
+
+@override_settings(GZIP_MIN_LENGTH=1024)
+def test_large_responses_are_compressed() -> None:
+    original = JsonResponse(LARGE, headers={"ETag": '"etag"'})
+    content = original.content
+
+    response = compress_response(original)
+
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert response.headers["Vary"] == "Accept-Encoding"
+    assert response.headers["ETag"] == 'W/"etag"'
+    assert gzip.decompress(response.content) == content  # type: ignore[attr-defined]
+
+
+@override_settings(GZIP_MIN_LENGTH=1024)
+def test_accept_encoding_is_honored() -> None:
+    response = compress_response(JsonResponse(LARGE), RequestFactory().get("/"))
+
+    assert not response.has_header("Content-Encoding")
+    assert response.headers["Vary"] == "Accept-Encoding"
+
+
+@override_settings(GZIP_MIN_LENGTH=1024)
+def test_known_gzip_content_is_reused() -> None:
+    original = JsonResponse(LARGE)
+    original.gzip_content = gzip.compress(b"cached")
+
+    response = compress_response(original)
+
+    assert gzip.decompress(response.content) == b"cached"  # type: ignore[attr-defined]
+
+
+def test_streaming_responses_are_compressed_by_chunk() -> None:
+    original = StreamingHttpResponse(iter([b"first ", b"second"]))
+
+    response = compress_response(original)
+
+    assert response.headers["Content-Encoding"] == "gzip"
+    content = b"".join(response.streaming_content)  # type: ignore[attr-defined]
+    assert gzip.decompress(content) == b"first second"
+
+
+class ExemptAPIView(APIView):
+    gzip_exempt = True
+
+    @staticmethod
+    def get() -> JsonResponse:
+        return JsonResponse(LARGE)
+
+
+@override_settings(GZIP_MIN_LENGTH=0)
+def test_views_can_opt_out() -> None:
+    view = ExemptAPIView.as_view()
+    middleware = GZipMiddleware(view)
+    request = RequestFactory().get("/", headers=GZIP)
+
+    middleware.process_view(request, view, (), {})
+
+    response = middleware.process_response(request, view(request))
+    assert not response.has_header("Content-Encoding")
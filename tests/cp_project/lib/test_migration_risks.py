@@ -0,0 +1,107 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
+import pytest
+from django.apps import apps
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+from django.db.migrations.state import ProjectState
+from django.db.models.functions import Now
+
+from cp_project.lib import migration_risks
+
+if TYPE_CHECKING:
+    from cp_project.lib.migration_risks import OperationRisk
+
+
+def analyze(*operations: migrations.operations.base.Operation) -> list[OperationRisk]:
+    migration = migrations.Migration("0002_test", "accounts")
+    migration.operations = list(operations)
+    state = ProjectState.from_apps(apps)
+    return list(migration_risks.analyze_migration(migration, state))
+
+
+@pytest.mark.parametrize(
+    ("operation", "lock", "cost"),
+    [
+        (
+            migrations.AddIndex(
+                "user", models.Index(fields=["created_at"], name="created_at_idx")
+            ),
+            "SHARE",
+            "index build without CONCURRENTLY",
+        ),
+        (
+            migrations.AddField("user", "nickname", models.TextField(db_index=True)),
+            "SHARE",
+            "index build",
+        ),
+        (
+            migrations.AddField(
+                "user", "seen_at", models.DateTimeField(db_default=Now())
+            ),
+            "ACCESS EXCLUSIVE",
+            "table rewrite for a volatile default",
+        ),
+        (
+            migrations.AlterField("user", "email", models.IntegerField(unique=True)),
+            "ACCESS EXCLUSIVE",
+            "table rewrite from varchar(254) to integer",
+        ),
+        (
+            migrations.AlterField("user", "last_login", models.DateTimeField()),
+            "ACCESS EXCLUSIVE",
+            "table scan for NOT NULL",
+        ),
+        (
+            migrations.RunPython(
+                migrations.RunPython.noop, hints={"model_name": "user"}
+            ),
+            "ROW EXCLUSIVE",
+            "row updates in a single transaction",
+        ),
+    ],
+)
+def test_blocking_operations(
+    operation: migrations.operations.base.Operation, lock: str, cost: str
+) -> None:
+    (risk,) = analyze(operation)
+    assert risk.table == "accounts_user"
+    assert (risk.lock, risk.cost, risk.risk) == (lock, cost, "high")
+    assert risk.blocking
+
+
+@pytest.mark.parametrize(
+    "operation",
+    [
+        AddIndexConcurrently(
+            "user", models.Index(fields=["created_at"], name="created_at_idx")
+        ),
+        migrations.AddField("user", "nickname", models.TextField(default="")),
+        migrations.AlterField("user", "email", models.EmailField(max_length=320)),
+        migrations.AlterField("user", "email", models.TextField(unique=True)),
+        migrations.AlterField("user", "last_login", models.DateTimeField(null=True)),
+    ],
+)
+def test_safe_operations(operation: migrations.operations.base.Operation) -> None:
+    assert analyze(operation) == []
+
+
+def test_new_tables_are_not_reported() -> None:
+    assert (
+        analyze(
+            migrations.CreateModel(
+                "Profile", [("id", models.BigAutoField(primary_key=True))]
+            ),
+            migrations.AddField("profile", "bio", models.TextField(db_index=True)),
+        )
+        == []
+    )
+
+
+def test_unhinted_run_python_is_not_blocking() -> None:
+    (risk,) = analyze(migrations.RunPython(migrations.RunPython.noop))
+    assert risk.table == "?"
+    assert risk.risk == "medium"
+    assert not risk.blocking
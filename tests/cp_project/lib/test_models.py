@@ -1,6 +1,17 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
 import pytest
+from django.db import transaction
 
 from cp_project.accounts.models import User
+from cp_project.lib.models import get_generation_keys, get_generations
+
+if TYPE_CHECKING:
+    from collections.abc import Callable
+
+    from pytest_django import DjangoAssertNumQueries
 
 
 class TestBaseModel:
@@ -30,6 +41,18 @@ class TestBaseModel:
     def test_bulk_create(self) -> None:
         assert User.objects.count() == 3
 
+    @pytest.mark.django_db
+    @pytest.mark.parametrize(("batch_size", "batches"), [(1, 3), (2, 2), (3, 1)])
+    def test_pk_ranges(self, batch_size: int, batches: int) -> None:
+        ranges = list(User.objects.pk_ranges(batch_size))
+        assert len(ranges) == batches
+        covered = [
+            User.objects.filter(pk__gte=first, pk__lte=last).count()
+            for first, last in ranges
+        ]
+        assert sum(covered) == 3
+        assert max(covered) <= batch_size
+
     @pytest.mark.django_db
     def test_random(self) -> None:
         assert User.objects.random().email in self.emails
@@ -64,3 +87,94 @@ class TestBaseModel:
         updated_users = User.objects.bulk_update(users, fields=fields)
         assert updated_users == 3
         assert User.objects.filter(is_staff=True).count() == 3
+
+
+class TestCachedQuerySet:
+    @pytest.fixture(autouse=True)
+    def _create_user(self) -> None:
+        User.objects.create_user("jon.snow@winterfell.org")
+
+    @pytest.mark.django_db
+    def test_cached(self, django_assert_num_queries: DjangoAssertNumQueries) -> None:
+        with django_assert_num_queries(1):
+            first = User.objects.filter(is_active=True).cached()
+            second = User.objects.filter(is_active=True).cached()
+
+        assert first == second
+        assert [user.email for user in second] == ["jon.snow@winterfell.org"]
+
+    @pytest.mark.django_db
+    def test_cached_key(
+        self, django_assert_num_queries: DjangoAssertNumQueries
+    ) -> None:
+        with django_assert_num_queries(1):
+            first = User.objects.all().cached(key="users")
+            second = User.objects.none().cached(key="users")
+
+        assert second == first
+
+    @pytest.mark.django_db
+    def test_cached_values(
+        self, django_assert_num_queries: DjangoAssertNumQueries
+    ) -> None:
+        queryset = User.objects.values("email")
+        with django_assert_num_queries(1):
+            queryset.cached()
+            emails = queryset.cached()
+
+        assert emails == [{"email": "jon.snow@winterfell.org"}]
+
+    @pytest.mark.django_db
+    @pytest.mark.parametrize(
+        "write",
+        [
+            lambda: User.objects.create_user("arya.stark@winterfell.org"),
+            lambda: User.objects.update(is_staff=True),
+            lambda: User.objects.bulk_create([User(email="sansa@winterfell.org")]),
+            lambda: User.objects.bulk_update(User.objects.all(), ["is_staff"]),
+            lambda: User.objects.all().delete(),
+            lambda: User.objects.get().delete(),
+        ],
+    )
+    def test_writes_invalidate(
+        self,
+        write: Callable[[], object],
+        django_assert_num_queries: DjangoAssertNumQueries,
+    ) -> None:
+        User.objects.all().cached()
+        write()
+
+        with django_assert_num_queries(1):
+            users = User.objects.all().cached()
+
+        assert users == list(User.objects.all())
+
+    @pytest.mark.django_db(transaction=True)
+    def test_autocommit_writes_bump_once(self) -> None:
+        keys = get_generation_keys(["accounts.user"])
+        (generation,) = get_generations(keys)
+
+        User.objects.update(is_staff=True)
+
+        assert get_generations(keys) == [generation + 1]
+
+    @pytest.mark.django_db
+    def test_rolled_back_writes_are_not_cached(self) -> None:
+        queryset = User.objects.filter(email="arya.stark@winterfell.org")
+        assert queryset.cached() == []
+
+        with pytest.raises(RuntimeError), transaction.atomic():  # noqa: PT012
+            User.objects.create_user("arya.stark@winterfell.org")
+            assert len(queryset.cached()) == 1
+            raise RuntimeError
+
+        assert queryset.cached() == []
+
+    @pytest.mark.django_db
+    def test_joined_writes_invalidate(self) -> None:
+        queryset = User.objects.filter(signup_token__isnull=False)
+        assert queryset.cached() == []
+
+        User.objects.get().get_signup_token()
+
+        assert len(queryset.cached()) == 1
@@ -0,0 +1,219 @@
+from __future__ import annotations
+
+from email import message_from_bytes
+from typing import TYPE_CHECKING
+from unittest import mock
+
+import pytest
+from django.core.mail import get_connection
+from django.test import override_settings
+
+from cp_project.lib import smtp
+from cp_project.lib.emails import FileAttachment
+from cp_project.lib.exceptions import PoolExhaustedError
+from cp_project.notifications.emails import SignupEmail
+
+from tests.helpers.smtp import SMTPStandIn
+
+if TYPE_CHECKING:
+    from collections.abc import Iterator
+    from pathlib import Path
+
+    from cp_project.accounts.models import User
+    from cp_project.lib.types import JSONDict
+
+
+@pytest.fixture
+def relay() -> Iterator[SMTPStandIn]:
+    with (
+        SMTPStandIn() as server,
+        override_settings(
+            EMAIL_BACKEND="cp_project.lib.smtp.PooledEmailBackend",
+            EMAIL_HOST=server.host,
+            EMAIL_PORT=server.port,
+            EMAIL_CONNECT_TIMEOUT=0.5,
+            EMAIL_SEND_TIMEOUT=0.5,
+            EMAIL_POOL_SIZE=2,
+            EMAIL_POOL_TIMEOUT=0.5,
+            EMAIL_CIRCUIT_BREAKER_THRESHOLD=2,
+            EMAIL_CIRCUIT_BREAKER_RESET_TIMEOUT=60,
+        ),
+    ):
+        smtp.reset_relays()
+        yield server
+        smtp.reset_relays()
+
+
+def get_metrics(server: SMTPStandIn) -> dict[str, JSONDict]:
+    metrics = smtp.get_relay_metrics()[f"{server.host}:{server.port}"]
+    assert isinstance(metrics["pool"], dict)
+    assert isinstance(metrics["breaker"], dict)
+    return {"pool": metrics["pool"], "breaker": metrics["breaker"]}
+
+
+@pytest.mark.django_db
+def test_connections_are_reused(relay: SMTPStandIn, inactive_user: User) -> None:
+    for _ in range(3):
+        assert SignupEmail.send_email(inactive_user, signup_link="https://a.b/c")
+
+    assert len(relay.server.messages) == 3
+    assert relay.server.connections == 1
+    metrics = get_metrics(relay)
+    assert metrics["pool"]["created"] == 1
+    assert metrics["pool"]["reused"] == 2
+    assert metrics["pool"]["idle"] == 1
+    assert metrics["breaker"]["state"] == "closed"
+
+
+@pytest.mark.django_db
+def test_file_attachments_are_streamed(
+    relay: SMTPStandIn, inactive_user: User, tmp_path: Path
+) -> None:
+    content = b".leading dot\r\n" * 10_000
+    path = tmp_path.joinpath("notes.txt")
+    path.write_bytes(content)
+    attachment = FileAttachment("notes.txt", path, "text/plain")
+
+    assert SignupEmail.send_email(
+        inactive_user, [attachment], signup_link="https://a.b/c"
+    )
+
+    message = message_from_bytes(relay.server.messages[0])
+    (part,) = [part for part in message.walk() if part.get_filename()]
+    assert part.get_filename() == "notes.txt"
+    assert part.get_payload(decode=True) == content
+    size = len(relay.server.messages[0])
+    assert relay.server.envelopes[0].endswith(f" size={size}")
+
+
+@pytest.mark.django_db
+def test_partly_refused_recipients(
+    relay: SMTPStandIn, inactive_user: User, caplog: pytest.LogCaptureFixture
+) -> None:
+    relay.server.refused.add("arya.stark@winterfell.org")
+    connection = get_connection()
+    mail = SignupEmail.get_mail(inactive_user, "plain", "<p>html</p>", [], connection)
+    mail.to.append("arya.stark@winterfell.org")
+
+    assert connection.send_messages([mail]) == 1
+
+    assert len(relay.server.messages) == 1
+    assert "arya.stark@winterfell.org" in caplog.text
+    assert get_metrics(relay)["breaker"]["failures"] == 0
+
+
+@pytest.mark.django_db
+def test_slow_relay_times_out(relay: SMTPStandIn, inactive_user: User) -> None:
+    relay.server.delay = 1
+
+    assert not SignupEmail.send_email(inactive_user, signup_link="https://a.b/c")
+
+    metrics = get_metrics(relay)
+    assert metrics["pool"]["discarded"] == 1
+    assert metrics["pool"]["idle"] == 0
+    assert metrics["breaker"]["failures"] == 1
+
+
+@pytest.mark.django_db
+def test_failing_relay_opens_circuit(relay: SMTPStandIn, inactive_user: User) -> None:
+    relay.server.fail = True
+    for _ in range(2):
+        assert not SignupEmail.send_email(inactive_user, signup_link="https://a.b/c")
+    connections = relay.server.connections
+
+    assert not SignupEmail.send_email(inactive_user, signup_link="https://a.b/c")
+
+    assert relay.server.connections == connections
+    metrics = get_metrics(relay)
+    assert metrics["breaker"]["state"] == "open"
+    assert metrics["breaker"]["times_opened"] == 1
+
+
+@pytest.mark.django_db
+def test_silent_relay_failures_open_circuit(
+    relay: SMTPStandIn, inactive_user: User
+) -> None:
+    relay.server.fail = True
+    connection = get_connection(fail_silently=True)
+    mail = SignupEmail.get_mail(inactive_user, "plain", "<p>html</p>", [], connection)
+
+    assert [connection.send_messages([mail]) for _ in range(2)] == [0, 0]
+
+    metrics = get_metrics(relay)
+    assert metrics["breaker"]["state"] == "open"
+    assert metrics["pool"]["discarded"] == 2
+
+
+@pytest.mark.django_db
+def test_refused_recipients_do_not_open_circuit(
+    relay: SMTPStandIn, inactive_user: User
+) -> None:
+    relay.server.refused.add(inactive_user.email)
+    connection = get_connection(fail_silently=True)
+    mail = SignupEmail.get_mail(inactive_user, "plain", "<p>html</p>", [], connection)
+
+    assert [connection.send_messages([mail]) for _ in range(2)] == [0, 0]
+    assert not SignupEmail.send_email(inactive_user, signup_link="https://a.b/c")
+
+    metrics = get_metrics(relay)
+    assert metrics["breaker"]["failures"] == 0
+    assert metrics["pool"]["created"] == 1
+
+
+@pytest.mark.usefixtures("relay")
+def test_unused_trial_is_released() -> None:
+    breaker = get_connection().breaker
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.opened_at is not None
+    breaker.opened_at -= 60
+
+    with get_connection():
+        pass
+
+    assert breaker.allow()
+
+
+@mock.patch("cp_project.lib.smtp.time.monotonic")
+def test_circuit_breaker_half_open(mock_monotonic: mock.MagicMock) -> None:
+    mock_monotonic.return_value = 100
+    breaker = smtp.CircuitBreaker(threshold=1, reset_timeout=10)
+    breaker.record_failure()
+    assert breaker.stats().state == "open"
+    assert not breaker.allow()
+
+    mock_monotonic.return_value = 110
+    assert breaker.stats().state == "half-open"
+    assert breaker.allow()
+    assert not breaker.allow()
+
+    breaker.record_failure()
+    assert breaker.stats().state == "open"
+
+    mock_monotonic.return_value = 120
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.stats() == smtp.BreakerStats(
+        state="closed", failures=0, times_opened=1
+    )
+
+
+def test_pool_exhausted() -> None:
+    pool = smtp.ConnectionPool(size=1, max_idle=60)
+    connection = pool.acquire(mock.MagicMock, timeout=0.01)
+    with pytest.raises(PoolExhaustedError):
+        pool.acquire(mock.MagicMock, timeout=0.01)
+
+    pool.release(connection)
+    assert pool.acquire(mock.MagicMock, timeout=0.01) is connection
+
+
+@override_settings(EMAIL_POOL_SIZE=1, EMAIL_POOL_MAX_IDLE=60)
+def test_relay_is_not_shared_across_fork() -> None:
+    key = ("localhost", 25, "", False, False)
+    relay = smtp.get_relay(key)
+    assert smtp.get_relay(key) is relay
+
+    with mock.patch("cp_project.lib.smtp.os.getpid", return_value=-1):
+        assert smtp.get_relay(key) is not relay
+    smtp.reset_relays()
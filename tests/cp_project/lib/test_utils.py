@@ -1,12 +1,20 @@
-from typing import Literal
+from __future__ import annotations
+
+import os
+from typing import TYPE_CHECKING, Literal
+from unittest import mock
 
 import pytest
 from django.test import override_settings
+from pyutilkit.files import hash_file
 
 from cp_project.lib import utils
 
 from tests.helpers.factories.account import UserFactory
 
+if TYPE_CHECKING:
+    from pathlib import Path
+
 
 class TestJWT:
     @pytest.mark.django_db
@@ -72,3 +80,71 @@ def test_saved_hashes() -> None:
     assert "accounts" in hashed_migrations
     initial_account_migration = hashed_migrations["accounts"][0]
     assert initial_account_migration.name == "0001_initial"
+
+
+def test_migration_hash_cache(tmp_path: Path) -> None:
+    cache_path = tmp_path.joinpath("migrations.lock.cache")
+    migration = tmp_path.joinpath("0001_initial.py")
+    migration.write_text("operations = []\n")
+
+    cache = utils.MigrationHashCache.load(cache_path)
+    file_hash = cache.hash_file(migration)
+    cache.save()
+    assert file_hash == hash_file(migration)
+
+    with mock.patch("cp_project.lib.utils.hash_file") as mock_hash_file:
+        cache = utils.MigrationHashCache.load(cache_path)
+        assert cache.hash_file(migration) == file_hash
+    mock_hash_file.assert_not_called()
+
+    migration.write_text("operations = [None]\n")
+    os.utime(migration, ns=(0, 0))
+    cache = utils.MigrationHashCache.load(cache_path)
+    assert cache.hash_file(migration) == hash_file(migration) != file_hash
+
+
+def test_migration_hash_cache_is_rebuilt_when_corrupt(tmp_path: Path) -> None:
+    cache_path = tmp_path.joinpath("migrations.lock.cache")
+    cache_path.write_text("garbage\n")
+    assert utils.MigrationHashCache.load(cache_path).entries == {}
+
+
+def test_hash_migrations_uses_cache(tmp_path: Path) -> None:
+    with override_settings(MIGRATION_HASH_CACHE_PATH=tmp_path.joinpath("cache")):
+        loader = utils.get_migration_loader()
+        hashed_migrations = utils.get_migrations_info(loader)
+        with mock.patch("cp_project.lib.utils.hash_file") as mock_hash_file:
+            assert utils.get_migrations_info(loader) == hashed_migrations
+    mock_hash_file.assert_not_called()
+
+
+@mock.patch("cp_project.lib.utils.subprocess.run")
+@mock.patch("cp_project.lib.utils.MigrationWriter")
+def test_format_migrations(
+    mock_writer: mock.MagicMock, mock_run: mock.MagicMock
+) -> None:
+    mock_writer.side_effect = lambda migration: mock.Mock(path=f"{migration.name}.py")
+    migrations = [mock.Mock(), mock.Mock()]
+    migrations[0].name = "0002_first"
+    migrations[1].name = "0003_second"
+    utils.format_migrations(migrations)
+    assert mock_run.call_args_list == [
+        mock.call(["black", "--quiet", "0002_first.py", "0003_second.py"], check=True),
+        mock.call(
+            [
+                "ruff",
+                "check",
+                "--fix-only",
+                "--quiet",
+                "0002_first.py",
+                "0003_second.py",
+            ],
+            check=True,
+        ),
+    ]
+
+
+@mock.patch("cp_project.lib.utils.subprocess.run")
+def test_format_no_migrations(mock_run: mock.MagicMock) -> None:
+    utils.format_migrations([])
+    assert mock_run.call_count == 0
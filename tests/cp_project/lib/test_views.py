@@ -0,0 +1,450 @@
+from __future__ import annotations
+
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+from http import HTTPStatus
+from typing import TYPE_CHECKING, ClassVar
+
+import pytest
+from django.contrib.auth.models import AnonymousUser
+from django.db import connections
+from django.test import RequestFactory, override_settings
+from django.urls import path
+
+from cp_project.accounts.models import User
+from cp_project.lib.db import advisory_lock
+from cp_project.lib.exceptions import ValidationError
+from cp_project.lib.http import JsonResponse
+from cp_project.lib.views import APIView, BatchAPIView
+
+if TYPE_CHECKING:
+    from collections.abc import Iterator
+    from pathlib import Path
+
+    from django.http import HttpRequest
+
+    from cp_project.lib.types import JSONDict, JSONType
+    from cp_project.lib.utils import JWT
+
+    from tests.helpers.client import JsonTestClient
+
+
+class CountingAPIView(APIView):
+    calls: ClassVar[list[str]] = []
+
+    def get(self) -> JsonResponse:
+        self.calls.append(self.request.get_full_path())
+        return JsonResponse(list(User.objects.flat_values("email")), safe=False)
+
+
+class EchoAPIView(APIView):
+    def post(self) -> JsonResponse:
+        try:
+            return JsonResponse({"data": self.get_data()})
+        except ValidationError as exc:
+            return JsonResponse({"error": str(exc)}, status=HTTPStatus.BAD_REQUEST)
+
+
+class CachedAPIView(CountingAPIView):
+    cache_timeout = 60
+    cache_models = (User,)
+
+
+class ValidatedAPIView(CountingAPIView):
+    def get_validator(self, **_kwargs: object) -> object | None:
+        users = User.objects.order_by("-updated_at")
+        updated_at: object = users.flat_values("updated_at").first()
+        return updated_at
+
+
+class BarrierAPIView(APIView):
+    barrier = threading.Barrier(3, timeout=5)
+
+    def get(self) -> JsonResponse:
+        return JsonResponse({"waiting": self.barrier.wait()})
+
+
+class IdempotentAPIView(APIView):
+    calls: ClassVar[list[JSONType]] = []
+    started = threading.Event()
+    release = threading.Event()
+
+    def post(self) -> JsonResponse:
+        data = self.get_data()
+        self.calls.append(data)
+        self.started.set()
+        self.release.wait(timeout=5)
+        if data == "fail":
+            return JsonResponse(None, safe=False, status=HTTPStatus.BAD_GATEWAY)
+        return JsonResponse({"call": len(self.calls)}, status=HTTPStatus.CREATED)
+
+
+urlpatterns = [
+    path("batch", BatchAPIView.as_view()),
+    path("barrier", BarrierAPIView.as_view()),
+]
+
+
+@pytest.fixture(autouse=True)
+def _reset_calls() -> None:
+    CountingAPIView.calls.clear()
+    IdempotentAPIView.calls.clear()
+    IdempotentAPIView.started.clear()
+    IdempotentAPIView.release.set()
+
+
+@pytest.fixture
+def file_response_cache(tmp_path: Path) -> Iterator[None]:
+    # A cache that the processes share, as the workers of a host do.
+    backends: JSONDict = {
+        "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+        "file": {
+            "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+            "LOCATION": str(tmp_path),
+        },
+    }
+    with override_settings(CACHES=backends, RESPONSE_CACHE_ALIAS="file"):
+        yield
+
+
+def post_with_key(data: JSONType, key: str | None = "key") -> JsonResponse:
+    headers = {} if key is None else {"idempotency-key": key}
+    request = RequestFactory().post(
+        "/", data=json.dumps(data), content_type="application/json", headers=headers
+    )
+    return IdempotentAPIView.as_view()(request)
+
+
+def post_in_thread(responses: list[JsonResponse], data: JSONType) -> threading.Thread:
+    def post() -> None:
+        try:
+            responses.append(post_with_key(data))
+        finally:
+            connections.close_all()
+
+    thread = threading.Thread(target=post)
+    thread.start()
+    return thread
+
+
+@pytest.mark.django_db
+def test_get_sets_a_strong_etag() -> None:
+    view = CountingAPIView.as_view()
+    response = view(RequestFactory().get("/"))
+    etag = response.headers["ETag"]
+
+    not_modified = view(RequestFactory().get("/", headers={"if-none-match": etag}))
+    modified = view(RequestFactory().get("/", headers={"if-none-match": '"other"'}))
+
+    assert etag.startswith('"')
+    assert not_modified.status_code == HTTPStatus.NOT_MODIFIED
+    assert not_modified.content == b""
+    assert modified.status_code == HTTPStatus.OK
+    assert modified.headers["ETag"] == etag
+
+
+@pytest.mark.django_db
+def test_validator_skips_the_handler(active_user: User) -> None:
+    view = ValidatedAPIView.as_view()
+    etag = view(RequestFactory().get("/")).headers["ETag"]
+
+    response = view(RequestFactory().get("/", headers={"if-none-match": f"W/{etag}"}))
+    active_user.save()
+    changed = view(RequestFactory().get("/", headers={"if-none-match": etag}))
+
+    assert response.status_code == HTTPStatus.NOT_MODIFIED
+    assert changed.status_code == HTTPStatus.OK
+    assert changed.headers["ETag"] != etag
+    assert len(ValidatedAPIView.calls) == 2
+
+
+@pytest.mark.django_db
+def test_cached_responses_vary_on_the_query_string(active_user: User) -> None:
+    view = CachedAPIView.as_view()
+
+    first = view(RequestFactory().get("/"))
+    second = view(RequestFactory().get("/"))
+    other = view(RequestFactory().get("/?page=2"))
+
+    assert first.data == second.data == other.data == [active_user.email]
+    assert second.headers["ETag"] == first.headers["ETag"]
+    assert CachedAPIView.calls == ["/", "/?page=2"]
+
+
+@pytest.mark.django_db
+def test_writes_expire_cached_responses(active_user: User) -> None:
+    view = CachedAPIView.as_view()
+    view(RequestFactory().get("/"))
+
+    User.objects.create_user("new@example.com")
+    response = view(RequestFactory().get("/"))
+
+    assert isinstance(response.data, list)
+    assert set(map(str, response.data)) == {active_user.email, "new@example.com"}
+    assert len(CachedAPIView.calls) == 2
+
+
+@pytest.mark.django_db
+def test_head_reuses_the_cached_response() -> None:
+    view = CachedAPIView.as_view()
+    response = view(RequestFactory().get("/"))
+
+    head = view(RequestFactory().head("/"))
+    not_modified = view(
+        RequestFactory().head("/", headers={"if-none-match": response.headers["ETag"]})
+    )
+
+    assert head.status_code == HTTPStatus.OK
+    assert head.headers["ETag"] == response.headers["ETag"]
+    assert not_modified.status_code == HTTPStatus.NOT_MODIFIED
+    assert CachedAPIView.calls == ["/"]
+
+
+@pytest.mark.django_db
+@override_settings(GZIP_MIN_LENGTH=0)
+def test_cached_responses_keep_their_gzip_content() -> None:
+    view = CachedAPIView.as_view()
+
+    first = view(RequestFactory().get("/"))
+    second = view(RequestFactory().get("/"))
+
+    assert isinstance(second, JsonResponse)
+    assert second.gzip_content is not None
+    assert gzip.decompress(second.gzip_content) == first.content
+
+
+def post_body(body: bytes, encoding: str) -> JsonResponse:
+    request = RequestFactory().post(
+        "/",
+        data=body,
+        content_type="application/json",
+        headers={"content-encoding": encoding},
+    )
+    return EchoAPIView.as_view()(request)
+
+
+def test_gzip_request_bodies_are_decoded() -> None:
+    data = {"items": list(range(1000))}
+
+    response = post_body(gzip.compress(json.dumps(data).encode()), "gzip")
+
+    assert response.data == {"data": data}
+
+
+@override_settings(REQUEST_MAX_DECOMPRESSED_SIZE=1000)
+def test_gzip_request_bodies_are_capped() -> None:
+    response = post_body(gzip.compress(b" " * 1001), "gzip")
+
+    assert response.status_code == HTTPStatus.BAD_REQUEST
+    assert response.data == {"error": "Request body exceeds 1000 bytes"}
+
+
+@pytest.mark.parametrize(
+    ("body", "encoding", "error"),
+    [
+        (b"{}", "gzip", "Invalid gzip body"),
+        (gzip.compress(b"{}")[:-10], "gzip", "Truncated gzip body"),
+        (b"{}", "br", "Unsupported Content-Encoding: br"),
+    ],
+)
+def test_invalid_request_bodies(body: bytes, encoding: str, error: str) -> None:
+    response = post_body(body, encoding)
+
+    assert response.status_code == HTTPStatus.BAD_REQUEST
+    assert response.data == {"error": error}
+
+
+@pytest.mark.django_db
+def test_batch_runs_requests_in_order(
+    json_client: JsonTestClient, active_user: User
+) -> None:
+    credentials: JSONDict = {"email": active_user.email, "password": "WwOQa7;S#8HAr#L^"}
+    requests: JSONType = [
+        {"method": "post", "path": "/accounts/token/", "body": credentials},
+        {"method": "POST", "path": "/accounts/token/refresh", "body": {"token": ""}},
+        {"method": "GET", "path": "/nowhere"},
+        {"method": "POST", "path": "/batch", "body": {"requests": []}},
+    ]
+
+    response = json_client.post("/batch", data={"requests": requests})
+
+    assert response.status_code == HTTPStatus.OK
+    assert isinstance(response.data, dict)
+    responses = response.data["responses"]
+    assert isinstance(responses, list)
+    assert [item["status"] for item in responses] == [200, 401, 404, 404]  # type: ignore[call-overload,index]
+
+
+@pytest.mark.django_db
+def test_batch_resolves_the_user_once(
+    json_client: JsonTestClient,
+    user_tokens: dict[str, JWT],
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    calls = []
+    from_request = User.from_request
+
+    def counting_from_request(request: HttpRequest) -> User:
+        calls.append(request.path)
+        return from_request(request)
+
+    monkeypatch.setattr(User, "from_request", counting_from_request)
+    request: JSONDict = {
+        "method": "POST",
+        "path": "/accounts/token/refresh",
+        "body": {},
+    }
+
+    json_client.post(
+        "/batch", data={"requests": [request] * 3}, jwt=user_tokens["access"]
+    )
+
+    assert calls == ["/batch"]
+
+
+@pytest.mark.parametrize(
+    "data",
+    [
+        [],
+        {"requests": {}},
+        {"requests": [{"method": "GET", "path": "/"}] * 21},
+        {"requests": [{"method": "FETCH", "path": "/"}]},
+        {"requests": [{"method": "GET", "path": "accounts/"}]},
+        {"requests": ["GET /"]},
+        {"requests": [], "parallel": "yes"},
+    ],
+)
+def test_invalid_batches(json_client: JsonTestClient, data: JSONType) -> None:
+    response = json_client.post("/batch", data=data)
+
+    assert response.status_code == HTTPStatus.BAD_REQUEST
+
+
+@pytest.mark.urls(__name__)
+def test_parallel_batches_run_safe_requests_at_once() -> None:
+    data = {"requests": [{"method": "GET", "path": "/barrier"}] * 3, "parallel": True}
+    request = RequestFactory().post(
+        "/batch", data=data, content_type="application/json"
+    )
+
+    response = BatchAPIView.as_view()(request)
+
+    assert isinstance(response.data, dict)
+    responses = response.data["responses"]
+    assert isinstance(responses, list)
+    assert sorted(item["body"]["waiting"] for item in responses) == [0, 1, 2]  # type: ignore[call-overload,index,type-var]
+
+
+@pytest.mark.django_db
+def test_idempotent_posts_are_replayed() -> None:
+    first = post_with_key("data")
+    retry = post_with_key("data")
+    other = post_with_key("data", key="other")
+    unkeyed = [post_with_key("data", key=None) for _ in range(2)]
+
+    assert first.status_code == retry.status_code == HTTPStatus.CREATED
+    assert retry.data == first.data == {"call": 1}
+    assert retry.headers["Idempotent-Replayed"] == "true"
+    assert "Idempotent-Replayed" not in first.headers
+    assert other.data == {"call": 2}
+    assert [response.data for response in unkeyed] == [{"call": 3}, {"call": 4}]
+
+
+@pytest.mark.django_db
+def test_idempotency_keys_are_bound_to_the_body() -> None:
+    post_with_key("data")
+    response = post_with_key("other data")
+
+    assert response.status_code == HTTPStatus.UNPROCESSABLE_CONTENT
+    assert IdempotentAPIView.calls == ["data"]
+
+
+@pytest.mark.django_db
+def test_server_errors_are_not_replayed() -> None:
+    responses = [post_with_key("fail") for _ in range(2)]
+
+    assert [response.status_code for response in responses] == [
+        HTTPStatus.BAD_GATEWAY,
+        HTTPStatus.BAD_GATEWAY,
+    ]
+    assert IdempotentAPIView.calls == ["fail", "fail"]
+
+
+@pytest.mark.django_db(transaction=True)
+def test_concurrent_duplicates_wait_for_the_first() -> None:
+    IdempotentAPIView.release.clear()
+    responses: list[JsonResponse] = []
+    first = post_in_thread(responses, "data")
+    IdempotentAPIView.started.wait(timeout=5)
+    duplicate = post_in_thread(responses, "data")
+    IdempotentAPIView.release.set()
+    first.join()
+    duplicate.join()
+
+    assert [response.data for response in responses] == [{"call": 1}, {"call": 1}]
+    assert IdempotentAPIView.calls == ["data"]
+
+
+@pytest.mark.usefixtures("file_response_cache")
+@pytest.mark.django_db(transaction=True)
+def test_duplicates_wait_for_the_first_across_processes() -> None:
+    view = IdempotentAPIView()
+    view.setup(
+        RequestFactory().post(
+            "/", data=json.dumps("data"), content_type="application/json"
+        )
+    )
+    view.request.user = AnonymousUser()
+    key = view.get_idempotency_key("key")
+    digest = hashlib.sha256(view.request.body).hexdigest()
+    # This process runs the first request, while another one gets a duplicate.
+    with advisory_lock(key) as locked:
+        assert locked
+        pid = os.fork()
+        if pid == 0:  # pragma: no cover
+            response = post_with_key("data")
+            os._exit(0 if response.data == {"call": "first"} else 1)
+        time.sleep(0.2)
+        view.store_response(
+            JsonResponse({"call": "first"}, status=HTTPStatus.CREATED), key, digest
+        )
+    _, status = os.waitpid(pid, 0)
+
+    assert os.waitstatus_to_exitcode(status) == 0
+    assert IdempotentAPIView.calls == []
+
+
+@override_settings(IDEMPOTENCY_LOCK_TIMEOUT=0)
+@pytest.mark.django_db(transaction=True)
+def test_duplicates_give_up_after_the_lock_timeout() -> None:
+    view = IdempotentAPIView()
+    view.setup(RequestFactory().post("/"))
+    view.request.user = AnonymousUser()
+    locked = threading.Event()
+    done = threading.Event()
+
+    def hold_lock() -> None:
+        # Another worker is running the first request.
+        try:
+            with advisory_lock(view.get_idempotency_key("key")) as taken:
+                if taken:
+                    locked.set()
+                    done.wait(timeout=5)
+        finally:
+            connections.close_all()
+
+    holder = threading.Thread(target=hold_lock)
+    holder.start()
+    try:
+        assert locked.wait(timeout=5)
+        response = post_with_key("data")
+    finally:
+        done.set()
+        holder.join()
+
+    assert response.status_code == HTTPStatus.CONFLICT
+    assert IdempotentAPIView.calls == []
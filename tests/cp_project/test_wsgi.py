@@ -1,5 +1,25 @@
+import pytest
+from django.core.signals import request_started
+from django.test import override_settings
+
+from cp_project.lib.invalidation import listeners
 from cp_project.wsgi import application
 
 
 def test_application() -> None:
     assert application is not None
+
+
+@override_settings(CACHE_INVALIDATION_BUS=True)
+@pytest.mark.django_db(transaction=True)
+def test_listener_starts_on_the_first_request() -> None:
+    # A preloading master loads the app, but never serves a request.
+    assert not listeners
+
+    request_started.send(sender=None)
+    try:
+        assert len(listeners) == 1
+        assert listeners[0].listening.wait(5)
+    finally:
+        listeners[0].stop()
+        listeners.clear()
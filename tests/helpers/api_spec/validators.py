@@ -36,6 +36,14 @@ class Validator:
             raise ValidationError(error_message)
 
 
+class AnyValidator(Validator):
+    def __init__(self) -> None:
+        self.spec = None
+
+    def _validate(self, _json_response: JSONType) -> str:
+        return ""
+
+
 class NoneValidator(Validator):
     def __init__(self) -> None:
         self.spec = None
@@ -207,6 +215,8 @@ class DictValidator(Validator):
 def get_validator(specs: JSONType) -> Validator:
     if not isinstance(specs, dict):
         raise ConfigurationError(specs)
+    if specs["$type"] == "any":
+        return AnyValidator()
     if specs["$type"] == "null":
         return NoneValidator()
     if specs["$type"] == "bool":
@@ -246,7 +256,7 @@ def get_validator(specs: JSONType) -> Validator:
             raise ConfigurationError(specs)
         return StringValidator(regex=regex)
     if specs["$type"] == "list":
-        return get_validator(specs["$items"])
+        return ListValidator(get_validator(specs["$items"]))
     if specs["$type"] == "dict":
         optional: dict[str, Validator] = {}
         required: dict[str, Validator] = {}
@@ -0,0 +1,88 @@
+from __future__ import annotations
+
+import socketserver
+import threading
+import time
+from typing import TYPE_CHECKING, Self
+
+if TYPE_CHECKING:
+    from types import TracebackType
+
+
+class _SMTPHandler(socketserver.StreamRequestHandler):
+    server: _SMTPServer
+
+    def reply(self, line: str) -> None:
+        self.wfile.write(f"{line}\r\n".encode())
+
+    def handle(self) -> None:
+        self.server.connections += 1
+        self.reply("220 stand-in ESMTP")
+        while line := self.rfile.readline():
+            command = line.decode().strip().split(" ", 1)[0].upper()
+            if command == "EHLO":
+                self.reply("250-stand-in")
+                self.reply("250 SIZE")
+            elif command in {"HELO", "RSET", "NOOP"}:
+                self.reply("250 OK")
+            elif command == "RCPT":
+                address = line.decode().partition("<")[2].partition(">")[0]
+                refused = address in self.server.refused
+                self.reply("550 No such user" if refused else "250 OK")
+            elif command == "MAIL":
+                self.server.envelopes.append(line.decode().strip())
+                self.reply("451 Try again later" if self.server.fail else "250 OK")
+            elif command == "DATA":
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                self.server.messages.append(self.read_data())
+                time.sleep(self.server.delay)
+                self.reply("250 OK")
+            elif command == "QUIT":
+                self.reply("221 Bye")
+                return
+            else:
+                self.reply("502 Command not implemented")
+
+    def read_data(self) -> bytes:
+        lines = []
+        while (line := self.rfile.readline()) not in {b".\r\n", b""}:
+            lines.append(line.removeprefix(b"."))
+        return b"".join(lines)
+
+
+class _SMTPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self) -> None:
+        super().__init__(("localhost", 0), _SMTPHandler)
+        self.connections = 0
+        self.messages: list[bytes] = []
+        self.delay = 0.0
+        self.fail = False
+        self.refused: set[str] = set()
+        self.envelopes: list[str] = []
+
+
+class SMTPStandIn:
+    """A local SMTP relay that can be made slow, failing or refusing."""
+
+    def __init__(self) -> None:
+        self.server = _SMTPServer()
+        self.host = "localhost"
+        self.port: int = self.server.socket.getsockname()[1]
+        self._thread = threading.Thread(target=self.server.serve_forever)
+
+    def __enter__(self) -> Self:
+        self._thread.start()
+        return self
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc_value: BaseException | None,
+        exc_tb: TracebackType | None,
+    ) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+        self._thread.join()